@@ -1,96 +1,269 @@
 import base64
+import hashlib
 import time
-from flask import Flask, render_template, request, jsonify, url_for
+import math
+from flask import Flask, render_template, request, jsonify, url_for, Response, stream_with_context, send_from_directory, g
 import os
 from flask_sqlalchemy import SQLAlchemy
 import json
-from models import db, Collage, Leaderboard, Feedback
+import click
+from dotenv import load_dotenv
+load_dotenv()  # 讀取 .env 檔案；要在 import 下列模組與讀取設定之前載入（GEMINI_*、DATABASE_URL 等）
+from models import (db, Collage, Feedback, CollageJob, upgrade_tables, migrate_collage_layouts, sync_public_files,
+                    is_public_file)
 
-from collage_util_api import generate_collage_info_from_request
-import random
-import glob
+from collage_util_api import (read_collage_request, generate_collage_info, variant_cache, segmenter, retention,
+                              mask_cache, file_writer, get_mask, get_client, ensure_dir, load_font, scheduler,
+                              track_atlas)
+from collage_jobs import CollageJobQueue, QueueFullError
+from collage_renderer import CollageRenderer, BASE_CANVAS, MAX_RENDER_SIZE
+from atlas import build_atlas, atlas_file, ATLAS_DIR
+from detail_cache import create_detail_cache
+from leaderboard import get_top, submit_scores, DEFAULT_NAME
+from storage import configure_database, enable_sqlite_pragmas, WriteBatcher
+from ingest import UploadTooLargeError, MAX_UPLOAD_BYTES
+from carousel import CarouselIndex, read_data_url_field, save_carousel_image, spooled_buffer
+from werkzeug.exceptions import RequestEntityTooLarge
+from sqlalchemy.exc import IntegrityError
+from batch import (run_batch, check_batch_shape, BATCH_SHAPES, DEFAULT_CPU_WORKERS, DEFAULT_MODEL_WORKERS,
+                   DEFAULT_COMMIT_EVERY)
+from metrics import metrics
+from layout_codec import encode_layout, layout_to_b64, COMPACT_MIMETYPE, LAYOUT_PACKED, LAYOUT_FIELDS
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///photos.db'
+app.config['DATABASE_URL'] = os.getenv('DATABASE_URL')  # 未設定時使用 SQLite（instance/photos.db）
+app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 8))
+app.config['DB_WRITE_BATCHING'] = os.getenv('DB_WRITE_BATCHING', '1') != '0'  # 排行榜/回饋改用批次寫入
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['RETENTION_INTERVAL'] = int(os.getenv('RETENTION_INTERVAL', 300))  # 清理舊圖片的間隔秒數
+app.config['MAX_CONTENT_LENGTH'] = 3 * MAX_UPLOAD_BYTES  # 主圖 + 遮罩 + 手繪形狀
 app.config['UPLOAD_FOLDER'] = os.path.join(os.getcwd(), 'static', 'uploads')
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+app.config['COLLAGE_JOB_WORKERS'] = 2         # 同時執行的拼貼生成工作數
+app.config['COLLAGE_JOB_MAX_PENDING'] = 8     # 排隊中的工作上限，超過回 429
+app.config['SERVER_TIMING'] = os.getenv('SERVER_TIMING') == '1'  # 回應附上 Server-Timing 標頭（各階段耗時）
+app.config['WARMUP'] = os.getenv('WARMUP') == '1'  # create_app() 時先預熱字型、遮罩、資料庫連線
+configure_database(app)
 db.init_app(app)
+enable_sqlite_pragmas(app)
+job_queue = CollageJobQueue(app)
+renderer = CollageRenderer(app.root_path)
+# 拼貼詳細資料快取；多個 worker 時設定 DETAIL_CACHE_URL=redis://... 共用
+detail_cache = create_detail_cache(os.getenv('DETAIL_CACHE_URL'), max_entries=500, ttl=60)
+# 首頁輪播圖片清單（快取在記憶體，資料夾有變動才重新列目錄）
+carousel_index = CarouselIndex()
+CAROUSEL_SAMPLE = 8
+
+
+def _flush_feedback(_, rows):
+    feedbacks = [Feedback(**row) for row in rows]
+    db.session.add_all(feedbacks)
+    db.session.commit()
+    return [feedback.id for feedback in feedbacks]
+
+
+# 同一拼貼同時送出的成績合併成一次 submit_scores，每個請求仍拿到寫入後的排行榜
+leaderboard_writer = WriteBatcher(app, submit_scores, max_batch=200, max_delay=0.02, name='leaderboard-writer')
+# 回饋合併成一次 commit，每個請求等自己那筆寫入後拿到 feedback_id
+feedback_writer = WriteBatcher(app, _flush_feedback, max_batch=200, max_delay=0.05, name='feedback-writer',
+                               per_item=True)
+
+metrics.describe('stage_seconds', '拼貼生成各階段耗時（秒）')
+metrics.describe('gemini_attempt_seconds', '每次 generate_content 請求耗時（秒）')
+metrics.describe('gemini_attempts_total', 'generate_content 請求次數（success / failure / empty / timeout）')
+metrics.describe('gemini_queue_wait_seconds', '模型呼叫在全域排程中排隊的時間（秒）')
+metrics.describe('http_request_seconds', 'HTTP 請求處理時間（秒，不含串流回應的傳送）')
+for _name, _source in [('variant_cache', variant_cache.stats), ('retention', retention.stats),
+                       ('detail_cache', detail_cache.stats), ('mask_cache', mask_cache.stats),
+                       ('file_writer', file_writer.stats), ('gemini_scheduler', scheduler.stats),
+                       ('leaderboard_writer', leaderboard_writer.stats),
+                       ('feedback_writer', feedback_writer.stats)]:
+    metrics.register_stats(_name, _source)
+
+@app.before_request
+def start_request_metrics():
+    if metrics.enabled:
+        g.metrics_started = time.perf_counter()
+        if app.config['SERVER_TIMING']:
+            g.metrics_token = metrics.start_request()
+
+@app.after_request
+def finish_request_metrics(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        stages = metrics.finish_request(token)
+        response.headers['Server-Timing'] = ', '.join(filter(None, [stages, f'total;dur={elapsed * 1000:.1f}']))
+    endpoint = request.endpoint or 'unknown'
+    metrics.observe('http_request_seconds', elapsed, endpoint=endpoint)
+    metrics.inc('http_requests_total', endpoint=endpoint, status=response.status_code)
+    if request.content_length:
+        metrics.inc('http_request_bytes_total', request.content_length, endpoint=endpoint)
+    if response.content_length:
+        metrics.inc('http_response_bytes_total', response.content_length, endpoint=endpoint)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 文字格式的計時與計數"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """超過 MAX_CONTENT_LENGTH 時 Werkzeug 會在讀取 body 前中止"""
+    return jsonify({'error': f"上傳內容超過 {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)}MB 上限"}), 413
 
 @app.route('/')
 def index():
-    # ✅ 從 carousel 資料夾隨機選取8張圖片
-    carousel_folder = os.path.join('static', 'carousel')
-    
-    # 確保資料夾存在
-    if not os.path.exists(carousel_folder):
-        os.makedirs(carousel_folder, exist_ok=True)
-    
-    # 取得所有圖片檔案
-    image_extensions = ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp']
-    all_images = []
-    for ext in image_extensions:
-        all_images.extend(glob.glob(os.path.join(carousel_folder, ext)))
-    
-    # 隨機選取8張 (如果不足8張就全部顯示)
-    max_images = 8
-    if len(all_images) >= max_images:
-        selected_images = random.sample(all_images, max_images)
-    else:
-        selected_images = all_images
-    
-    # 轉換為相對路徑供前端使用
-    image_urls = []
-    for img_path in selected_images:
-        # 將 static\carousel\image.png 轉為 /static/carousel/image.png
-        relative_path = img_path.replace('\\', '/').replace('static/', '/static/')
-        image_urls.append(relative_path)
-    
+    # ✅ 從 carousel 索引隨機選取8張圖片（不足8張就全部顯示）
+    image_urls = [f"/static/carousel/{name}" for name in carousel_index.sample(CAROUSEL_SAMPLE)]
     return render_template('integrated.html', image_urls=image_urls)
 
 
 # 整合頁面路由
 @app.route('/integrated')
 def integrated():
-    # 取得 static/carousel 資料夾所有圖片檔名
-    carousel_folder = os.path.join(app.static_folder, 'carousel')
-    image_files = [
-        f for f in os.listdir(carousel_folder)
-        if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif'))
-    ]
-    # 產生可用於 <img src=""> 的網址
-    image_urls = [url_for('static', filename=f'carousel/{fname}') for fname in image_files]
+    # 圖片可能有上萬張，和首頁一樣只抽樣
+    image_urls = [url_for('static', filename=f'carousel/{name}') for name in carousel_index.sample(CAROUSEL_SAMPLE)]
     return render_template('integrated.html', image_urls=image_urls)
 
-@app.route('/generate_collage', methods=['POST'])
-def generate_collage():
-    try:
-        result = generate_collage_info_from_request(request, app.config['UPLOAD_FOLDER'], max_upload_files=100)
-        
-        now_ts = time.time()
-        collage_id = f"{int(now_ts)}"
-        target_img_path = result["images"][0]["img_path"]
+def _is_public_file(filename):
+    """保留策略刪檔前呼叫：檔案是否仍被公開拼貼使用（PublicFile 主鍵查詢）"""
+    with app.app_context():
+        try:
+            return is_public_file(filename)
+        finally:
+            db.session.remove()
 
+COLLAGE_ID_ATTEMPTS = 20
+
+def _run_collage_job(params, report):
+    """在背景 worker 中執行：產生拼貼資訊並寫入資料庫，回傳 collage_id"""
+    def on_progress(stage, data):
+        if stage == "upload_saved":
+            report(stage, data, progress=5)
+        elif stage == "image_generated":
+            report(stage, data, progress=5 + data["count"] * 8)   # 10 張 AI 圖片 → 85%
+        elif stage == "layout_done":
+            report(stage, data, progress=90)
+
+    result = generate_collage_info(params, app.config['UPLOAD_FOLDER'], on_progress=on_progress)
+
+    now_ts = time.time()
+    collage_id = f"{int(now_ts)}"
+    target_img_path = result["images"][0].get("full_path", result["images"][0]["img_path"])
+
+    # 多個 worker（或其他程序）可能在同一秒完成：先跳過已使用的 ID，
+    # 檢查與寫入之間仍可能被搶先，commit 遇到主鍵衝突時換下一個 ID 重試
+    for _ in range(COLLAGE_ID_ATTEMPTS):
+        while db.session.get(Collage, collage_id) is not None:
+            collage_id = str(int(collage_id) + 1)
         collage = Collage(
             id=collage_id,
             preview_src=target_img_path,
-            info_json=json.dumps(result, ensure_ascii=False),
             is_public=False,  # ✅ 預設為不公開
             created_at=now_ts,
             updated_at=now_ts
         )
+        collage.set_info(result)
         db.session.add(collage)
-        db.session.commit()
-        
+        try:
+            with metrics.timer('stage_seconds', stage='db_commit'):
+                db.session.commit()
+            return collage_id
+        except IntegrityError:
+            db.session.rollback()
+            collage_id = str(int(collage_id) + 1)
+    raise RuntimeError('無法配置拼貼 ID，請稍後再試')
+
+@app.route('/generate_collage', methods=['POST'])
+def generate_collage():
+    """收下上傳檔案後立即回傳 job_id，實際生成在背景執行"""
+    try:
+        with metrics.timer('stage_seconds', stage='upload_read'):
+            params = read_collage_request(request)
+        job_id = job_queue.submit(_run_collage_job, params)
         return jsonify({
             "success": True,
-            "collage_id": collage_id,
-            "image_info": result["image_info"],
-            "images": result["images"]
-        })
+            "job_id": job_id,
+            "status_url": url_for('get_job_status', job_id=job_id),
+            "events_url": url_for('stream_job_events', job_id=job_id)
+        }), 202
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '10'}
+    except UploadTooLargeError as e:
+        return jsonify({'error': str(e)}), 413
+    except RequestEntityTooLarge:
+        raise  # 交給 413 errorhandler
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """查詢生成工作狀態；完成時一併回傳拼貼內容（格式同舊版 /generate_collage）"""
+    job = db.session.get(CollageJob, job_id)
+    if not job:
+        return jsonify({'error': '工作不存在'}), 404
+
+    data = job.to_dict()
+    if job.status == 'done' and job.collage_id:
+        collage = db.session.get(Collage, job.collage_id)
+        if collage:
+            result = collage.get_info()
+            data.update({
+                "success": True,
+                "image_info": result["image_info"],
+                "images": result["images"],
+                "atlas": result.get("atlas")
+            })
+    return jsonify(data)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """以 SSE 推送工作進度，每張 AI 圖片完成時推一次 image_generated"""
+    return Response(
+        stream_with_context(job_queue.stream(job_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/variant_cache/stats', methods=['GET'])
+def get_variant_cache_stats():
+    """AI 變體快取的命中統計"""
+    return jsonify(variant_cache.stats())
+
+@app.route('/segmentation/stats', methods=['GET'])
+def get_segmentation_stats():
+    """剪影模型的載入/推論耗時與快取統計"""
+    return jsonify(segmenter.stats())
+
+@app.route('/gemini_scheduler/stats', methods=['GET'])
+def get_gemini_scheduler_stats():
+    """Gemini 全域排程：排隊數、等待時間、目前速率與限流次數"""
+    return jsonify(scheduler.stats())
+
+@app.route('/retention/stats', methods=['GET'])
+def get_retention_stats():
+    """上傳/生成圖片保留策略的統計"""
+    return jsonify(retention.stats())
+
+@app.route('/detail_cache/stats', methods=['GET'])
+def get_detail_cache_stats():
+    """拼貼詳細資料快取的命中統計"""
+    return jsonify(detail_cache.stats())
+
+@app.route('/db/stats', methods=['GET'])
+def get_db_stats():
+    """連線池與批次寫入的統計"""
+    return jsonify({
+        'dialect': db.engine.dialect.name,
+        'pool': db.engine.pool.status(),
+        'leaderboard_writer': leaderboard_writer.stats(),
+        'feedback_writer': feedback_writer.stats()
+    })
+
 # ✅ 新增：設定作品公開狀態的路由
 @app.route('/collage/<collage_id>/set_public', methods=['POST'])
 def set_collage_public(collage_id):
@@ -105,7 +278,11 @@ def set_collage_public(collage_id):
         
         collage.is_public = is_public
         collage.updated_at = time.time()
+        sync_public_files(collage)
         db.session.commit()
+        detail_cache.invalidate(collage_id)
+        if not is_public:
+            retention.track_names(collage.file_names())   # 不再受保護，交回保留策略管理
         
         return jsonify({
             'success': True,
@@ -118,24 +295,65 @@ def set_collage_public(collage_id):
         print(f"設定公開狀態失敗: {e}")
         return jsonify({'error': str(e)}), 500
 
+GALLERY_PAGE_SIZE = 30      # 畫廊每頁預設筆數
+GALLERY_MAX_PAGE_SIZE = 100
+
+def _encode_gallery_cursor(updated_at, collage_id):
+    raw = json.dumps([updated_at, collage_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _decode_gallery_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    updated_at, collage_id = json.loads(raw)
+    return float(updated_at), str(collage_id)
+
 # 修改 get_gallery - 只顯示公開作品
 @app.route('/gallery', methods=['GET'])
 def get_gallery():
-    """返回所有已公開的拼貼作品列表"""
+    """分頁返回已公開的拼貼作品（依 updated_at, id 由新到舊的 keyset 分頁）
+
+    參數：limit（每頁筆數）、cursor（上一頁回傳的 next_cursor）
+    """
     try:
-        # ✅ 只查詢公開作品
-        collages = Collage.query.filter_by(is_public=True).order_by(Collage.updated_at.desc()).all()
+        limit = request.args.get('limit', GALLERY_PAGE_SIZE, type=int) or GALLERY_PAGE_SIZE
+        limit = max(1, min(limit, GALLERY_MAX_PAGE_SIZE))
+        cursor = request.args.get('cursor')
+
+        # ✅ 只查詢公開作品，且只讀列表需要的欄位
+        query = (db.session.query(Collage.id, Collage.preview_src, Collage.updated_at)
+                    .filter(Collage.is_public == True))
+        if cursor:
+            try:
+                cursor_updated_at, cursor_id = _decode_gallery_cursor(cursor)
+            except Exception:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            query = query.filter(db.or_(
+                Collage.updated_at < cursor_updated_at,
+                db.and_(Collage.updated_at == cursor_updated_at, Collage.id < cursor_id)
+            ))
+        rows = query.order_by(Collage.updated_at.desc(), Collage.id.desc()).limit(limit + 1).all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
         gallery_items = []
-        for collage in collages:
+        for row in rows:
             gallery_items.append({
-                'id': collage.id,
-                'preview_src': collage.preview_src,
-                'updated_at': collage.updated_at,
-                'name': collage.id,
-                'timestamp': collage.id
+                'id': row.id,
+                'preview_src': row.preview_src,
+                'updated_at': row.updated_at,
+                'name': row.id,
+                'timestamp': row.id
             })
-        
-        return jsonify({'items': gallery_items})
+        next_cursor = _encode_gallery_cursor(rows[-1].updated_at, rows[-1].id) if has_more else None
+
+        response = jsonify({'items': gallery_items, 'next_cursor': next_cursor})
+        # 內容沒變時讓瀏覽器拿到 304
+        signature = json.dumps([cursor, limit, next_cursor, [(r.id, r.updated_at, r.preview_src) for r in rows]])
+        response.set_etag(hashlib.sha1(signature.encode()).hexdigest())
+        if rows:
+            response.last_modified = max(r.updated_at for r in rows)
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
         
     except Exception as e:
         print(f"Database gallery query failed: {e}")
@@ -145,81 +363,168 @@ def get_gallery():
 @app.route('/collage/<info_id>', methods=['GET'])
 def get_collage_detail(info_id):
     try:
+        # ---- 內容協商：要求精簡格式時，image_info 直接送出壓縮後的二進位（base64）----
+        wants_compact = request.accept_mimetypes.best_match(['application/json', COMPACT_MIMETYPE]) == COMPACT_MIMETYPE
+        variant = 'compact' if wants_compact else 'json'
+
+        # ---- 熱門拼貼直接回傳快取的回應內容 ----
+        cached = detail_cache.get(info_id, variant)
+        if cached is not None:
+            response = Response(cached, mimetype=COMPACT_MIMETYPE if wants_compact else 'application/json')
+            response.vary.add('Accept')
+            return response
+
         collage = Collage.query.filter_by(id=info_id).first()
         if not collage or not collage.info_json:
             return jsonify({"error": "Collage not found"}), 404
 
+        packed = collage.layout_version == LAYOUT_PACKED and collage.layout_blob is not None
+
         # ---- 解析 info_json ----
-        try:
-            raw = json.loads(collage.info_json)
-        except Exception:
-            raw = {}
+        raw = collage.get_info(decode_layout_blob=not (wants_compact and packed))
+
+        # ---- 舊資料沒有圖集（或圖集已被保留策略淘汰）時補建一次 ----
+        if raw.get("images") and not (raw.get("atlas") and os.path.isfile(atlas_file(raw))):
+            try:
+                full = raw if "image_info" in raw else collage.get_info()
+                build_atlas(full)
+                track_atlas(full)
+                collage.set_info(full)
+                db.session.commit()
+                raw["images"], raw["atlas"] = full["images"], full["atlas"]
+            except Exception as atlas_err:
+                db.session.rollback()
+                print(f"補建圖集失敗: {atlas_err}")
 
         # ---- 解包核心資料 ----
-        image_info = raw.get("image_info", [])
         images = raw.get("images", [])
+        atlas = raw.get("atlas")
+        if wants_compact:
+            blob = collage.layout_blob if packed else encode_layout(raw.get("image_info", []))
+            layout = {"version": LAYOUT_PACKED, "fields": list(LAYOUT_FIELDS), "data": layout_to_b64(blob)}
+        else:
+            image_info = raw.get("image_info", [])
 
         # ---- 載入排行榜 ----
         try:
-            scores = (Leaderboard.query
-                        .filter_by(collage_id=info_id)
-                        .order_by(Leaderboard.time.asc())
-                        .limit(10)
-                        .all())
-            leaderboard = [{"name": s.name, "time": s.time} for s in scores]
+            leaderboard = get_top(info_id)
         except Exception:
             leaderboard = []
 
         # ---- 直接回傳前端需要的乾淨格式 ----
-        return jsonify({
-            "image_info": image_info,   # 324 個位置
+        payload = {
             "images": images,           # 13 張圖片（包含 target）
+            "atlas": atlas,             # 圖集（images[i].uv 為各圖在圖集中的位置）
             "leaderboard": leaderboard
-        })
+        }
+        if wants_compact:
+            payload["layout"] = layout  # 精簡格式，見 layout_codec
+            response = jsonify(payload)
+            response.mimetype = COMPACT_MIMETYPE
+        else:
+            payload["image_info"] = image_info  # 324 個位置
+            response = jsonify(payload)
+        response.vary.add('Accept')
+        detail_cache.set(info_id, variant, response.get_data())
+        return response
 
     except Exception as e:
         print("ERROR in get_collage_detail:", e)
         return jsonify({"error": "Server error"}), 500
 
 
+@app.route('/collage/<collage_id>/render', methods=['GET'])
+def render_collage(collage_id):
+    """在伺服器端合成拼貼 PNG，邊畫邊串流輸出；size 為輸出邊長（預設 600，最大 8000）"""
+    collage = db.session.get(Collage, collage_id)
+    if not collage or not collage.info_json:
+        return jsonify({"error": "Collage not found"}), 404
+
+    size = request.args.get('size', BASE_CANVAS, type=int)
+    if size is None or not (1 <= size <= MAX_RENDER_SIZE):
+        return jsonify({"error": f"size 需介於 1 到 {MAX_RENDER_SIZE}"}), 400
+
+    info = collage.get_info()
+    return Response(
+        renderer.iter_png(info, size=size, seed=collage_id),
+        mimetype='image/png',
+        headers={'Cache-Control': 'public, max-age=86400'}
+    )
+
+
+@app.route('/atlas/<name>', methods=['GET'])
+def get_atlas(name):
+    """圖集檔名為內容雜湊，內容不會變，給一年的快取"""
+    response = send_from_directory(os.path.join(os.getcwd(), ATLAS_DIR), name, max_age=31536000)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
 # 排行榜相關路由
 @app.route('/collage/<collage_id>/leaderboard', methods=['GET'])
 def get_leaderboard(collage_id):
     """獲取指定拼貼的排行榜"""
     try:
         # 按時間排序，最快的在前面
-        scores = Leaderboard.query.filter_by(collage_id=collage_id).order_by(Leaderboard.time.asc()).limit(10).all()
-        return jsonify({'leaderboard': [{'name': score.name, 'time': score.time} for score in scores]})
+        return jsonify({'leaderboard': get_top(collage_id)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def parse_score_time(value):
+    """成績時間轉成正的有限浮點數；缺少或格式錯誤回傳 None（在送進批次寫入前就擋下）"""
+    if isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) and value >= 0 else None
+
 @app.route('/collage/<info_id>/leaderboard', methods=['POST'])
 def save_leaderboard(info_id):
     """提交遊戲成績到排行榜並返回完整排行榜"""
     try:
         data = request.get_json()
-        time_used = data.get('time')
-        name = data.get('name', '匿名玩家')  # 預設為匿名玩家
+        time_used = parse_score_time(data.get('time'))
+        name = data.get('name', DEFAULT_NAME)  # 預設為匿名玩家
         
         if time_used is None:
-            return jsonify({'error': 'Missing time'}), 400
+            return jsonify({'error': 'Invalid time'}), 400
         
-        # 創建新的排行榜記錄
-        score = Leaderboard(
-            collage_id=info_id,
-            name=name,
-            time=float(time_used)
-        )
+        # 寫入成績，只有擠進前 10 名時才更新排行榜
+        score = {'name': name, 'time': time_used}
+        if app.config['DB_WRITE_BATCHING']:
+            leaderboard, changed = leaderboard_writer.submit(info_id, score).result(timeout=15)
+        else:
+            leaderboard, changed = submit_scores(info_id, [score])
+        if changed:
+            detail_cache.invalidate(info_id)
         
-        db.session.add(score)
-        db.session.commit()
+        return jsonify({'leaderboard': leaderboard})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/collage/<info_id>/leaderboard/batch', methods=['POST'])
+def save_leaderboard_batch(info_id):
+    """一次提交多筆成績：{"scores": [{"name": ..., "time": ...}, ...]}"""
+    try:
+        data = request.get_json()
+        scores = data.get('scores') or []
+        if not scores or not all(isinstance(s, dict) for s in scores):
+            return jsonify({'error': 'Missing scores'}), 400
+        scores = [{**s, 'time': parse_score_time(s.get('time'))} for s in scores]
+        if any(s['time'] is None for s in scores):
+            return jsonify({'error': 'Invalid time'}), 400
         
-        # 返回前10名排行榜
-        scores = Leaderboard.query.filter_by(collage_id=info_id).order_by(Leaderboard.time.asc()).limit(10).all()
-        leaderboard = [{'name': score.name, 'time': score.time} for score in scores]
+        leaderboard, changed = submit_scores(info_id, scores)
+        if changed:
+            detail_cache.invalidate(info_id)
         
-        return jsonify({'leaderboard': leaderboard})
+        return jsonify({'leaderboard': leaderboard, 'submitted': len(scores)})
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 # 新增回饋表單路由
@@ -229,22 +534,27 @@ def submit_feedback():
     try:
         data = request.get_json()
         
-        # 創建回饋記錄
-        feedback = Feedback(
-            type=data['feedbackType'],
-            subject=data['feedbackSubject'],
-            message=data['feedbackMessage']
-        )
+        row = {
+            'type': data['feedbackType'],
+            'subject': data['feedbackSubject'],
+            'message': data['feedbackMessage']
+        }
         
-        db.session.add(feedback)
-        db.session.commit()
+        if app.config['DB_WRITE_BATCHING']:
+            feedback_id = feedback_writer.submit('feedback', row).result(timeout=15)
+        else:
+            # 創建回饋記錄
+            feedback = Feedback(**row)
+            db.session.add(feedback)
+            db.session.commit()
+            feedback_id = feedback.id
         
         # TODO: 可以在這裡發送郵件通知
         
         return jsonify({
             'message': '回饋送出成功！感謝您的寶貴意見。',
             'status': 'success',
-            'feedback_id': feedback.id  # 回傳新建立的回饋 ID
+            'feedback_id': feedback_id  # 回傳新建立的回饋 ID
         })
         
     except Exception as e:
@@ -255,36 +565,124 @@ def submit_feedback():
 @app.route('/save_to_carousel', methods=['POST'])
 def save_to_carousel():
     try:
-        data = request.get_json()
-        image_data = data['image_data']
-        timestamp = data['timestamp']
-        
-        # 移除 data URL 前綴
-        image_data = image_data.split(',')[1]
-        
-        # 解碼 base64
-        image_bytes = base64.b64decode(image_data)
-        
-        # 生成檔名
-        filename = f"collage_{timestamp}.png"
-        filepath = os.path.join('static', 'carousel', filename)
-        
-        # 確保目錄存在
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        
-        # 保存檔案
-        with open(filepath, 'wb') as f:
-            f.write(image_bytes)
+        # 串流解碼 {"image_data": "data:image/png;base64,...", "timestamp": ...}
+        with spooled_buffer() as image_file:
+            data = read_data_url_field(request.stream, 'image_data', image_file)
+            image_file.seek(0)
+            filename = save_carousel_image(image_file, data['timestamp'], carousel_index.folder)
+        carousel_index.add(filename)
         
         return jsonify({'success': True, 'filename': filename})
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-if __name__ == '__main__':
+@app.cli.command('migrate-layouts')
+def migrate_layouts_command():
+    """把舊的 JSON image_info 轉成精簡格式：flask --app app migrate-layouts"""
+    upgrade_tables()
+    converted = migrate_collage_layouts()
+    print(f"已轉換 {converted} 筆拼貼排版")
+
+@app.cli.command('batch-collages')
+@click.argument('photo_dir', type=click.Path(exists=True, file_okay=False))
+@click.option('--shape', default='rectangle', help=' / '.join(BATCH_SHAPES))
+@click.option('--text', 'text_input', default=None, help='shape=text_mask 時的文字')
+@click.option('--layout', 'strategy', default=None, help='排版策略（grid / poisson / distance）')
+@click.option('--seed', type=int, default=None, help='固定排版種子，第 i 張照片使用 seed + i')
+@click.option('--public/--private', default=False, help='產生的拼貼是否公開')
+@click.option('--cpu-workers', type=int, default=DEFAULT_CPU_WORKERS)
+@click.option('--model-workers', type=int, default=DEFAULT_MODEL_WORKERS)
+@click.option('--commit-every', type=int, default=DEFAULT_COMMIT_EVERY)
+@click.option('--limit', type=int, default=None, help='最多處理幾張（試跑用）')
+@click.option('--fake', is_flag=True, help='使用離線的假模型（fake_genai），不呼叫 Gemini')
+def batch_collages_command(photo_dir, shape, text_input, strategy, seed, public, cpu_workers, model_workers,
+                           commit_every, limit, fake):
+    """對資料夾內所有照片批次產生拼貼：flask --app app batch-collages photos/ --shape heart --public"""
+    try:
+        check_batch_shape(shape, text_input)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    db.create_all()
+    upgrade_tables()
+    gen_client = None
+    if fake:
+        from fake_genai import FakeClient
+        gen_client = FakeClient(latency=1.0)
+    run_batch(app, photo_dir, shape=shape, text_input=text_input, strategy=strategy, seed=seed,
+              is_public=public, cpu_workers=cpu_workers, model_workers=model_workers,
+              commit_every=commit_every, limit=limit, gen_client=gen_client)
+
+WARMUP_SHAPES = ("circle", "star", "heart")
+WARMUP_CANVAS = (600, 600)
+_started = False
+
+def warm_up():
+    """預先載入字型、常用形狀遮罩、資料庫連線與模型 client，讓第一個請求不必等待；回傳各項耗時（秒）"""
+    from PIL import Image
+
+    timings = {}
+    canvas = Image.new("RGBA", WARMUP_CANVAS)
+
+    start = time.perf_counter()
+    load_font(WARMUP_CANVAS[0] // 2)
+    get_mask(canvas, "text_mask", text_input="拼貼", as_array=True)
+    timings['fonts'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for shape in WARMUP_SHAPES:
+        get_mask(canvas, shape, as_array=True)
+    timings['masks'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with app.app_context():
+        db.session.execute(db.text('SELECT 1'))
+        db.session.query(Collage.id).filter(Collage.is_public == True).order_by(Collage.updated_at.desc()).limit(1).all()
+        db.session.remove()
+    timings['database'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        get_client()
+        from google.genai import types  # noqa: F401  第一次送出請求時會用到
+    except Exception as e:
+        print(f"模型 client 預熱略過：{e}")
+    timings['model_client'] = time.perf_counter() - start
+
+    print("🔥 預熱完成：" + "，".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in timings.items()))
+    return timings
+
+def create_app(warmup=None):
+    """啟動入口（python app.py、flask --app 'app:create_app()' run 或 gunicorn 'app:create_app()'）：建立資料表、處理中斷的工作、啟動保留策略排程
+
+    只 import app 不會連線資料庫、建立模型 client 或啟動背景排程與寫入執行緒，測試與 CLI 可以直接使用 app。
+    warmup 為 None 時依 WARMUP 設定決定是否先預熱再接受請求。重複呼叫只會啟動一次。
+    """
+    global _started
+    if _started:
+        return app
+    start = time.perf_counter()
+    ensure_dir(app.config['UPLOAD_FOLDER'])
     with app.app_context():
         db.create_all()
-    app.run(debug=True)
+        upgrade_tables()
+        job_queue.recover_interrupted()
+    if os.getenv('PRELOAD_SEGMENTATION'):
+        segmenter.load()  # 預先載入剪影模型，避免第一個剪影請求等待
+    retention.is_protected = _is_public_file
+    retention.start(interval=app.config['RETENTION_INTERVAL'])
+    if app.config['DB_WRITE_BATCHING']:
+        leaderboard_writer.start()
+        feedback_writer.start()
+    if app.config['WARMUP'] if warmup is None else warmup:
+        warm_up()
+    _started = True
+    print(f"🚀 啟動完成，用時 {time.perf_counter() - start:.2f} 秒")
+    return app
+
+if __name__ == '__main__':
+    create_app()
+    app.run(debug=os.getenv('FLASK_DEBUG', '1') == '1')
     
     
     
@@ -0,0 +1,69 @@
+"""拼貼圖集（sprite sheet）：把一個拼貼用到的縮小圖片打包成一張圖，瀏覽頁/遊戲頁只需下載一次
+
+每張圖片在圖集中的位置寫回 images[i]["uv"]，格式為圖集像素座標 {"x", "y", "w", "h"}；
+圖集本身記在 info["atlas"] = {"src", "width", "height"}。
+檔名使用內容雜湊，內容不會改變，可以給很長的快取時間。
+"""
+import hashlib
+import io
+import math
+import os
+
+from PIL import Image
+
+from derivatives import pick_thumb_size, THUMB_FORMAT, THUMB_EXT, THUMB_OPTIONS
+
+ATLAS_DIR = os.path.join("static", "atlases")
+ATLAS_URL_PREFIX = "/atlas"
+DEFAULT_CELL = 128
+# 格式與縮圖相同（沒有 WebP 支援時改用 JPEG），畫質稍高一點，圖集上的每張圖都會被放大顯示
+ATLAS_OPTIONS = {**THUMB_OPTIONS, "quality": 85}
+
+
+def _local_path(img_path):
+    return img_path.lstrip("/").replace("/", os.sep)
+
+
+def atlas_file(info, out_dir=ATLAS_DIR):
+    """info["atlas"] 對應的本機檔案路徑；沒有圖集時回傳 None"""
+    src = (info.get("atlas") or {}).get("src")
+    return os.path.join(out_dir, os.path.basename(src)) if src else None
+
+
+def build_atlas(info, out_dir=ATLAS_DIR):
+    """依 info 的 images 產生圖集並寫回 uv 與 atlas 欄位；回傳更新後的 info"""
+    images = info.get("images", [])
+    if not images:
+        return info
+
+    # 格子大小跟縮圖一樣依排版尺寸決定
+    tile_px = max((max(p["w"], p["h"]) for p in info.get("image_info", [])), default=0)
+    cell = (pick_thumb_size(tile_px) if tile_px else None) or DEFAULT_CELL
+
+    cols = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / cols)
+    sheet = Image.new("RGB", (cols * cell, rows * cell), (255, 255, 255))
+    rects = []
+    for i, entry in enumerate(images):
+        with Image.open(_local_path(entry["img_path"])) as src:
+            src.draft("RGB", (cell, cell))
+            tile = src.convert("RGB")
+            tile.thumbnail((cell, cell), Image.LANCZOS)
+        x, y = (i % cols) * cell, (i // cols) * cell
+        sheet.paste(tile, (x, y))
+        rects.append({"x": x, "y": y, "w": tile.size[0], "h": tile.size[1]})
+
+    buf = io.BytesIO()
+    sheet.save(buf, format=THUMB_FORMAT, **ATLAS_OPTIONS)
+    data = buf.getvalue()
+    name = f"{hashlib.sha1(data).hexdigest()[:20]}.{THUMB_EXT}"
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, name)
+    if not os.path.isfile(path):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    for entry, rect in zip(images, rects):
+        entry["uv"] = rect
+    info["atlas"] = {"src": f"{ATLAS_URL_PREFIX}/{name}", "width": sheet.size[0], "height": sheet.size[1]}
+    return info
@@ -0,0 +1,322 @@
+"""批次產生拼貼：對整個資料夾的照片離線產生拼貼並寫入資料庫（活動前預先產生用）
+
+流程與 generate_collage_info 相同，但不經過 request：
+- CPU 階段（解碼縮圖、編碼 JPEG、產生縮圖，以及排版 + 圖集）在程序池執行，不受 GIL 限制
+- 模型呼叫（ai_generate）在執行緒中進行，同時呼叫的照片數由 model_workers 限制
+- 完成的拼貼累積 commit_every 筆後一次寫入 Collage，寫入成功才記到進度檔（JSON lines），
+  中斷後重新執行會略過已完成的照片
+- 同一張照片已生成過的 AI 圖片（變體快取）直接沿用
+
+用法：flask --app app batch-collages <資料夾> [--shape heart] [--public]
+Python：run_batch(app, photo_dir, shape="heart")
+程序池的 worker 會重新 import 本模組，所以這裡只在最上層 import 輕量模組。
+"""
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from derivatives import make_derivatives
+from ingest import ingest_image, encode_jpeg, UploadTooLargeError, MAX_UPLOAD_BYTES
+from variant_cache import variant_cache_key
+
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".heic", ".bmp", ".tif", ".tiff")
+STATE_FILENAME = ".collage_batch.jsonl"
+DEFAULT_CPU_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+DEFAULT_MODEL_WORKERS = 2          # 同時呼叫模型的照片數（每張照片內部還有 AI_CONCURRENCY 個請求）
+DEFAULT_COMMIT_EVERY = 20
+# 只用畫布大小（和文字）就能產生的形狀；custom_silhouette / draw 需要每張照片各自上傳的遮罩
+BATCH_SHAPES = ("rectangle", "circle", "star", "heart", "text_mask")
+
+
+def photo_key(root, path):
+    """進度檔裡的照片識別：相對路徑 + 大小 + 修改時間，檔案被換掉就會重新產生"""
+    st = os.stat(path)
+    return f"{os.path.relpath(path, root)}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def find_photos(root):
+    photos = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in sorted(filenames):
+            if name.lower().endswith(PHOTO_EXTENSIONS) and not name.startswith("."):
+                photos.append(os.path.join(dirpath, name))
+    return photos
+
+
+def load_state(state_path):
+    """讀取進度檔，回傳 {photo_key: collage_id}；最後一行寫到一半時忽略"""
+    done = {}
+    try:
+        with open(state_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                done[entry["key"]] = entry["collage_id"]
+    except FileNotFoundError:
+        pass
+    return done
+
+
+# ---- 程序池中執行的 CPU 階段 ----
+def prepare_photo(path, upload_folder, prompt):
+    """解碼並縮小照片、存成上傳圖與縮圖；回傳送給模型的 JPEG 與排版需要的資訊"""
+    start = time.perf_counter()
+    if os.path.getsize(path) > MAX_UPLOAD_BYTES:
+        raise UploadTooLargeError(f"檔案超過 {MAX_UPLOAD_BYTES // (1024 * 1024)}MB 上限")
+    with open(path, "rb") as f:
+        img, ingest_stats = ingest_image(f.read())
+    upload_jpeg = encode_jpeg(img)
+    filename = f"{uuid.uuid4().hex}.jpg"
+    tmp_path = os.path.join(upload_folder, f".{filename}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(upload_jpeg)
+    os.replace(tmp_path, os.path.join(upload_folder, filename))
+    make_derivatives(img, upload_folder, filename)
+    return {
+        "filename": filename,
+        "size": img.size,
+        "jpeg": upload_jpeg,
+        "cache_key": variant_cache_key(img, prompt),
+        "ingest": ingest_stats,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def layout_photo(generated_images, target_img, shape, text_input, strategy, seed):
+    """排版 + 圖集，回傳與 generate_collage_info 相同格式的拼貼資訊"""
+    from collage_util_api import paste_jittered_grid_photos
+    from atlas import build_atlas
+
+    start = time.perf_counter()
+    result = paste_jittered_grid_photos(
+        generated_images, canvas_size=(600, 600), grid=(18, 18), shape=shape, target_img=target_img,
+        text_input=text_input, strategy=strategy, seed=seed)
+    try:
+        build_atlas(result)
+    except Exception as atlas_err:
+        print(f"產生圖集失敗：{atlas_err}")
+    info = {
+        "image_info": result["image_info"],
+        "images": result["images"],
+        "atlas": result.get("atlas"),
+        "layout": result["layout"],
+    }
+    return info, time.perf_counter() - start
+
+
+# ---- 主程序 ----
+class BatchStats:
+    STAGES = ("prepare", "model", "layout", "db")
+
+    def __init__(self, total, skipped):
+        self.total = total
+        self.skipped = skipped
+        self.done = 0
+        self.failed = 0
+        self.cache_hits = 0
+        self.generated_images = 0
+        self.seconds = {stage: 0.0 for stage in self.STAGES}
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.seconds[stage] += seconds
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def to_dict(self):
+        elapsed = self.elapsed()
+        return {
+            "total": self.total,
+            "skipped": self.skipped,
+            "done": self.done,
+            "failed": self.failed,
+            "cache_hits": self.cache_hits,
+            "generated_images": self.generated_images,
+            "elapsed": round(elapsed, 2),
+            "photos_per_min": round(self.done / elapsed * 60, 2) if elapsed else 0.0,
+            "stage_seconds": {k: round(v, 2) for k, v in self.seconds.items()},
+        }
+
+    def report(self):
+        d = self.to_dict()
+        print(f"📊 完成 {d['done']} / 失敗 {d['failed']} / 略過 {d['skipped']}（共 {d['total']} 張），"
+              f"耗時 {d['elapsed']:.1f}s，{d['photos_per_min']:.1f} 張/分鐘")
+        print(f"   變體快取命中 {d['cache_hits']}，新生成 AI 圖片 {d['generated_images']} 張")
+        busy = ", ".join(f"{k} {v:.1f}s" for k, v in d["stage_seconds"].items())
+        print(f"   各階段累計：{busy}")
+
+
+def _allocate_ids(count, cursor):
+    """從 cursor 開始找 count 個未使用的時間戳 ID（與網頁生成的 ID 規則相同），回傳 (ids, 新 cursor)"""
+    from models import db, Collage, public_file_rows
+
+    ids = []
+    while len(ids) < count:
+        candidates = [str(cursor + i) for i in range(count - len(ids))]
+        taken = {row[0] for row in db.session.query(Collage.id).filter(Collage.id.in_(candidates))}
+        ids += [c for c in candidates if c not in taken]
+        cursor += len(candidates)
+    return ids, cursor
+
+
+def check_batch_shape(shape, text_input=None):
+    """在呼叫模型之前檢查形狀參數，不合法時丟出 ValueError"""
+    if shape not in BATCH_SHAPES:
+        raise ValueError(f"批次產生不支援形狀 {shape}（可用：{' / '.join(BATCH_SHAPES)}；"
+                         f"custom_silhouette 與 draw 需要每張照片各自的遮罩）")
+    if shape == "text_mask" and not text_input:
+        raise ValueError("shape=text_mask 需要同時指定 --text")
+
+
+def run_batch(app, photo_dir, shape="rectangle", text_input=None, strategy=None, seed=None,
+              is_public=False, cpu_workers=DEFAULT_CPU_WORKERS, model_workers=DEFAULT_MODEL_WORKERS,
+              commit_every=DEFAULT_COMMIT_EVERY, state_path=None, limit=None, gen_client=None):
+    """處理 photo_dir 底下所有照片，回傳統計資料（BatchStats.to_dict()）
+
+    seed 有指定時第 i 張照片使用 seed + i，重跑可得到相同排版；gen_client 可換成 fake_genai.FakeClient。
+    非公開的拼貼與網頁產生的一樣受保留策略管理，活動用途請設 is_public=True。
+    """
+    from sqlalchemy.exc import IntegrityError
+    from collage_util_api import (ai_generate, variant_cache, retention, track_atlas, DEFAULT_PROMPT, AI_MAX_IMAGES,
+                                  UPLOAD_DIR)
+    from layout_engine import DEFAULT_STRATEGY, STRATEGIES
+    from models import db, Collage
+
+    strategy = strategy or DEFAULT_STRATEGY
+    if strategy not in STRATEGIES:
+        raise ValueError(f"不支援的排版策略: {strategy}")
+    check_batch_shape(shape, text_input)
+    upload_folder = app.config.get("UPLOAD_FOLDER", UPLOAD_DIR)
+    os.makedirs(upload_folder, exist_ok=True)
+    state_path = state_path or os.path.join(photo_dir, STATE_FILENAME)
+
+    done_keys = load_state(state_path)
+    photos = []
+    for index, path in enumerate(find_photos(photo_dir)):
+        key = photo_key(photo_dir, path)
+        if key not in done_keys:
+            photos.append((index, path, key))
+    skipped = len(done_keys)
+    if limit is not None:
+        photos = photos[:limit]
+    stats = BatchStats(len(photos) + skipped, skipped)
+    print(f"🗂️ {photo_dir}：待處理 {len(photos)} 張，已完成 {skipped} 張；"
+          f"CPU 程序 {cpu_workers}、模型並行 {model_workers}")
+    if not photos:
+        return stats.to_dict()
+
+    model_slots = threading.Semaphore(model_workers)
+    # spawn：父程序已有執行緒（寫檔、資料庫連線），fork 複製它們不安全
+    cpu_pool = ProcessPoolExecutor(max_workers=cpu_workers, mp_context=multiprocessing.get_context("spawn"))
+    # 每張照片一個協調執行緒；多出 cpu_workers 個，讓模型等待時下一批照片可以先做 CPU 階段
+    drivers = ThreadPoolExecutor(max_workers=model_workers + cpu_workers, thread_name_prefix="batch")
+
+    def process(index, path):
+        prepared = cpu_pool.submit(prepare_photo, path, upload_folder, DEFAULT_PROMPT).result()
+        stats.add("prepare", prepared["seconds"])
+        upload_path = os.path.join(upload_folder, prepared["filename"])
+        retention.track(upload_path)
+
+        cached = variant_cache.get(prepared["cache_key"])
+        if cached:
+            generated = [{"filename": f} for f in cached]
+            with stats._lock:
+                stats.cache_hits += 1
+        else:
+            with model_slots:
+                start = time.perf_counter()
+                generated = ai_generate(prepared["jpeg"], mime_type="image/jpeg", gen_client=gen_client,
+                                        user="batch")
+                stats.add("model", time.perf_counter() - start)
+            with stats._lock:
+                stats.generated_images += len(generated)
+            if len(generated) >= AI_MAX_IMAGES:
+                variant_cache.put(prepared["cache_key"], [item["filename"] for item in generated])
+
+        target = {"size": prepared["size"], "filename": prepared["filename"]}
+        run_seed = None if seed is None else seed + index
+        info, layout_seconds = cpu_pool.submit(
+            layout_photo, generated, target, shape, text_input, strategy, run_seed).result()
+        stats.add("layout", layout_seconds)
+        track_atlas(info)   # 圖集在子程序中建立，由本程序的保留策略管理
+        return info
+
+    pending = []    # [(photo_key, 路徑, info)]
+    cursor = int(time.time())
+
+    def flush():
+        nonlocal cursor
+        if not pending:
+            return
+        start = time.perf_counter()
+        for attempt in range(3):
+            ids, cursor = _allocate_ids(len(pending), max(cursor, int(time.time())))
+            now_ts = time.time()
+            rows = []
+            for collage_id, (_, path, info) in zip(ids, pending):
+                collage = Collage(
+                    id=collage_id,
+                    title=os.path.splitext(os.path.basename(path))[0],
+                    preview_src=info["images"][0].get("full_path", info["images"][0]["img_path"]),
+                    is_public=is_public,
+                    created_at=now_ts,
+                    updated_at=now_ts
+                )
+                collage.set_info(info)
+                rows.append(collage)
+                rows += public_file_rows(collage)   # 公開拼貼的檔案登記為受保護
+            db.session.add_all(rows)
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                # 網頁同時產生拼貼搶到同一個 ID，重新分配
+                db.session.rollback()
+                if attempt == 2:
+                    raise
+        with open(state_path, "a", encoding="utf-8") as f:
+            for collage_id, (key, _, _) in zip(ids, pending):
+                f.write(json.dumps({"key": key, "collage_id": collage_id}, ensure_ascii=False) + "\n")
+        stats.add("db", time.perf_counter() - start)
+        pending.clear()
+
+    futures = {drivers.submit(process, index, path): (path, key) for index, path, key in photos}
+    try:
+        with app.app_context():
+            for future in as_completed(futures):
+                path, key = futures[future]
+                try:
+                    info = future.result()
+                except Exception as e:
+                    stats.failed += 1
+                    print(f"❌ {path} 失敗: {e}")
+                    continue
+                stats.done += 1
+                pending.append((key, path, info))
+                print(f"✅ [{stats.done + stats.failed}/{len(photos)}] {path}（{len(info['image_info'])} 格）")
+                if len(pending) >= commit_every:
+                    flush()
+            flush()
+    except KeyboardInterrupt:
+        # 已完成的先寫入，下次執行從中斷處繼續
+        print("⏹️ 中斷，寫入已完成的拼貼")
+        for future in futures:
+            future.cancel()
+        with app.app_context():
+            flush()
+        raise
+    finally:
+        drivers.shutdown(wait=False, cancel_futures=True)
+        cpu_pool.shutdown(wait=False, cancel_futures=True)
+        stats.report()
+    return stats.to_dict()
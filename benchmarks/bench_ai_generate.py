@@ -0,0 +1,55 @@
+"""比較 ai_generate 序列 (concurrency=1) 與並行的耗時，使用假的 Gemini client，不需連網
+
+用法：python benchmarks/bench_ai_generate.py [--latency 0.5] [--failure-rate 0.1]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("API_KEY", "offline-benchmark")
+os.environ.setdefault("GEMINI_SCHEDULER", "0")  # 只比較並行度；全域速率排程另見 bench_gemini_scheduler.py
+
+from PIL import Image
+
+import collage_util_api
+from derivatives import remove_derivatives
+from fake_genai import FakeClient
+
+
+def run(concurrency, args, image_path):
+    fake = FakeClient(latency=args.latency, failure_rate=args.failure_rate, empty_rate=args.empty_rate, seed=0)
+    start = time.perf_counter()
+    images = collage_util_api.ai_generate(image_path, max_images=args.max_images, concurrency=concurrency, gen_client=fake)
+    elapsed = time.perf_counter() - start
+    for img in images:
+        os.remove(os.path.join(collage_util_api.OUTPUT_DIR, img["filename"]))
+        remove_derivatives(collage_util_api.OUTPUT_DIR, img["filename"])
+    return elapsed, len(images), fake.calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    parser.add_argument("--empty-rate", type=float, default=0.05)
+    parser.add_argument("--max-images", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = os.path.join(tmp, "source.jpg")
+        Image.new("RGB", (512, 512), (120, 80, 40)).save(image_path, format="JPEG")
+
+        print(f"{'concurrency':>12} {'seconds':>10} {'images':>8} {'calls':>8}")
+        baseline = None
+        for c in args.concurrency:
+            elapsed, count, calls = run(c, args, image_path)
+            baseline = baseline or elapsed
+            print(f"{c:>12} {elapsed:>10.2f} {count:>8} {calls:>8}   x{baseline / elapsed:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""比較 SQLite 預設設定與 storage 設定（WAL + synchronous=NORMAL + 批次寫入）的寫入吞吐量
+
+用法：python benchmarks/bench_db_writes.py [--writes 2000] [--threads 16]
+每種模式使用獨立的臨時資料庫檔案，不會動到 instance/photos.db。
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+
+from models import db, Feedback, Leaderboard
+from leaderboard import submit_scores, get_top, _query_top, _public
+from storage import configure_database, enable_sqlite_pragmas, WriteBatcher
+
+
+def make_app(path, tuned):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    uri = f"sqlite:///{path}"
+    if tuned:
+        configure_database(app, uri)
+    else:
+        app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    db.init_app(app)
+    if tuned:
+        enable_sqlite_pragmas(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def run(tuned, workload, writes, threads, seed):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'), tuned)
+        rng = random.Random(seed)
+        times = [round(rng.uniform(5, 300), 3) for _ in range(writes)]
+        errors = []
+        lock = threading.Lock()
+
+        if workload == 'feedback':
+            def flush(_, rows):
+                db.session.add_all(Feedback(**row) for row in rows)
+                db.session.commit()
+        else:
+            flush = submit_scores
+        batcher = WriteBatcher(app, flush, max_batch=200, max_delay=0.02) if tuned else None
+
+        def write(i):
+            row = {'type': 'bug', 'subject': f's{i}', 'message': 'x' * 200}
+            score = {'name': f'p{i}', 'time': times[i]}
+            try:
+                if batcher is not None:
+                    if workload == 'feedback':
+                        batcher.submit('feedback', row)
+                    else:
+                        batcher.submit('c1', score).result(timeout=60)
+                    return
+                with app.app_context():
+                    if workload == 'feedback':
+                        db.session.add(Feedback(**row))
+                        db.session.commit()
+                    else:
+                        submit_scores('c1', [score])
+            except OperationalError as e:
+                with lock:
+                    errors.append(str(e.orig))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(write, range(writes)))
+        if batcher is not None:
+            batcher.close(timeout=60)
+        elapsed = time.perf_counter() - start
+
+        with app.app_context():
+            if workload == 'feedback':
+                stored = Feedback.query.count()
+                consistent = True
+            else:
+                stored = Leaderboard.query.count()
+                consistent = get_top('c1') == _public(_query_top('c1'))
+            db.session.remove()
+            db.engines[None].dispose()
+        return elapsed, stored, len(errors), consistent
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--writes', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'workload':>12} {'mode':>9} {'seconds':>8} {'writes/s':>9} {'stored':>7} {'locked':>7} {'top ok':>7}")
+    for workload in ('feedback', 'leaderboard'):
+        for tuned in (False, True):
+            elapsed, stored, errors, consistent = run(tuned, workload, args.writes, args.threads, args.seed)
+            mode = 'tuned' if tuned else 'default'
+            print(f"{workload:>12} {mode:>9} {elapsed:>8.2f} {stored / elapsed:>9.0f} {stored:>7} {errors:>7} "
+                  f"{str(consistent):>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""比較 image_info 的 JSON 與精簡格式（layout_codec）的大小與編解碼時間
+
+用法：python benchmarks/bench_layout_codec.py [--grids 18 50 100 200]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("API_KEY", "offline-benchmark")
+
+from collage_util_api import paste_jittered_grid_photos
+from layout_codec import encode_layout, decode_layout, decode_columns
+
+
+def timed(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grids", type=int, nargs="+", default=[18, 50, 100, 200])
+    parser.add_argument("--canvas", type=int, default=3840)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    target = {"size": (1024, 1024), "filename": "target.jpg"}
+    print(f"{'grid':>9} {'tiles':>7} {'json B':>9} {'packed B':>9} {'ratio':>6} "
+          f"{'json dec ms':>12} {'dict dec ms':>12} {'array dec ms':>13} {'enc ms':>8}")
+    for g in args.grids:
+        image_info = paste_jittered_grid_photos(
+            [], canvas_size=(args.canvas, args.canvas), grid=(g, g), shape="rectangle", target_img=target, seed=0
+        )["image_info"]
+        as_json = json.dumps(image_info)
+        packed = encode_layout(image_info)
+        assert decode_layout(packed) == image_info
+
+        json_dec = timed(lambda: json.loads(as_json), args.repeat)
+        dict_dec = timed(lambda: decode_layout(packed), args.repeat)
+        arr_dec = timed(lambda: decode_columns(packed), args.repeat)
+        enc = timed(lambda: encode_layout(image_info), args.repeat)
+        print(f"{g:>4}x{g:<4} {len(image_info):>7} {len(as_json):>9} {len(packed):>9} {len(as_json) / len(packed):>5.1f}x "
+              f"{json_dec:>12.2f} {dict_dec:>12.2f} {arr_dec:>13.3f} {enc:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""比較排版策略（抖動網格 vs 泊松圓盤）在各種遮罩下的取樣速度、張數與覆蓋率
+
+用法：python benchmarks/bench_layout_engine.py [--canvas 600] [--grid 18] [--seeds 5]
+覆蓋率 = 遮罩內被至少一張圖片（視為未旋轉的正方形）蓋到的比例。
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("API_KEY", "offline-benchmark")
+
+from PIL import Image
+
+from collage_util_api import get_mask
+from layout_engine import STRATEGIES, TILE_RATIO, generate_layout, coverage
+
+SHAPES = [("rectangle", None), ("circle", None), ("star", None), ("heart", None),
+          ("text_mask", "HI"), ("text_mask", "拼貼")]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--canvas", type=int, default=600)
+    parser.add_argument("--grid", type=int, default=18)
+    parser.add_argument("--seeds", type=int, default=5)
+    args = parser.parse_args()
+
+    size = (args.canvas, args.canvas)
+    base_spacing = args.canvas // args.grid
+    print(f"canvas {args.canvas}x{args.canvas}, base spacing {base_spacing}px, {args.seeds} seeds")
+    print(f"{'shape':>14} {'strategy':>9} {'tiles':>6} {'ms':>8} {'samples/s':>10} {'coverage':>9}")
+    for shape, text in SHAPES:
+        mask = get_mask(Image.new("RGBA", size), shape, text_input=text, as_array=True)
+        label = f"{shape}:{text}" if text else shape
+        for strategy in STRATEGIES:
+            elapsed, tiles, covered = 0.0, 0, 0.0
+            for seed in range(args.seeds):
+                start = time.perf_counter()
+                centers, _, spacing, scales = generate_layout(size, base_spacing, mask, strategy=strategy, seed=seed,
+                                                              adaptive=(strategy == "poisson"))
+                elapsed += time.perf_counter() - start
+                rects = []
+                for (x, y), scale in zip(centers, scales):
+                    tile = int(spacing * TILE_RATIO * scale)
+                    rects.append((x - tile // 2, y - tile // 2, tile, tile))
+                tiles += len(centers)
+                covered += coverage(mask, size, rects)
+            print(f"{label:>14} {strategy:>9} {tiles / args.seeds:>6.0f} {elapsed / args.seeds * 1000:>8.2f} "
+                  f"{tiles / elapsed:>10.0f} {covered / args.seeds:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""比較 paste_jittered_grid_photos 舊版逐格迴圈與 NumPy 向量化版本在不同格數下的耗時
+
+用法：python benchmarks/bench_placement.py [--canvas 3840] [--shape heart] [--repeat 3]
+計時前先確認向量化的 grid 策略在非正方形畫布上與逐格迴圈的格子位置、抖動範圍一致。
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("API_KEY", "offline-benchmark")
+
+import numpy as np
+
+from collage_util_api import paste_jittered_grid_photos
+from layout_engine import grid_strategy
+
+
+def best_of(repeat, **kwargs):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = paste_jittered_grid_photos(**kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, len(result["image_info"])
+
+
+CHECK_CASES = [((1000, 600), (30, 18)), ((600, 1000), (24, 40)), ((600, 600), (36, 36))]
+
+
+def check_grid_matches_loop(target, generated):
+    """jitter_ratio=0 時兩種做法的位置必須完全相同；有抖動時每張圖偏離格子中心不超過各軸的抖動範圍"""
+    for canvas, grid in CHECK_CASES:
+        common = dict(generated_images=generated, canvas_size=canvas, grid=grid, shape="heart", target_img=target)
+        cell_w, cell_h = canvas[0] // grid[0], canvas[1] // grid[1]
+        loop = paste_jittered_grid_photos(vectorized=False, jitter_ratio=0, **common)["image_info"]
+        vec = paste_jittered_grid_photos(vectorized=True, jitter_ratio=0, seed=0, **common)["image_info"]
+        assert [(p["x"], p["y"]) for p in loop] == [(p["x"], p["y"]) for p in vec], f"grid 位置不一致: {canvas} {grid}"
+        for ratio in (0.1, 0.35):
+            xs, ys = grid_strategy(canvas, 0, None, np.random.default_rng(1), jitter_ratio=ratio, grid=grid)
+            base_x, base_y = grid_strategy(canvas, 0, None, np.random.default_rng(1), jitter_ratio=0, grid=grid)
+            assert (np.abs(xs - base_x) <= int(cell_w * ratio)).all(), f"x 抖動超出範圍: {canvas} {ratio}"
+            assert (np.abs(ys - base_y) <= int(cell_h * ratio)).all(), f"y 抖動超出範圍: {canvas} {ratio}"
+        print(f"grid check ok: canvas {canvas[0]}x{canvas[1]}, grid {grid[0]}x{grid[1]}, {len(vec)} tiles")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--canvas", type=int, default=3840)
+    parser.add_argument("--shape", default="heart")
+    parser.add_argument("--grids", type=int, nargs="+", default=[18, 50, 100, 200, 400])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    target = {"size": (1024, 1024), "filename": "target.jpg"}
+    generated = [{"filename": f"edited_{i}.jpg"} for i in range(10)]
+    check_grid_matches_loop(target, generated)
+    print(f"canvas {args.canvas}x{args.canvas}, shape={args.shape}")
+    print(f"{'grid':>10} {'loop ms':>10} {'numpy ms':>10} {'tiles':>8} {'speedup':>8}")
+    for g in args.grids:
+        common = dict(generated_images=generated, canvas_size=(args.canvas, args.canvas), grid=(g, g),
+                      shape=args.shape, target_img=target)
+        loop_s, loop_n = best_of(args.repeat, vectorized=False, **common)
+        np_s, np_n = best_of(args.repeat, vectorized=True, seed=0, **common)
+        print(f"{g:>4}x{g:<5} {loop_s * 1000:>10.1f} {np_s * 1000:>10.1f} {np_n:>8} {loop_s / np_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""伺服器端渲染（collage_renderer）的耗時與記憶體：distance 排版幾乎每張圖的尺寸都不同，是快取最吃緊的情況
+
+用法：python benchmarks/bench_renderer.py [--size 8000] [--strategy distance] [--budget-mb 96]
+結束前檢查記憶體有沒有守住上限：
+- 渲染器快取（來源圖 + 小圖 + 旋轉結果）的最大佔用量不超過 budget，加上一張最大的圖（LRU 至少保留剛放入的一項）
+- 程序最大 RSS 的增加量不超過 budget 加上條帶緩衝與一張最大圖的餘裕
+"""
+import argparse
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("API_KEY", "offline-benchmark")
+
+MB = 1024 * 1024
+
+
+def max_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024     # Linux 單位為 KB
+
+
+def make_collage(api, strategy, count=10):
+    """在目前目錄（臨時目錄）建立上傳圖與 count 張生成圖，回傳排好版的拼貼資訊"""
+    from PIL import Image
+    from derivatives import make_derivatives
+
+    rng = random.Random(0)
+    api.ensure_dir(api.UPLOAD_DIR)
+    api.ensure_dir(api.OUTPUT_DIR)
+    target = Image.new("RGB", (1600, 1200), (200, 120, 80))
+    target.save(os.path.join(api.UPLOAD_DIR, "bench_target.jpg"), format="JPEG")
+    make_derivatives(target, api.UPLOAD_DIR, "bench_target.jpg")
+    generated = []
+    for i in range(count):
+        img = Image.effect_noise((1024, 1024), 40).convert("RGB")
+        img.paste(tuple(rng.randint(0, 255) for _ in range(3)), (0, 0, 512, 512))
+        filename = f"edited_bench_{i}.jpg"
+        img.save(os.path.join(api.OUTPUT_DIR, filename), format="JPEG")
+        make_derivatives(img, api.OUTPUT_DIR, filename)
+        generated.append({"filename": filename})
+    return api.paste_jittered_grid_photos(generated, canvas_size=(600, 600), grid=(18, 18), shape="heart",
+                                          target_img={"size": target.size, "filename": "bench_target.jpg"},
+                                          strategy=strategy, seed=0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=8000)
+    parser.add_argument("--strategy", default="distance")
+    parser.add_argument("--budget-mb", type=int, default=96)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="collage-render-")
+    os.chdir(workdir)
+    try:
+        import collage_util_api as api
+        from collage_renderer import CollageRenderer, BASE_CANVAS, STRIP_HEIGHT
+
+        info = make_collage(api, args.strategy)
+        sizes = {(p["w"], p["h"]) for p in info["image_info"]}
+        scale = args.size / BASE_CANVAS
+        largest_w = max(w for w, _ in sizes) * scale
+        largest_h = max(h for _, h in sizes) * scale
+        largest_item = int((largest_w + largest_h) ** 2 * 4)   # 旋轉後外接框的保守估計（RGBA）
+        budget = args.budget_mb * MB
+        strip_bytes = args.size * STRIP_HEIGHT * 3 * 4          # 條帶、原始列資料與壓縮緩衝
+
+        renderer = CollageRenderer(workdir, cache_bytes=budget)
+        rss_before = max_rss_bytes()
+        start = time.perf_counter()
+        png_bytes = sum(len(chunk) for chunk in renderer.iter_png(info, size=args.size, seed=0))
+        elapsed = time.perf_counter() - start
+        rss_growth = max(0, max_rss_bytes() - rss_before)
+
+        print(f"{args.strategy} layout, {len(info['image_info'])} tiles, {len(sizes)} distinct tile sizes, "
+              f"rendered at {args.size}x{args.size}")
+        print(f"time {elapsed:.2f}s, png {png_bytes / MB:.1f} MB")
+        print(f"cache peak {renderer.last_peak_bytes / MB:.1f} MB (budget {args.budget_mb} MB), "
+              f"max RSS growth {rss_growth / MB:.1f} MB")
+        assert renderer.last_peak_bytes <= budget + largest_item, "渲染快取超過上限"
+        assert rss_growth <= budget + largest_item + strip_bytes + 64 * MB, "渲染時的記憶體用量超過上限"
+        print("memory check ok")
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""量測啟動成本：import 時間、create_app() 時間，以及啟動後第一個請求的延遲（有/無預熱）
+
+用法：python benchmarks/bench_startup.py [--runs 5]
+每一輪都在新的子程序中執行（臨時目錄 + 臨時 SQLite），取中位數。
+「第一個請求」：GET /gallery（資料庫連線）與文字遮罩排版（字型與遮罩），各量第一次的時間。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, os, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, ROOT)
+result = {}
+if MODE == "import_api":
+    import collage_util_api
+    result["import"] = time.perf_counter() - t0
+else:
+    import app as app_module
+    result["import"] = time.perf_counter() - t0
+    start = time.perf_counter()
+    create_app = getattr(app_module, "create_app", None)
+    if create_app:
+        create_app(warmup=(MODE == "warmup"))
+    else:
+        with app_module.app.app_context():
+            app_module.db.create_all()
+    result["create_app"] = time.perf_counter() - start
+
+    client = app_module.app.test_client()
+    start = time.perf_counter()
+    assert client.get("/gallery").status_code == 200
+    result["first_gallery"] = time.perf_counter() - start
+
+    from PIL import Image
+    from collage_util_api import paste_jittered_grid_photos
+    start = time.perf_counter()
+    paste_jittered_grid_photos([], target_img={"size": (800, 600), "filename": "x.jpg"}, grid=(18, 18),
+                               shape="text_mask", text_input="拼貼", seed=0)
+    result["first_text_layout"] = time.perf_counter() - start
+    result["time_to_first_request"] = time.perf_counter() - t0 - result["first_text_layout"]
+print(json.dumps(result))
+"""
+
+
+def run_child(mode):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, API_KEY=os.environ.get("API_KEY", "offline-benchmark"),
+                   DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'startup.db')}",
+                   RETENTION_INTERVAL="3600")
+        code = f"ROOT = {ROOT!r}\nMODE = {mode!r}\n" + CHILD
+        out = subprocess.run([sys.executable, "-c", code], cwd=tmp, env=env, capture_output=True, text=True,
+                             check=True).stdout
+        return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'mode':>12} {'metric':>22} {'median ms':>10} {'min ms':>8}")
+    for mode in ("import_api", "cold", "warmup"):
+        runs = [run_child(mode) for _ in range(args.runs)]
+        for metric in runs[0]:
+            values = [r[metric] * 1000 for r in runs]
+            print(f"{mode:>12} {metric:>22} {statistics.median(values):>10.1f} {min(values):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""排行榜壓力測試：多執行緒同時對同一個拼貼提交成績，最後比對物化的前 N 名與資料表算出的前 N 名
+
+用法：python benchmarks/load_leaderboard.py [--submissions 2000] [--concurrency 16] [--batch 1]
+測試資料寫在臨時目錄的 SQLite 檔（不碰 instance/photos.db），結束後整個刪除。
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("API_KEY", "offline-benchmark")
+# 資料庫位置在 import app 時決定，必須先設定
+WORKDIR = tempfile.mkdtemp(prefix="leaderboard-load-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORKDIR, 'load.db')}"
+
+from app import app
+from models import db, Leaderboard, upgrade_tables
+from leaderboard import TOP_N, _query_top, _public, get_top
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--submissions", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=1, help="每個請求提交幾筆成績")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        upgrade_tables()
+
+    collage_id = f"loadtest-{uuid.uuid4().hex[:8]}"
+    rng = random.Random(args.seed)
+    times = [round(rng.uniform(5, 300), 3) for _ in range(args.submissions)]
+    batches = [times[i:i + args.batch] for i in range(0, len(times), args.batch)]
+    client = app.test_client()
+    latencies, failures = [], []
+
+    def submit(i, batch):
+        start = time.perf_counter()
+        if args.batch == 1:
+            resp = client.post(f"/collage/{collage_id}/leaderboard", json={"name": f"p{i}", "time": batch[0]})
+        else:
+            resp = client.post(f"/collage/{collage_id}/leaderboard/batch",
+                               json={"scores": [{"name": f"p{i}-{j}", "time": t} for j, t in enumerate(batch)]})
+        latencies.append(time.perf_counter() - start)
+        if resp.status_code != 200:
+            failures.append(resp.get_json())
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(submit, range(len(batches)), batches))
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        materialized = get_top(collage_id)
+        expected = _public(_query_top(collage_id))
+        stored = Leaderboard.query.filter_by(collage_id=collage_id).count()
+
+        read_start = time.perf_counter()
+        for _ in range(200):
+            get_top(collage_id)
+        read_ms = (time.perf_counter() - read_start) / 200 * 1000
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0
+    print(f"requests={len(batches)} scores={args.submissions} concurrency={args.concurrency} failures={len(failures)}")
+    print(f"elapsed={elapsed:.2f}s throughput={args.submissions / elapsed:.0f} scores/s p50={p50:.1f}ms p99={p99:.1f}ms")
+    print(f"rows stored={stored} top read={read_ms:.3f}ms")
+    if failures:
+        print(f"first failure: {failures[0]}")
+    ok = materialized == expected and len(materialized) == min(TOP_N, args.submissions) and stored == args.submissions
+    print("top-N consistent" if ok else f"MISMATCH\n materialized={materialized}\n expected={expected}")
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        ok = main()
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,335 @@
+"""離線效能測試組：遮罩、排版、完整生成請求與主要讀取端點，結果寫成 JSON 方便跨 commit 比較
+
+用法：
+    python benchmarks/suite.py [--out results.json] [--quick] [--only masks,layout,request,endpoints]
+    python benchmarks/suite.py --compare old.json new.json
+
+- 模型呼叫換成 fake_genai.FakeClient（固定 seed，延遲與失敗率可調），不需連網
+- 在臨時目錄中執行：SQLite 資料庫、上傳/生成圖片、圖集都寫在那裡，結束後刪除，不會動到專案資料
+- 端點測試先灌入 --collages 筆拼貼（一半公開）與排行榜資料
+每個項目記錄 n、mean/p50/p95/min（毫秒），另附 commit 與環境資訊。
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("API_KEY", "offline-benchmark")
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")    # 預設輸出位置，不納入版本控制
+SUITES = ("masks", "layout", "request", "endpoints")
+MASK_CANVASES = (600, 1200)
+LAYOUT_CASES = [(600, 18), (600, 30), (1200, 36)]   # (畫布邊長, 格數)
+LAYOUT_SHAPES = [("rectangle", None), ("heart", None), ("text_mask", "HI")]
+REQUEST_TIMEOUT = 120    # 單一生成工作等待完成的上限（秒）
+
+
+def summarize(name, samples, **params):
+    ms = sorted(s * 1000 for s in samples)
+    return {
+        "name": name,
+        "params": params,
+        "n": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 3),
+        "p50_ms": round(ms[len(ms) // 2], 3),
+        "p95_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 3),
+        "min_ms": round(ms[0], 3),
+    }
+
+
+def measure(func, repeat, warmup=1):
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def print_row(row):
+    params = ",".join(f"{k}={v}" for k, v in row["params"].items())
+    print(f"{row['name']:>26} {params:<48} {row['n']:>4} {row['mean_ms']:>10.2f} {row['p50_ms']:>10.2f} "
+          f"{row['p95_ms']:>10.2f}")
+
+
+# ---- 各項測試 ----
+def bench_masks(api, repeat):
+    from PIL import Image
+
+    rows = []
+    builders = [("rectangle", api.create_rectangle_mask), ("circle", api.create_circle_mask),
+                ("star", api.create_star_mask), ("heart", api.create_heart_mask),
+                ("text", lambda canvas: api.create_text_mask(canvas, "拼貼 HI"))]
+    for size in MASK_CANVASES:
+        canvas = Image.new("RGBA", (size, size))
+        for shape, build in builders:
+            rows.append(summarize(f"mask.{shape}", measure(lambda: build(canvas), repeat), canvas=size))
+    return rows
+
+
+def make_fixture_images(api, count=10):
+    """建立一張上傳圖與 count 張「生成圖」（含縮圖），給排版與圖集使用"""
+    from PIL import Image
+    from derivatives import make_derivatives
+
+    rng = random.Random(0)
+    api.ensure_dir(api.UPLOAD_DIR)      # 目錄在第一次寫入時才建立，import 時不會先建好
+    api.ensure_dir(api.OUTPUT_DIR)
+    target = Image.new("RGB", (800, 600), (200, 120, 80))
+    target.save(os.path.join(api.UPLOAD_DIR, "bench_target.jpg"), format="JPEG")
+    make_derivatives(target, api.UPLOAD_DIR, "bench_target.jpg")
+    generated = []
+    for i in range(count):
+        img = Image.new("RGB", (512, 512), tuple(rng.randint(0, 255) for _ in range(3)))
+        filename = f"edited_bench_{i}.jpg"
+        img.save(os.path.join(api.OUTPUT_DIR, filename), format="JPEG")
+        make_derivatives(img, api.OUTPUT_DIR, filename)
+        generated.append({"filename": filename})
+    return {"size": target.size, "filename": "bench_target.jpg"}, generated
+
+
+def bench_layout(api, repeat):
+    from layout_engine import STRATEGIES
+
+    target, generated = make_fixture_images(api)
+    rows = []
+    for canvas, grid in LAYOUT_CASES:
+        for shape, text in LAYOUT_SHAPES:
+            for strategy in STRATEGIES:
+                def run():
+                    api.paste_jittered_grid_photos(generated, canvas_size=(canvas, canvas), grid=(grid, grid),
+                                                   shape=shape, target_img=target, text_input=text,
+                                                   strategy=strategy, seed=0)
+                rows.append(summarize("paste_jittered_grid_photos", measure(run, repeat),
+                                      canvas=canvas, grid=grid, shape=shape, strategy=strategy))
+    return rows
+
+
+def _source_jpeg(i):
+    from PIL import Image
+
+    rng = random.Random(i)
+    buf = io.BytesIO()
+    Image.new("RGB", (1600, 1200), tuple(rng.randint(0, 255) for _ in range(3))).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+def bench_request(app_module, repeat):
+    """POST /generate_collage 到工作完成（輪詢 /jobs/<id>）的端到端時間；每次使用不同照片，不會命中變體快取"""
+    client = app_module.app.test_client()
+    samples, failed = [], 0
+    for i in range(repeat + 1):
+        data = {"images": (io.BytesIO(_source_jpeg(i)), f"photo{i}.jpg"), "shape": "heart"}
+        start = time.perf_counter()
+        resp = client.post("/generate_collage", data=data, content_type="multipart/form-data")
+        job_id = resp.get_json()["job_id"]
+        deadline = start + REQUEST_TIMEOUT
+        while True:
+            status = client.get(f"/jobs/{job_id}").get_json()
+            if status["status"] in ("done", "failed"):
+                break
+            if time.perf_counter() > deadline:
+                raise SystemExit(f"工作 {job_id} 超過 {REQUEST_TIMEOUT} 秒仍未完成（狀態 {status['status']}）")
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        if status["status"] != "done":
+            failed += 1
+        if i:   # 第一次為暖身
+            samples.append(elapsed)
+    row = summarize("generate_collage.end_to_end", samples, shape="heart")
+    row["failed"] = failed
+    return [row]
+
+
+def seed_database(app_module, api, collages, scores_per_collage):
+    """灌入 collages 筆拼貼（偶數筆公開）與排行榜資料，回傳拼貼 ID 清單"""
+    from atlas import build_atlas
+    from leaderboard import submit_scores
+    from models import db, Collage, public_file_rows
+
+    target, generated = make_fixture_images(api)
+    rng = random.Random(0)
+    ids = []
+    with app_module.app.app_context():
+        now = time.time()
+        rows = []
+        for i in range(collages):
+            result = api.paste_jittered_grid_photos(generated, canvas_size=(600, 600), grid=(18, 18),
+                                                    shape="heart", target_img=target, seed=i)
+            build_atlas(result)     # 和正式流程一樣先建好圖集，詳細頁不會在測試中補建
+            collage = Collage(id=str(1_000_000_000 + i), preview_src=result["images"][0]["full_path"],
+                              is_public=(i % 2 == 0), created_at=now - i, updated_at=now - i)
+            collage.set_info(result)
+            rows.append(collage)
+            rows += public_file_rows(collage)
+            ids.append(collage.id)
+        db.session.add_all(rows)
+        db.session.commit()
+        for collage_id in ids[:50]:
+            submit_scores(collage_id, [{"name": f"p{j}", "time": round(rng.uniform(5, 300), 3)}
+                                       for j in range(scores_per_collage)])
+    return ids
+
+
+def bench_endpoints(app_module, api, repeat, collages):
+    client = app_module.app.test_client()
+    ids = seed_database(app_module, api, collages, scores_per_collage=40)
+    public_ids = ids[::2]
+    rng = random.Random(1)
+    rows = []
+
+    def gallery_first():
+        assert client.get("/gallery?limit=24").status_code == 200
+
+    def gallery_walk():
+        cursor = None
+        for _ in range(5):
+            query = {"limit": 24, **({"cursor": cursor} if cursor else {})}
+            cursor = client.get("/gallery", query_string=query).get_json()["next_cursor"]
+            if not cursor:
+                break
+
+    def detail_once(collage_id, compact):
+        headers = {"Accept": app_module.COMPACT_MIMETYPE} if compact else {}
+        assert client.get(f"/collage/{collage_id}", headers=headers).status_code == 200
+
+    def detail(compact, cold):
+        collage_id = rng.choice(public_ids[:50])
+        if cold:
+            app_module.detail_cache.invalidate(collage_id)
+        detail_once(collage_id, compact)
+
+    def leaderboard():
+        assert client.get(f"/collage/{rng.choice(ids[:50])}/leaderboard").status_code == 200
+
+    rows.append(summarize("GET /gallery", measure(gallery_first, repeat), collages=collages))
+    rows.append(summarize("GET /gallery x5 pages", measure(gallery_walk, repeat), collages=collages))
+    hot_ids = public_ids[:50]
+    for compact in (False, True):
+        for cold in (True, False):
+            if not cold:
+                for collage_id in hot_ids:
+                    app_module.detail_cache.invalidate(collage_id)
+                    detail_once(collage_id, compact)
+            rows.append(summarize("GET /collage/<id>", measure(lambda: detail(compact, cold), repeat),
+                                  format="compact" if compact else "json", cache="cold" if cold else "warm"))
+    rows.append(summarize("GET /collage/<id>/leaderboard", measure(leaderboard, repeat)))
+    return rows
+
+
+# ---- 比較 ----
+def compare(old_path, new_path):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    key = lambda row: (row["name"], json.dumps(row["params"], sort_keys=True))
+    before = {key(row): row for row in old["results"]}
+    print(f"{old['meta'].get('commit')} → {new['meta'].get('commit')}")
+    print(f"{'benchmark':>26} {'params':<48} {'old p50':>10} {'new p50':>10} {'change':>8}")
+    for row in new["results"]:
+        prev = before.get(key(row))
+        if not prev:
+            continue
+        params = ",".join(f"{k}={v}" for k, v in row["params"].items())
+        change = (row["p50_ms"] / prev["p50_ms"] - 1) * 100 if prev["p50_ms"] else 0.0
+        print(f"{row['name']:>26} {params:<48} {prev['p50_ms']:>10.2f} {row['p50_ms']:>10.2f} {change:>+7.1f}%")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", default=None, help="結果 JSON 路徑（預設 benchmarks/results/bench_<commit>.json）")
+    parser.add_argument("--only", default=",".join(SUITES), help="要執行的項目，逗號分隔")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--request-repeat", type=int, default=5)
+    parser.add_argument("--collages", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05, help="假模型每次呼叫的延遲（秒）")
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    parser.add_argument("--empty-rate", type=float, default=0.05)
+    parser.add_argument("--quick", action="store_true", help="少量重複，快速檢查")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="比較兩份結果後結束")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.quick:
+        args.repeat, args.request_repeat, args.collages = 3, 2, 100
+    suites = [s for s in args.only.split(",") if s]
+    commit = git_commit()
+    out_path = os.path.abspath(args.out or os.path.join(RESULTS_DIR, f"bench_{commit or 'local'}.json"))
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+    workdir = tempfile.mkdtemp(prefix="collage-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault("METRICS", "0")
+    os.environ.setdefault("GEMINI_SCHEDULER", "0")  # 全域速率排程另見 bench_gemini_scheduler.py
+    os.chdir(workdir)   # 相對路徑（static/...、variant_cache.json）都落在臨時目錄
+    try:
+        import app as app_module
+        import collage_util_api as api
+        from fake_genai import FakeClient
+
+        api.set_client(FakeClient(latency=args.latency, failure_rate=args.failure_rate,
+                                empty_rate=args.empty_rate, seed=0))
+        app_module.create_app(warmup=False)
+
+        print(f"{'benchmark':>26} {'params':<48} {'n':>4} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10}")
+        results = []
+        for suite in suites:
+            if suite == "masks":
+                rows = bench_masks(api, args.repeat)
+            elif suite == "layout":
+                rows = bench_layout(api, args.repeat)
+            elif suite == "request":
+                rows = bench_request(app_module, args.request_repeat)
+            elif suite == "endpoints":
+                rows = bench_endpoints(app_module, api, args.repeat * 5, args.collages)
+            else:
+                raise SystemExit(f"未知的項目: {suite}")
+            for row in rows:
+                row["suite"] = suite
+                print_row(row)
+            results.extend(rows)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果已寫入 {out_path}")
+
+
+if __name__ == "__main__":
+    main()
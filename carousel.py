@@ -0,0 +1,173 @@
+"""首頁輪播圖片：檔案清單快取與存檔
+
+- CarouselIndex 把 static/carousel 的檔名清單放在記憶體，只有自己寫入或資料夾 mtime 改變時才重新列目錄；
+  首頁抽樣是 random.sample(k)，不隨圖片總數變慢
+- save_to_carousel 的 JSON 內容以串流方式讀取：base64 圖片邊讀邊解碼到暫存檔，
+  不會把整個字串（與解碼後的 bytes）同時放在記憶體，存檔時縮成長邊 MAX_EDGE 的 WebP
+"""
+import base64
+import json
+import os
+import random
+import tempfile
+import threading
+import uuid
+
+from PIL import Image, features
+
+CAROUSEL_DIR = os.path.join("static", "carousel")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+MAX_EDGE = 1280                     # 輪播圖長邊上限
+READ_CHUNK = 64 * 1024
+SPOOL_BYTES = 2 * 1024 * 1024       # 解碼後小於這個大小時留在記憶體
+
+if features.check("webp"):
+    CAROUSEL_FORMAT, CAROUSEL_EXT, CAROUSEL_OPTIONS = "WEBP", "webp", {"quality": 82, "method": 4}
+else:
+    CAROUSEL_FORMAT, CAROUSEL_EXT, CAROUSEL_OPTIONS = "JPEG", "jpg", {"quality": 85, "optimize": True}
+
+
+class CarouselIndex:
+    def __init__(self, folder=CAROUSEL_DIR):
+        self.folder = folder
+        self._files = []
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.rescans = 0
+
+    def _dir_mtime(self):
+        try:
+            return os.stat(self.folder).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _rescan(self, mtime):
+        with os.scandir(self.folder) as it:
+            self._files = [e.name for e in it if e.is_file() and e.name.lower().endswith(IMAGE_EXTENSIONS)]
+        self._mtime = mtime
+        self.rescans += 1
+
+    def files(self):
+        """目前的檔名清單；資料夾被其他程序改動時（mtime 不同）才重新列目錄"""
+        mtime = self._dir_mtime()
+        with self._lock:
+            if mtime is None:
+                self._files, self._mtime = [], None
+            elif mtime != self._mtime:
+                self._rescan(mtime)
+            return self._files
+
+    def sample(self, k):
+        files = self.files()
+        if len(files) <= k:
+            return list(files)
+        return random.sample(files, k)
+
+    def add(self, filename):
+        """自己寫入新檔後呼叫，直接加進清單，不必重新列目錄"""
+        with self._lock:
+            stale = self._mtime is None
+            if filename not in self._files:
+                self._files.append(filename)
+            if not stale:
+                self._mtime = self._dir_mtime()
+
+    def __len__(self):
+        return len(self.files())
+
+
+def read_data_url_field(stream, field, out):
+    """從 JSON 串流中找出 field（data URL 字串），把 base64 內容邊讀邊解碼寫入 out
+
+    回傳其餘欄位組成的 dict（field 本身為空字串）。base64 字元不需要 JSON 跳脫，
+    只需處理部分序列化工具會輸出的 "\\/"。
+    """
+    key = f'"{field}"'.encode()
+    rest = bytearray()       # 圖片以外的 JSON 內容（很小）
+    pending = b""            # 還沒湊滿 4 個字元的 base64
+    state = "key"            # key → value（找開頭引號）→ prefix（略過 data:...;base64,）→ data → tail
+    buf = b""
+    found = False
+
+    while True:
+        chunk = stream.read(READ_CHUNK)
+        if not chunk:
+            break
+        buf += chunk
+        while buf:
+            if state == "key":
+                i = buf.find(key)
+                if i < 0:
+                    keep = len(key) - 1          # 鍵可能被切在兩個 chunk 之間
+                    rest += buf[:-keep] if len(buf) > keep else b""
+                    buf = buf[-keep:] if len(buf) > keep else buf
+                    break
+                rest += buf[:i + len(key)]
+                buf = buf[i + len(key):]
+                state = "value"
+            elif state == "value":
+                i = buf.find(b'"')
+                if i < 0:
+                    rest += buf
+                    buf = b""
+                    break
+                rest += buf[:i + 1]
+                buf = buf[i + 1:]
+                state = "prefix"
+            elif state == "prefix":
+                i = buf.find(b",")
+                q = buf.find(b'"')
+                if 0 <= q < (i if i >= 0 else len(buf)):
+                    raise ValueError("圖片資料格式錯誤")
+                if i < 0:
+                    if len(buf) > 256:
+                        raise ValueError("圖片資料格式錯誤")
+                    break
+                buf = buf[i + 1:]
+                state = "data"
+            elif state == "data":
+                i = buf.find(b'"')
+                data, buf = (buf, b"") if i < 0 else (buf[:i], buf[i:])
+                pending += data.replace(b"\\", b"")
+                usable = len(pending) - len(pending) % 4
+                if usable:
+                    out.write(base64.b64decode(pending[:usable]))
+                    pending = pending[usable:]
+                if i < 0:
+                    break
+                found = True
+                state = "tail"
+            else:
+                rest += buf
+                buf = b""
+    if state == "key":
+        rest += buf
+    if not found:
+        raise ValueError(f"缺少 {field}")
+    if pending:
+        out.write(base64.b64decode(pending + b"=" * (-len(pending) % 4)))
+    return json.loads(bytes(rest))
+
+
+def save_carousel_image(src, timestamp, folder=CAROUSEL_DIR):
+    """把 src（檔案物件）存成長邊不超過 MAX_EDGE 的壓縮圖，回傳檔名"""
+    filename = f"collage_{int(timestamp)}.{CAROUSEL_EXT}"
+    os.makedirs(folder, exist_ok=True)
+    with Image.open(src) as img:
+        img.draft("RGB", (MAX_EDGE, MAX_EDGE))
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        else:
+            img = img.convert("RGB")
+        img.thumbnail((MAX_EDGE, MAX_EDGE), Image.LANCZOS)
+        tmp_path = os.path.join(folder, f".{uuid.uuid4().hex[:8]}.tmp")
+        img.save(tmp_path, format=CAROUSEL_FORMAT, **CAROUSEL_OPTIONS)
+    os.replace(tmp_path, os.path.join(folder, filename))
+    return filename
+
+
+def spooled_buffer():
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
@@ -0,0 +1,160 @@
+"""背景拼貼生成工作佇列：POST 只負責收檔並回傳 job id，耗時的 AI 生成交給固定數量的 worker 執行"""
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from models import db, CollageJob
+
+FINISHED_STATUSES = ('done', 'failed')
+
+
+class QueueFullError(Exception):
+    """佇列已滿（執行中 + 等待中的工作數達到上限）"""
+
+
+class CollageJobQueue:
+    def __init__(self, app=None, max_workers=2, max_pending=8, keep_events=200):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.keep_events = keep_events    # 記憶體中保留事件紀錄的工作數
+        self.app = None
+        self._executor = None
+        self._active = 0                  # 執行中 + 等待中的工作數
+        self._events = OrderedDict()      # job_id -> [事件...]，給 SSE 使用
+        self._cond = threading.Condition()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_workers = app.config.get('COLLAGE_JOB_WORKERS', self.max_workers)
+        self.max_pending = app.config.get('COLLAGE_JOB_MAX_PENDING', self.max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='collage-job')
+
+    def recover_interrupted(self):
+        """伺服器重啟時，把上次沒跑完的工作標成失敗（上傳內容只存在記憶體，無法續跑）"""
+        now = time.time()
+        (CollageJob.query
+            .filter(CollageJob.status.notin_(FINISHED_STATUSES))
+            .update({'status': 'failed', 'error': '伺服器重新啟動，工作已中斷', 'updated_at': now},
+                    synchronize_session=False))
+        db.session.commit()
+
+    def submit(self, func, params):
+        """排入一個工作，func(params, report) 需回傳完成後的 collage_id"""
+        with self._cond:
+            if self._active >= self.max_workers + self.max_pending:
+                raise QueueFullError("目前生成的人太多了，請稍後再試")
+            self._active += 1
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        try:
+            db.session.add(CollageJob(id=job_id, status='queued', progress=0, created_at=now, updated_at=now))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._cond:
+                self._active -= 1
+            raise
+
+        self._push(job_id, 'status', {'status': 'queued', 'progress': 0})
+        self._executor.submit(self._run, job_id, func, params)
+        return job_id
+
+    def pending_count(self):
+        with self._cond:
+            return self._active
+
+    def _run(self, job_id, func, params):
+        with self.app.app_context():
+            try:
+                self._update(job_id, status='running', stage='started')
+
+                def report(stage, data=None, progress=None):
+                    self._update(job_id, stage=stage, progress=progress, image=(data or {}).get('img_path'))
+                    self._push(job_id, stage, dict(data or {}, progress=progress))
+
+                collage_id = func(params, report)
+                self._update(job_id, status='done', stage='done', progress=100, collage_id=collage_id)
+                self._push(job_id, 'done', {'status': 'done', 'progress': 100, 'collage_id': collage_id})
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ 拼貼工作 {job_id} 失敗: {e}")
+                self._update(job_id, status='failed', error=str(e))
+                self._push(job_id, 'failed', {'status': 'failed', 'error': str(e)})
+            finally:
+                db.session.remove()
+                with self._cond:
+                    self._active -= 1
+
+    def _update(self, job_id, status=None, stage=None, progress=None, image=None, collage_id=None, error=None):
+        job = db.session.get(CollageJob, job_id)
+        if job is None:
+            return
+        if status is not None:
+            job.status = status
+        if stage is not None:
+            job.stage = stage
+        if progress is not None:
+            job.progress = progress
+        if image is not None:
+            images = json.loads(job.images_json) if job.images_json else []
+            images.append(image)
+            job.images_json = json.dumps(images)
+        if collage_id is not None:
+            job.collage_id = collage_id
+        if error is not None:
+            job.error = error
+        job.updated_at = time.time()
+        db.session.commit()
+
+    def _push(self, job_id, event, data):
+        with self._cond:
+            events = self._events.setdefault(job_id, [])
+            events.append((event, data))
+            self._events.move_to_end(job_id)
+            while len(self._events) > self.keep_events:
+                self._events.popitem(last=False)
+            self._cond.notify_all()
+
+    def stream(self, job_id, heartbeat=15):
+        """產生 SSE 文字；job 若已不在記憶體中，只回傳資料庫裡的最終狀態"""
+        with self._cond:
+            known = job_id in self._events
+        if not known:
+            job = db.session.get(CollageJob, job_id)
+            if job is None:
+                yield _sse('failed', {'status': 'failed', 'error': '工作不存在'})
+            else:
+                yield _sse('status', job.to_dict())
+            return
+
+        sent = 0
+        while True:
+            with self._cond:
+                if sent >= len(self._events.get(job_id, [])):
+                    self._cond.wait(timeout=heartbeat)
+                events = self._events.get(job_id)
+                if events is not None:
+                    new_events = events[sent:]
+                    sent = len(events)
+            if events is None:
+                # 事件紀錄已被淘汰，改回傳資料庫裡的狀態
+                job = db.session.get(CollageJob, job_id)
+                yield _sse('status', job.to_dict() if job else {'status': 'failed', 'error': '工作不存在'})
+                return
+            if not new_events:
+                yield ": keep-alive\n\n"
+                continue
+            for event, data in new_events:
+                yield _sse(event, data)
+                if event in FINISHED_STATUSES:
+                    return
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -0,0 +1,200 @@
+"""伺服器端拼貼渲染：把 Collage.info_json 合成為 PNG，分條（strip）繪製並邊畫邊輸出
+
+image_info 的座標以 600x600 的畫布為基準（與前端 baseSize 相同），輸出時等比例放大。
+每張來源圖片只解碼一次，直接縮到這次渲染需要的最大尺寸，其他尺寸都由它縮小；
+來源圖、各尺寸小圖與旋轉結果放在同一個 LRU 快取，共用 cache_bytes 的位元組上限。
+輸出逐條壓縮成 PNG 的 IDAT chunk，整張畫布不會同時存在記憶體中，8000x8000 也只佔用一條的大小。
+"""
+import os
+import random
+import struct
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+BASE_CANVAS = 600          # image_info 座標使用的畫布大小
+MAX_RENDER_SIZE = 8000     # 允許的最大輸出邊長
+STRIP_HEIGHT = 256         # 每次繪製/輸出的高度
+BORDER_RATIO = 2 / BASE_CANVAS   # 與前端 .photo 的 2px 白框相同比例
+BACKGROUND = (255, 255, 255)
+
+
+def assign_images(image_info, images, seed):
+    """依前端 displayResult 的規則指定每個位置的圖片：洗牌後輪流使用，主圖只出現一次"""
+    rng = random.Random(seed)
+    image_list = list(images)
+    rng.shuffle(image_list)
+    assigned = []
+    for index in range(len(image_info)):
+        if not image_list:
+            break
+        img = image_list[index % len(image_list)]
+        assigned.append(img)
+        if img.get("is_target"):
+            image_list = [i for i in image_list if not i.get("is_target")]
+    return assigned
+
+
+def _image_bytes(img):
+    return img.size[0] * img.size[1] * len(img.getbands())
+
+
+class _ByteLRU:
+    """依位元組數淘汰的 LRU；超過上限時從最久沒用的開始丟，至少保留剛放入的那一項
+
+    cheap(key) 為 True 的項目（重建成本低的中間結果）優先淘汰。
+    """
+
+    def __init__(self, max_bytes, cheap=lambda key: False):
+        self.max_bytes = max_bytes
+        self.cheap = cheap
+        self.bytes = 0
+        self.peak_bytes = 0
+        self._items = OrderedDict()
+
+    def get(self, key, build):
+        item = self._items.get(key)
+        if item is not None:
+            self._items.move_to_end(key)
+            return item
+        item = build()
+        self._items[key] = item
+        self.bytes += _image_bytes(item)
+        while self.bytes > self.max_bytes and len(self._items) > 1:
+            victim = next((k for k in self._items if k != key and self.cheap(k)), None)
+            if victim is None:
+                victim = next(iter(self._items))
+            self.discard(victim)
+        self.peak_bytes = max(self.peak_bytes, self.bytes)
+        return item
+
+    def discard(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.bytes -= _image_bytes(item)
+
+
+class CollageRenderer:
+    def __init__(self, static_root, cache_bytes=256 * 1024 * 1024):
+        self.static_root = static_root     # img_path（/static/...）所在的根目錄
+        self.cache_bytes = cache_bytes     # 來源圖 + 小圖 + 旋轉結果合計的上限
+        self.last_peak_bytes = 0           # 上一次渲染時快取的最大佔用量
+
+    def _source_path(self, img_path):
+        return os.path.join(self.static_root, img_path.lstrip("/").replace("/", os.sep))
+
+    def _load_source(self, img_path, w, h):
+        """解碼來源圖片並縮放到 w x h（這次渲染中這張圖最大的尺寸），JPEG 直接以縮小比例解碼"""
+        with Image.open(self._source_path(img_path)) as src:
+            src.draft("RGB", (w, h))
+            return src.convert("RGB").resize((w, h), Image.LANCZOS)
+
+    @staticmethod
+    def _make_tile(source, w, h, border):
+        """由來源圖縮成 w x h（含白框）"""
+        if border > 0:
+            tile = Image.new("RGB", (w, h), (255, 255, 255))
+            inner_size = (max(1, w - 2 * border), max(1, h - 2 * border))
+            tile.paste(source.resize(inner_size, Image.LANCZOS) if source.size != inner_size else source,
+                       (border, border))
+        else:
+            tile = source.resize((w, h), Image.LANCZOS) if source.size != (w, h) else source
+        return tile.convert("RGBA")
+
+    def iter_png(self, info, size=BASE_CANVAS, seed=None):
+        """產生 PNG bytes 片段；可直接交給 Flask Response 串流，或寫入檔案"""
+        size = max(1, min(int(size), MAX_RENDER_SIZE))
+        scale = size / BASE_CANVAS
+        image_info = info.get("image_info", [])
+        images = info.get("images", [])
+        assigned = assign_images(image_info, images, seed)
+        border = max(0, round(BORDER_RATIO * size))
+
+        # 預先計算每張小圖的尺寸與位置，並依所在條帶分桶（保留原本順序以維持疊放次序）
+        strips = [[] for _ in range((size + STRIP_HEIGHT - 1) // STRIP_HEIGHT)]
+        largest = {}                  # img_path -> 這次渲染需要的最大 (w, h)
+        last_strip = {}               # 快取鍵 -> 最後一個用到它的條帶，畫完就可以丟掉
+        for pos, img in zip(image_info, assigned):
+            w = max(1, round(pos["w"] * scale))
+            h = max(1, round(pos["h"] * scale))
+            cx = (pos["x"] + pos["w"] / 2) * scale
+            cy = (pos["y"] + pos["h"] / 2) * scale
+            # 旋轉後的外接框半徑（保守估計，用來決定會落在哪些條帶）
+            half = (w * w + h * h) ** 0.5 / 2
+            top = max(0, int(cy - half))
+            bottom = min(size - 1, int(cy + half))
+            if bottom < 0 or top >= size:
+                continue
+            # 伺服器端渲染可能放大很多倍，使用原圖而不是縮圖
+            placement = (img.get("full_path", img["img_path"]), w, h, int(pos.get("rotate", 0)) % 360, cx, cy)
+            max_w, max_h = largest.get(placement[0], (0, 0))
+            largest[placement[0]] = (max(max_w, w), max(max_h, h))
+            for s in range(top // STRIP_HEIGHT, bottom // STRIP_HEIGHT + 1):
+                strips[s].append(placement)
+            # 來源圖與未旋轉的小圖只在第一次畫到這張圖時用來產生旋轉結果；旋轉結果要留到最後一條
+            path, _, _, angle = placement[:4]
+            first, last = top // STRIP_HEIGHT, bottom // STRIP_HEIGHT
+            for key, until in ((("source", path), first), (("tile", path, w, h), last if not angle else first),
+                               (("rotated", path, w, h, angle), last)):
+                last_strip[key] = max(last_strip.get(key, -1), until)
+
+        cache = _ByteLRU(self.cache_bytes, cheap=lambda key: key[0] == "source" or key[0] == "tile")
+        expires = [[] for _ in strips]
+        for key, s in last_strip.items():
+            expires[s].append(key)
+
+        def rotated_tile(img_path, w, h, angle):
+            def source():
+                return cache.get(("source", img_path), lambda: self._load_source(img_path, *largest[img_path]))
+
+            def tile():
+                return cache.get(("tile", img_path, w, h), lambda: self._make_tile(source(), w, h, border))
+
+            if not angle:
+                return tile()
+            # CSS rotate 為順時針，PIL 為逆時針
+            return cache.get(("rotated", img_path, w, h, angle),
+                             lambda: tile().rotate(-angle, resample=Image.BICUBIC, expand=True))
+
+        yield b"\x89PNG\r\n\x1a\n"
+        yield _png_chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+        compressor = zlib.compressobj(6)
+        for s, strip_tiles in enumerate(strips):
+            y0 = s * STRIP_HEIGHT
+            strip_h = min(STRIP_HEIGHT, size - y0)
+            strip = Image.new("RGB", (size, strip_h), BACKGROUND)
+            for img_path, w, h, angle, cx, cy in strip_tiles:
+                try:
+                    tile = rotated_tile(img_path, w, h, angle)
+                except OSError as e:
+                    print(f"渲染時讀不到圖片 {img_path}: {e}")
+                    continue
+                x = round(cx - tile.size[0] / 2)
+                y = round(cy - tile.size[1] / 2) - y0
+                strip.paste(tile, (x, y), tile)
+
+            # 每列前面加上 filter type 0，再交給 zlib 逐段壓縮
+            rows = np.asarray(strip).reshape(strip_h, size * 3)
+            raw = np.zeros((strip_h, size * 3 + 1), dtype=np.uint8)
+            raw[:, 1:] = rows
+            data = compressor.compress(raw.tobytes())
+            if data:
+                yield _png_chunk(b"IDAT", data)
+            # 之後的條帶用不到的圖立刻釋放，上限只需要容納同時跨過目前條帶的圖
+            for key in expires[s]:
+                cache.discard(key)
+        yield _png_chunk(b"IDAT", compressor.flush())
+        self.last_peak_bytes = cache.peak_bytes
+        yield _png_chunk(b"IEND", b"")
+
+    def render_to_file(self, info, path, size=BASE_CANVAS, seed=None):
+        with open(path, "wb") as f:
+            for chunk in self.iter_png(info, size, seed):
+                f.write(chunk)
+        return path
+
+
+def _png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
@@ -8,28 +8,81 @@ import math
 import random
 import json
 import io
+import numpy as np
 import time
+import secrets
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from werkzeug.utils import secure_filename
 from flask import jsonify, url_for
-from google import genai
-from google.genai import types
+from variant_cache import VariantCache, variant_cache_key
+from mask_cache import MaskCache
+from segmentation import SilhouetteSegmenter
+from derivatives import make_derivatives, make_derivatives_from_bytes, image_entry
+from atlas import build_atlas, atlas_file, ATLAS_DIR
+from ingest import read_limited, ingest_image, sniff_format, encode_jpeg, MAX_UPLOAD_BYTES
+from file_writer import AsyncFileWriter
+from retention import RetentionManager
+from layout_engine import generate_layout, DEFAULT_STRATEGY, STRATEGIES, TILE_RATIO
+from metrics import metrics
+from gemini_scheduler import (create_scheduler, throttle_info, ThrottledError, SchedulerTimeout, DEFAULT_RPM,
+                              DEFAULT_BURST, DEFAULT_MAX_CONCURRENT)
 
-load_dotenv()  # 讀取 .env 檔案
-api_key = os.getenv("API_KEY")
+# Gemini client 在第一次呼叫模型時才建立（google.genai 匯入約 0.5 秒），之後共用；
+# 測試或離線執行可以用 set_client() 換成假的 client
+client = None
+_client_lock = threading.Lock()
 
-# 設定 Gemini API 金鑰
-client = genai.Client(api_key=api_key)
+# 指定圖片儲存路徑（第一次寫檔時才建立資料夾）
+OUTPUT_DIR = os.path.join("static", "generated_images")
+UPLOAD_DIR = os.path.join("static", "uploads")
 
-MAX_UPLOAD_FILES = 100  # 預設最多保留 100 個檔案
+# AI 生成的並行設定
+AI_MAX_IMAGES = 10          # 每次生成的變體數量
+AI_CONCURRENCY = 4          # 同時送出的 generate_content 請求數
+AI_ATTEMPT_TIMEOUT = 60     # 單次請求最多等待秒數
+AI_DEADLINE = 180           # 整批生成最多等待秒數
+QUEUE_POLL_INTERVAL = 0.5   # 請求都還在排隊時，多久檢查一次是否已開始送出
 
-# 指定圖片儲存路徑
-OUTPUT_DIR = os.path.join("static", "generated_images")
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# 所有 Gemini 呼叫共用的速率排程（跨請求）；GEMINI_QUOTA_DB 設成 SQLite 檔案路徑時多個 worker 共用同一個上限
+scheduler = create_scheduler(
+    rpm=float(os.getenv("GEMINI_RPM", DEFAULT_RPM)),
+    burst=int(os.getenv("GEMINI_BURST", DEFAULT_BURST)),
+    max_concurrent=int(os.getenv("GEMINI_MAX_CONCURRENT", DEFAULT_MAX_CONCURRENT)),
+    quota_db=os.getenv("GEMINI_QUOTA_DB"),
+    enabled=os.getenv("GEMINI_SCHEDULER", "1") != "0",
+)
 
-def ai_generate(
-    image, 
-    max_images=10, 
-    prompt="""Generate a high-resolution, ultra-realistic portrait inspired by the uploaded reference image.  
+# 同一張上傳照片 + prompt 的 AI 變體快取
+variant_cache = VariantCache(OUTPUT_DIR, max_entries=200, index_path="variant_cache.json")
+
+# 形狀/文字遮罩快取（依畫布大小與文字）
+mask_cache = MaskCache(max_bytes=64 * 1024 * 1024)
+
+# 剪影分割模型（第一次使用時載入，之後共用）
+segmenter = SilhouetteSegmenter(max_side=1024)
+
+# 存檔與縮圖在背景執行
+file_writer = AsyncFileWriter(max_workers=2)
+
+
+def _on_evict(folder, filename):
+    if os.path.abspath(folder) == os.path.abspath(OUTPUT_DIR):
+        variant_cache.discard_files([filename])
+
+
+# 上傳圖片、生成圖片與圖集的保留策略（背景排程由 app 啟動）
+retention = RetentionManager([UPLOAD_DIR, OUTPUT_DIR, ATLAS_DIR], on_evict=_on_evict)
+
+
+def track_atlas(info):
+    """新建的圖集交給保留策略管理"""
+    path = atlas_file(info)
+    if path:
+        retention.track(path)
+
+DEFAULT_PROMPT = """Generate a high-resolution, ultra-realistic portrait inspired by the uploaded reference image.  
         The new person should resemble the original individual by about 30–50%, sharing the same gender and approximate age, but clearly be a different person.  
         Introduce noticeable changes in facial features, hairstyle, hair color, eye shape, nose shape, jawline, and expression to make the person look clearly different while maintaining overall familiarity.  
         Place the subject centered in the frame with a photographer’s portrait-style composition.  
@@ -39,66 +92,234 @@ def ai_generate(
         The background should feel harmonious with the original but not copy it.  
         Optionally modify color of the clothing to make it random, accessories, or angle slightly to increase distinction from the original while keeping the person recognizable.  
         Do not make it a clone or identical twin — keep identity uniqueness.
-        """,):
+        """
+
+def get_client():
+    """取得共用的 Gemini client，第一次呼叫時讀取 .env 的 API_KEY 並建立"""
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                from google import genai
+                load_dotenv()  # 讀取 .env 檔案
+                api_key = os.getenv("API_KEY")
+                if not api_key:
+                    raise RuntimeError("未設定 API_KEY，無法呼叫 Gemini")
+                client = genai.Client(api_key=api_key)
+    return client
+
+
+def set_client(new_client):
+    """替換共用的 client（例如 fake_genai.FakeClient）"""
+    global client
+    client = new_client
+
+
+@lru_cache(maxsize=None)
+def ensure_dir(path):
+    """建立資料夾（每個路徑只檢查一次）"""
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+AS_IS_FORMATS = ("jpg", "webp")   # 模型輸出為這些格式時原封不動存檔，不重新編碼
+
+
+def _transcode_generated(data, filename):
+    with Image.open(io.BytesIO(data)) as img:
+        rgb = img.convert("RGB")
+    file_writer.write_sync(os.path.join(OUTPUT_DIR, filename), encode_jpeg(rgb))
+    make_derivatives(rgb, OUTPUT_DIR, filename)
+
+
+def store_generated(data):
+    """把模型輸出交給背景寫檔執行緒，回傳 (檔名, futures)"""
+    ensure_dir(OUTPUT_DIR)
+    ext, _ = sniff_format(data)
+    if ext in AS_IS_FORMATS:
+        filename = f"edited_{uuid.uuid4().hex}.{ext}"
+        futures = [
+            file_writer.write(os.path.join(OUTPUT_DIR, filename), data),
+            file_writer.submit(make_derivatives_from_bytes, data, OUTPUT_DIR, filename),
+        ]
+    else:
+        # PNG 等無損格式檔案太大，轉成 JPEG（也在寫檔執行緒中進行）
+        filename = f"edited_{uuid.uuid4().hex}.jpg"
+        futures = [file_writer.submit(_transcode_generated, data, filename)]
+    return filename, futures
+
+
+def _generate_once(gen_client, image_bytes, mime_type, prompt):
+    """送出一次 generate_content，回傳第一張圖片的 bytes（沒有圖片時回傳 None）"""
+    from google.genai import types
+
+    metrics.inc('gemini_request_bytes_total', len(image_bytes))
+    started = time.perf_counter()
+    try:
+        response = gen_client.models.generate_content(
+            model='gemini-2.5-flash-image',
+            contents=[
+            types.Part.from_bytes(
+                data=image_bytes,
+                mime_type=mime_type,
+            ),
+            prompt
+            ]
+        )
+    except Exception:
+        metrics.observe('gemini_attempt_seconds', time.perf_counter() - started, outcome='failure')
+        metrics.inc('gemini_attempts_total', outcome='failure')
+        raise
+
+    image_data = None
+    candidates = response.candidates
+    if candidates and candidates[0].content and candidates[0].content.parts:
+        for part in candidates[0].content.parts:
+            if part.inline_data is not None:
+                image_data = part.inline_data.data
+                break
+    outcome = 'success' if image_data is not None else 'empty'
+    metrics.observe('gemini_attempt_seconds', time.perf_counter() - started, outcome=outcome)
+    metrics.inc('gemini_attempts_total', outcome=outcome)
+    if image_data is not None:
+        metrics.inc('gemini_response_bytes_total', len(image_data))
+    return image_data
+
+def _scheduled_generate(gen_client, image_bytes, mime_type, prompt, user, timeout, cancel, started_box):
+    """等 scheduler 放行才送出；429/5xx 轉成 ThrottledError，回報給 bucket 減速"""
+    with scheduler.slot(user, timeout=timeout, cancel=cancel):
+        started_box.append(time.monotonic())
+        try:
+            return _generate_once(gen_client, image_bytes, mime_type, prompt)
+        except Exception as e:
+            throttled, retry_after = throttle_info(e)
+            if throttled:
+                raise ThrottledError(e, retry_after) from e
+            raise
+
+def ai_generate(
+    image, 
+    max_images=AI_MAX_IMAGES, 
+    prompt=DEFAULT_PROMPT,
+    max_attempts=20,
+    concurrency=AI_CONCURRENCY,
+    attempt_timeout=AI_ATTEMPT_TIMEOUT,
+    deadline=AI_DEADLINE,
+    gen_client=None,
+    on_image=None,
+    mime_type=None,
+    user=None,):
+    """image 可以是檔案路徑或已編碼的圖片 bytes；回傳 [{"filename"}]，回傳時檔案與縮圖都已寫入
+
+    user 為排程的公平佇列鍵（例如來源 IP），同一個 user 的請求輪流和其他人的請求交錯放行。
+    """
     
     if not prompt or not image:
         return jsonify({"error": "缺少 prompt 或圖片"}), 400
     
+    gen_client = gen_client or get_client()
     images = []
+    write_futures = []
     attempt = 0
-    max_attempts = 20
+    unsent = 0  # 排隊逾時或取消、沒有真正送到模型的嘗試，不計入 max_attempts
     
-    try:
-        with open(image, 'rb') as f:
-            image_bytes = f.read()
-    except Exception as e:
-        return jsonify({"error": f"圖片讀取失敗: {str(e)}"}), 400
-
-    # 自動猜 MIME type
-    mime_type, _ = guess_type(image)
+    if isinstance(image, (bytes, bytearray)):
+        image_bytes = bytes(image)
+        mime_type = mime_type or sniff_format(image_bytes)[1]
+    else:
+        try:
+            with open(image, 'rb') as f:
+                image_bytes = f.read()
+        except Exception as e:
+            return jsonify({"error": f"圖片讀取失敗: {str(e)}"}), 400
+        # 自動猜 MIME type
+        mime_type = mime_type or guess_type(image)[0]
     if mime_type is None:
         mime_type = "image/jpeg"  # fallback，當不確定時用 jpeg
     
-    while len(images) < max_images and attempt < max_attempts:
-        attempt += 1
-        try:
-            response = client.models.generate_content(
-                model='gemini-2.5-flash-image',
-                contents=[
-                types.Part.from_bytes(
-                    data=image_bytes,
-                    mime_type=mime_type,
-                ),
-                prompt
-                ]
-            )
-
-            candidates = response.candidates
-            if not candidates or not candidates[0].content or not candidates[0].content.parts:
-                print(f"⚠️ 第 {attempt} 次未收到圖片，跳過")
-                continue
-            for part in candidates[0].content.parts:
-                if part.inline_data is not None:
-                    image_data = part.inline_data.data
-                    img = Image.open(io.BytesIO(image_data))
-                    
-                    # 儲存圖片到資料夾
-                    filename = f"edited_{uuid.uuid4().hex}.jpg"
-                    full_path = os.path.join(OUTPUT_DIR, filename)
-                    img.save(full_path, format="JPEG")
-                    
-                    images.append({
-                        "img": img,
-                        "filename": filename
-                    })
+    # 同時最多送出 concurrency 個請求；在途數量 + 已成功數量不超過 max_images，
+    # 所以全部成功時不會多花任何一次嘗試，失敗的才補送。真正送到模型的呼叫（含被限流的）
+    # 合計以 max_attempts 為上限，一個請求最多花 max_attempts 次配額
+    # 每個請求先在全域 scheduler 排隊，單次逾時從真正送出時才開始計算
+    # 執行緒池開到 max_attempts：逾時被放棄的請求仍佔著執行緒，不能讓它擋住補送的嘗試
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=max(1, max_attempts))
+    cancel = threading.Event()
+    in_flight = {}  # future -> (第幾次嘗試, [送出時間]，還在排隊時為空)
+    try:
+        while len(images) < max_images:
+            while (attempt - unsent < max_attempts
+                   and len(in_flight) < concurrency
+                   and len(images) + len(in_flight) < max_images):
+                attempt += 1
+                started_box = []
+                queue_timeout = max(0, deadline - (time.monotonic() - started))
+                future = executor.submit(_scheduled_generate, gen_client, image_bytes, mime_type, prompt,
+                                         user, queue_timeout, cancel, started_box)
+                in_flight[future] = (attempt, started_box)
+            if not in_flight:
+                break
 
-                    print(f"✅ 成功儲存第 {len(images)} 張：{filename}")
-                    break
-        except Exception as e:
-            print(f"❌ 第 {attempt} 次產生圖像失敗: {str(e)}")
-            continue
+            now = time.monotonic()
+            remaining = deadline - (now - started)
+            if remaining <= 0:
+                print(f"⏰ 超過整體時限 {deadline} 秒，停止生成（已取得 {len(images)} 張）")
+                break
+            # 等到最早一個請求逾時或整體時限，以先到者為準；都還在排隊時定期檢查
+            sent_times = [box[0] for _, box in in_flight.values() if box]
+            if sent_times:
+                wait_for = max(0, min(remaining, attempt_timeout - (now - min(sent_times))))
+            else:
+                wait_for = min(remaining, QUEUE_POLL_INTERVAL)
+            done, _ = wait(in_flight, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                n, box = in_flight.pop(future)
+                try:
+                    image_data = future.result()
+                except SchedulerTimeout as e:
+                    if not box:
+                        unsent += 1
+                    print(f"⏳ 第 {n} 次未送出: {str(e)}")
+                    continue
+                except ThrottledError as e:
+                    print(f"🚦 第 {n} 次被限流，等待後重送: {str(e)}")
+                    continue
+                except Exception as e:
+                    print(f"❌ 第 {n} 次產生圖像失敗: {str(e)}")
+                    continue
+                if image_data is None:
+                    print(f"⚠️ 第 {n} 次未收到圖片，跳過")
+                    continue
+                if len(images) >= max_images:
+                    continue
+                # 儲存圖片到資料夾（背景寫入，不解碼）
+                filename, futures = store_generated(image_data)
+                write_futures.extend(futures)
+                images.append({"filename": filename})
+
+                print(f"✅ 成功儲存第 {len(images)} 張：{filename}")
+                if on_image:
+                    on_image(images[-1], len(images))
+
+            # 單次請求逾時：放棄等待（執行緒無法強制中止，結果會被忽略），名額讓給下一次嘗試
+            now = time.monotonic()
+            for future, (n, box) in list(in_flight.items()):
+                if box and now - box[0] >= attempt_timeout:
+                    in_flight.pop(future)
+                    future.cancel()
+                    metrics.inc('gemini_attempts_total', outcome='timeout')
+                    print(f"⏰ 第 {n} 次產生圖像逾時（{attempt_timeout} 秒），跳過")
+    finally:
+        # 還在排隊的嘗試離開佇列，不再占用名額
+        cancel.set()
+        scheduler.wake()
+        executor.shutdown(wait=False, cancel_futures=True)
     if not images:
             raise RuntimeError("未成功生成任何圖片")
+    file_writer.wait(write_futures)  # 後續排版、圖集會讀縮圖
+    for item in images:
+        retention.track(os.path.join(OUTPUT_DIR, item["filename"]))
     return images
 
 # def ai_generate(
@@ -171,16 +392,6 @@ def ai_generate(
 #             raise RuntimeError("未成功生成任何圖片")
 #     return images
 
-def cleanup_upload_folder(upload_folder, max_files=MAX_UPLOAD_FILES):
-    files = [os.path.join(upload_folder, f) for f in os.listdir(upload_folder) if os.path.isfile(os.path.join(upload_folder, f))]
-    if len(files) > max_files:
-        files.sort(key=lambda x: os.path.getctime(x))
-        for f in files[:len(files) - max_files]:
-            try:
-                os.remove(f)
-            except Exception as err:
-                print(f"刪除檔案失敗: {f} ({err})")
-
 def create_rectangle_mask(canvas):
     return None
 
@@ -226,68 +437,93 @@ def create_heart_mask(canvas):
     draw.polygon(points, fill=255)
     return mask
 
+FONT_PATH = "msjh.ttc"
+
+@lru_cache(maxsize=4)
+def _font_bytes(font_path):
+    """字型檔只讀一次；讀不到時回傳 None"""
+    try:
+        with open(font_path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+@lru_cache(maxsize=16)
+def load_font(fontsize, font_path=FONT_PATH):
+    """從快取的字型檔內容建立指定尺寸的字型；BytesIO 從頭整段讀取時回傳同一個 bytes 物件，
+    各尺寸共用一份內容，不會重複讀檔或複製；只快取少量常用尺寸"""
+    data = _font_bytes(font_path)
+    if data is not None:
+        try:
+            return ImageFont.truetype(io.BytesIO(data), fontsize)
+        except OSError:
+            pass
+    try:
+        return ImageFont.load_default(fontsize)
+    except TypeError:  # 舊版 Pillow 的預設字型不能調整大小
+        return ImageFont.load_default()
+
 def create_text_mask(canvas, text, max_fill_ratio=0.8):
     mask = Image.new("L", canvas.size, 0)
     draw = ImageDraw.Draw(mask)
     width, height = canvas.size
-    try:
-        font_path = "msjh.ttc"
-        fontsize = 10
-        font = ImageFont.truetype(font_path, fontsize)
-    except:
-        font = ImageFont.load_default()
-        fontsize = 10
+
+    def text_bbox(fontsize):
+        return draw.textbbox((0, 0), text, font=load_font(fontsize), stroke_width=max(1, fontsize // 30))
+
+    def fits(fontsize):
+        bbox = text_bbox(fontsize)
+        return bbox[2] - bbox[0] < width * max_fill_ratio and bbox[3] - bbox[1] < height * max_fill_ratio
+
+    # 二分搜尋能放進畫布的最大字級
+    lo, hi = 1, max(width, height) * 2
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid - 1
+    fontsize = lo
+    font = load_font(fontsize)
     stroke_width = max(1, fontsize // 30)
-    while True:
-        bbox = draw.textbbox((0, 0), text, font=font, stroke_width=stroke_width)
-        text_w = bbox[2] - bbox[0]
-        text_h = bbox[3] - bbox[1]
-        if text_w >= width * max_fill_ratio or text_h >= height * max_fill_ratio:
-            fontsize -= 2
-            stroke_width = max(1, fontsize // 30)
-            font = ImageFont.truetype(font_path, fontsize) if font_path else ImageFont.load_default()
-            break
-        fontsize += 2
-        stroke_width = max(1, fontsize // 30)
-        font = ImageFont.truetype(font_path, fontsize) if font_path else ImageFont.load_default()
-    bbox = draw.textbbox((0, 0), text, font=font, stroke_width=stroke_width)
+    bbox = text_bbox(fontsize)
     x = (width - (bbox[2] - bbox[0])) // 2 - bbox[0]
     y = (height - (bbox[3] - bbox[1])) // 2 - bbox[1]
     draw.text((x, y), text, font=font, fill=255, stroke_width=stroke_width, stroke_fill=255)
     return mask
 
 def create_silhouette_mask(canvas, path):
-    import cv2
-    import mediapipe as mp
-    import numpy as np
-    img = cv2.imread(path)
-    if img is None:
-        raise FileNotFoundError(f"讀不到圖片喔：{path}")
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    with mp.solutions.selfie_segmentation.SelfieSegmentation(model_selection=1) as segment:
-        result = segment.process(img_rgb)
-        mask = result.segmentation_mask
-    binary_mask = (mask > 0.5).astype(np.uint8) * 255
-    h, w = img.shape[:2]
-    kernel_size = max(7, int(min(w, h) * 0.07) // 2 * 2 + 1)
-    blurred_mask = cv2.GaussianBlur(binary_mask, (kernel_size, kernel_size), 0)
-    smooth_mask = (blurred_mask > 127).astype(np.uint8) * 255
-    mask = Image.fromarray(smooth_mask).resize(canvas.size).convert("L")
+    return segmenter.mask_for(path, canvas.size)
+
+# 只跟畫布大小（和文字）有關的遮罩，放進快取重複使用
+CACHEABLE_MASKS = {
+    "circle": create_circle_mask,
+    "star": create_star_mask,
+    "heart": create_heart_mask,
+}
+
+def get_mask(canvas, shape, custom_mask_path=None, text_input=None, drawn_shape_file=None, as_array=False):
+    """回傳 L 模式遮罩（rectangle 為 None）；as_array=True 時回傳 NumPy 陣列，快取中的遮罩不可修改"""
+    if shape in CACHEABLE_MASKS or shape == "text_mask":
+        if shape == "text_mask":
+            if not text_input:
+                raise ValueError("文字遮罩需要提供 text_input")
+            key = (shape, canvas.size, text_input)
+            build = lambda: create_text_mask(canvas, text_input)
+        else:
+            key = (shape, canvas.size, None)
+            build = lambda: CACHEABLE_MASKS[shape](canvas)
+        mask, arr = mask_cache.get(key, build)
+        return arr if as_array else mask
+
+    mask = _build_uncached_mask(canvas, shape, custom_mask_path, drawn_shape_file)
+    if as_array and mask is not None:
+        return np.asarray(mask)
     return mask
 
-def get_mask(canvas, shape, custom_mask_path=None, text_input=None, drawn_shape_file=None):
+def _build_uncached_mask(canvas, shape, custom_mask_path=None, drawn_shape_file=None):
     if shape == "rectangle":
         return create_rectangle_mask(canvas)
-    elif shape == "circle":
-        return create_circle_mask(canvas)
-    elif shape == "star":
-        return create_star_mask(canvas)
-    elif shape == "heart":
-        return create_heart_mask(canvas)
-    elif shape == "text_mask":
-        if not text_input:
-            raise ValueError("文字遮罩需要提供 text_input")
-        return create_text_mask(canvas, text_input)
     elif shape == "custom_silhouette":
         if not custom_mask_path:
             raise ValueError("custom_silhouette 形狀需要提供 custom_mask_path")
@@ -304,17 +540,11 @@ def get_mask(canvas, shape, custom_mask_path=None, text_input=None, drawn_shape_
     else:
         return None
 
-def paste_jittered_grid_photos(generated_images, canvas_size=(600, 600), grid=(30, 30), jitter_ratio=0.2, shape="rectangle", target_img=None, custom_mask_path=None, text_input=None, drawn_shape_file=None):
-    canvas = Image.new("RGBA", canvas_size, (255, 255, 255, 0))
+def _jittered_candidates_loop(canvas_size, grid, jitter_ratio, mask):
+    """逐格用 random + mask.getpixel 產生候選位置（舊版做法，保留給 benchmark 對照）"""
     grid_w, grid_h = grid
     cell_w = canvas_size[0] // grid_w
     cell_h = canvas_size[1] // grid_h
-    mask = get_mask(canvas, shape, custom_mask_path, text_input, drawn_shape_file)
-    if not target_img:
-        raise ValueError("主圖找不到，是不是忘記丟進來?")
-    
-    image_info = []
-    images = []
     candidate_cells = []
     
     # 生成所有可能的位置
@@ -333,21 +563,51 @@ def paste_jittered_grid_photos(generated_images, canvas_size=(600, 600), grid=(3
                     continue
             candidate_cells.append((cx, cy))
     
+    rotations = [random.randint(0, 360) for _ in candidate_cells]
+    return candidate_cells, rotations
+
+def paste_jittered_grid_photos(generated_images, canvas_size=(600, 600), grid=(30, 30), jitter_ratio=0.2, shape="rectangle", target_img=None, custom_mask_path=None, text_input=None, drawn_shape_file=None, seed=None, vectorized=True, strategy=DEFAULT_STRATEGY):
+    """排版位置由 (strategy, seed) 完全決定；seed 為 None 時隨機產生一個並記在回傳的 layout 中"""
+    canvas = Image.new("RGBA", canvas_size, (255, 255, 255, 0))
+    grid_w, grid_h = grid
+    cell_w = canvas_size[0] // grid_w
+    cell_h = canvas_size[1] // grid_h
+    with metrics.timer('stage_seconds', stage='mask'):
+        mask = get_mask(canvas, shape, custom_mask_path, text_input, drawn_shape_file, as_array=vectorized)
+    if not target_img:
+        raise ValueError("主圖找不到，是不是忘記丟進來?")
+    
+    image_info = []
+    images = []
+    
+    # 生成所有可能的位置（同一個 seed 與策略一定得到相同的排版）
+    if seed is None:
+        seed = secrets.randbelow(2 ** 31)
+    spacing = min(cell_w, cell_h)
+    with metrics.timer('stage_seconds', stage='layout'):
+        if vectorized:
+            # 網格維持原本的格數與各軸格子大小；泊松取樣依遮罩面積調整間距
+            options = {"grid": grid, "jitter_ratio": jitter_ratio} if strategy == "grid" else {}
+            candidate_cells, rotations, spacing, scales = generate_layout(
+                canvas_size, spacing, mask, strategy=strategy, seed=seed, adaptive=(strategy == "poisson"),
+                **options)
+        else:
+            candidate_cells, rotations = _jittered_candidates_loop(canvas_size, grid, jitter_ratio, mask)
+            scales = [1.0] * len(candidate_cells)
+    
     if not candidate_cells:
         raise ValueError("整張圖都沒地方貼啦，調整一下 shape 或 grid")
     
-    target_size = int(min(cell_w, cell_h) * 1.5)
-    orig_w, orig_h = target_img["img"].size
+    target_size = int(spacing * TILE_RATIO)
+    orig_w, orig_h = target_img["size"]
     scale = min(target_size / orig_w, target_size / orig_h)
-    new_w = int(orig_w * scale)
-    new_h = int(orig_h * scale)
     
-    for i, pos in enumerate(candidate_cells):
-        # 計算圖片尺寸（假設所有圖片都用相同的縮放邏輯）
-        # 這裡用一個標準尺寸，前端會重新處理
-        
+    for pos, rotate_angle, tile_scale in zip(candidate_cells, rotations, scales):
+        # 計算圖片尺寸：標準尺寸乘上策略給的倍率（distance 策略內部放大、邊緣縮小）
+        # 前端會依 w/h 重新處理
+        new_w = int(orig_w * scale * tile_scale)
+        new_h = int(orig_h * scale * tile_scale)
         top_left = (pos[0] - new_w // 2, pos[1] - new_h // 2)
-        rotate_angle = random.randint(0, 360)
         
         image_info.append({
             "x": top_left[0],
@@ -357,58 +617,135 @@ def paste_jittered_grid_photos(generated_images, canvas_size=(600, 600), grid=(3
             "rotate": rotate_angle
         })
     
-    images.append({
-        "img_path": f"/static/uploads/{target_img['filename']}", "is_target": True
-    })
+    # img_path 指向接近繪製尺寸的縮圖，full_path 為原圖
+    display_px = max(max(p["w"], p["h"]) for p in image_info)
+    images.append(image_entry("/static/uploads", UPLOAD_DIR, target_img['filename'], True, display_px))
     for img in generated_images:
-        images.append({
-            "img_path": f"/static/generated_images/{img['filename']}", "is_target": False
-        })
+        images.append(image_entry("/static/generated_images", OUTPUT_DIR, img['filename'], False, display_px))
     
     return {
         "image_info": image_info,
-        "images": images
+        "images": images,
+        "layout": {"strategy": strategy if vectorized else "loop", "seed": seed, "spacing": round(spacing, 2)}
     }
 
-def generate_collage_info_from_request(request, upload_folder, max_upload_files=100):
-    try:
-        cleanup_upload_folder(upload_folder, max_upload_files)
-    except Exception as cleanup_err:
-        print(f"清理舊檔案時出錯：{cleanup_err}")
-        
-    shape = request.form.get("shape", "rectangle")
+def read_collage_request(request):
+    """把 request 裡需要的表單欄位與檔案讀進記憶體，讓後續工作可以離開 request 執行"""
     uploaded_file = request.files.get("images")
     mask_file = request.files.get("mask_image")
-    text_input = request.form.get("text_input") or None
     drawn_shape_file = request.files.get("drawn_shape") or None
+    if not uploaded_file:
+        raise ValueError("沒有收到上傳的圖片")
+
+    params = {
+        "client_id": (request.headers.get("X-Forwarded-For") or request.remote_addr or "").split(",")[0].strip(),
+        "shape": request.form.get("shape", "rectangle"),
+        "text_input": request.form.get("text_input") or None,
+        "layout_strategy": request.form.get("layout", DEFAULT_STRATEGY),
+        "upload_bytes": read_limited(uploaded_file.stream, MAX_UPLOAD_BYTES),
+        "mask_filename": None,
+        "mask_bytes": None,
+        "drawn_shape_bytes": read_limited(drawn_shape_file.stream, MAX_UPLOAD_BYTES) if drawn_shape_file else None,
+    }
+    if params["layout_strategy"] not in STRATEGIES:
+        raise ValueError(f"不支援的排版策略: {params['layout_strategy']}")
+    if mask_file and mask_file.filename != "":
+        params["mask_filename"] = mask_file.filename
+        params["mask_bytes"] = read_limited(mask_file.stream, MAX_UPLOAD_BYTES)
+    return params
+
+def generate_collage_info(params, upload_folder, on_progress=None):
+    """依 read_collage_request 的結果產生拼貼資訊
+
+    on_progress(stage, data) 會在各階段被呼叫：upload_saved、image_generated（每張 AI 圖片）、layout_done
+    """
+    def report(stage, data=None):
+        if on_progress:
+            on_progress(stage, data or {})
+
+    shape = params["shape"]
+    text_input = params["text_input"]
+    drawn_shape_file = io.BytesIO(params["drawn_shape_bytes"]) if params["drawn_shape_bytes"] else None
 
     filename = f"{uuid.uuid4().hex}.jpg"
-    filepath = os.path.join(upload_folder, filename)
+    filepath = os.path.join(ensure_dir(upload_folder), filename)
 
-    # 儲存原圖
-    img = Image.open(uploaded_file.stream).convert("RGB")
-    img.save(filepath, format="JPEG", quality=90)
+    # 儲存原圖（解碼時就縮小、套用 EXIF 方向，長邊不超過 MAX_LONG_EDGE）
+    metrics.inc('upload_bytes_total', len(params["upload_bytes"]))
+    with metrics.timer('stage_seconds', stage='decode'):
+        img, ingest_stats = ingest_image(params["upload_bytes"])
+    params["upload_bytes"] = None  # 原始檔案不再需要，提早釋放
+    print(f"📥 上傳圖片 {ingest_stats['source_size']} → {ingest_stats['size']}，"
+          f"解碼 {ingest_stats['decode_ms']}ms，估計峰值 {ingest_stats['est_peak_bytes'] / 1e6:.1f}MB")
+    # 只編碼一次：同一份 bytes 在背景寫檔，也直接送給 Gemini
+    with metrics.timer('stage_seconds', stage='encode'):
+        upload_jpeg = encode_jpeg(img)
+    write_futures = [
+        file_writer.write(filepath, upload_jpeg),
+        file_writer.submit(make_derivatives, img, upload_folder, filename),
+    ]
+    report("upload_saved", {"img_path": f"/static/uploads/{filename}", "ingest": ingest_stats})
 
-    # 準備主圖資訊
-    target_image_dict = {"img": img, "filename": filename}
+    # 準備主圖資訊（排版只需要尺寸）
+    target_image_dict = {"size": img.size, "filename": filename}
     
-    # 生成 AI 圖片
-    generated_images = ai_generate(filepath)
+    # 生成 AI 圖片（同一張照片已生成過就直接沿用）
+    def on_image(item, count):
+        report("image_generated", {"img_path": f"/static/generated_images/{item['filename']}", "count": count})
+
+    cache_key = variant_cache_key(img, DEFAULT_PROMPT)
+    del img  # 之後只用 bytes，縮圖工作仍持有自己的參照
+    cached_filenames = variant_cache.get(cache_key)
+    metrics.inc('variant_cache_lookups_total', outcome='hit' if cached_filenames else 'miss')
+    if cached_filenames:
+        print(f"♻️ 變體快取命中，沿用 {len(cached_filenames)} 張圖片")
+        generated_images = [{"filename": f} for f in cached_filenames]
+        for f in cached_filenames:
+            retention.touch(os.path.join(OUTPUT_DIR, f))
+        for count, item in enumerate(generated_images, 1):
+            on_image(item, count)
+    else:
+        with metrics.timer('stage_seconds', stage='ai_generate'):
+            generated_images = ai_generate(upload_jpeg, mime_type="image/jpeg", on_image=on_image,
+                                           user=params.get("client_id"))
+        if len(generated_images) >= AI_MAX_IMAGES:
+            variant_cache.put(cache_key, [item["filename"] for item in generated_images])
     
     # 處理自訂遮罩
     custom_mask_path = None
-    if shape == "custom_silhouette" and mask_file and mask_file.filename != "":
-        mask_filename = secure_filename(mask_file.filename)
+    if shape == "custom_silhouette" and params["mask_bytes"]:
+        mask_filename = secure_filename(params["mask_filename"])
         custom_mask_path = os.path.join(upload_folder, mask_filename)
-        mask_file.save(custom_mask_path)
+        with open(custom_mask_path, "wb") as f:
+            f.write(params["mask_bytes"])
+        retention.track(custom_mask_path)
+
+    with metrics.timer('stage_seconds', stage='upload_write'):
+        file_writer.wait(write_futures)  # 排版會檢查主圖縮圖是否存在
+    retention.track(filepath)
 
     # 生成位置資訊
     result = paste_jittered_grid_photos(
         generated_images, canvas_size=(600, 600), grid=(18, 18), shape=shape, target_img=target_image_dict,
-        custom_mask_path=custom_mask_path, text_input=text_input, drawn_shape_file=drawn_shape_file
+        custom_mask_path=custom_mask_path, text_input=text_input, drawn_shape_file=drawn_shape_file,
+        strategy=params.get("layout_strategy") or DEFAULT_STRATEGY, seed=params.get("layout_seed")
     )
+    report("layout_done", {"count": len(result["image_info"])})
+
+    # 打包圖集失敗不影響拼貼本身，前端會退回逐張下載
+    try:
+        with metrics.timer('stage_seconds', stage='atlas'):
+            build_atlas(result)
+        track_atlas(result)
+    except Exception as atlas_err:
+        print(f"產生圖集失敗：{atlas_err}")
     
     return {
         "image_info": result["image_info"],
-        "images": result["images"]
-    }
\ No newline at end of file
+        "images": result["images"],
+        "atlas": result.get("atlas"),
+        "layout": result["layout"]
+    }
+
+def generate_collage_info_from_request(request, upload_folder):
+    return generate_collage_info(read_collage_request(request), upload_folder)
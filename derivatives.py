@@ -0,0 +1,76 @@
+"""縮圖（衍生圖）管線：原圖存檔時一併產生幾種尺寸的 WebP 縮圖，拼貼只下載需要的大小
+
+縮圖放在原圖資料夾下的 thumbs/，檔名為 <原檔名主體>_<長邊像素>.<副檔名>。
+"""
+import io
+import os
+
+from PIL import Image, features
+
+THUMB_SIZES = (64, 128, 256, 512)    # 縮圖長邊像素，由小到大
+THUMB_DIR = "thumbs"
+DISPLAY_SCALE = 2                    # 高解析度螢幕需要的倍率
+
+if features.check("webp"):
+    THUMB_FORMAT, THUMB_EXT, THUMB_OPTIONS = "WEBP", "webp", {"quality": 80, "method": 4}
+else:
+    THUMB_FORMAT, THUMB_EXT, THUMB_OPTIONS = "JPEG", "jpg", {"quality": 82, "optimize": True}
+
+
+def thumb_filename(filename, size):
+    stem = os.path.splitext(filename)[0]
+    return f"{THUMB_DIR}/{stem}_{size}.{THUMB_EXT}"
+
+
+def make_derivatives(img, folder, filename, sizes=THUMB_SIZES):
+    """為 folder/filename 產生各尺寸縮圖，從大到小逐級縮放以減少重複運算；回傳 {size: 相對路徑}"""
+    os.makedirs(os.path.join(folder, THUMB_DIR), exist_ok=True)
+    current = img.convert("RGB") if img.mode not in ("RGB", "L") else img
+    result = {}
+    for size in sorted(sizes, reverse=True):
+        if max(current.size) > size:
+            current = current.copy()
+            current.thumbnail((size, size), Image.LANCZOS)
+        rel_path = thumb_filename(filename, size)
+        current.save(os.path.join(folder, rel_path), format=THUMB_FORMAT, **THUMB_OPTIONS)
+        result[size] = rel_path
+    return result
+
+
+def make_derivatives_from_bytes(data, folder, filename, sizes=THUMB_SIZES):
+    """從已編碼的圖片 bytes 產生縮圖；JPEG 以 draft 直接解碼成接近最大縮圖的尺寸"""
+    with Image.open(io.BytesIO(data)) as img:
+        largest = max(sizes)
+        img.draft("RGB", (largest, largest))
+        img.load()
+        return make_derivatives(img, folder, filename, sizes)
+
+
+def remove_derivatives(folder, filename, sizes=THUMB_SIZES):
+    for size in sizes:
+        path = os.path.join(folder, thumb_filename(filename, size))
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def pick_thumb_size(display_px, sizes=THUMB_SIZES):
+    """選出能涵蓋 display_px（已乘上螢幕倍率）的最小縮圖尺寸，都不夠大則回傳 None（使用原圖）"""
+    needed = display_px * DISPLAY_SCALE
+    for size in sorted(sizes):
+        if size >= needed:
+            return size
+    return None
+
+
+def image_entry(url_prefix, folder, filename, is_target, display_px):
+    """組出拼貼 images 的一筆資料：img_path 指向適合排版大小的縮圖，full_path 保留原圖"""
+    full_path = f"{url_prefix}/{filename}"
+    img_path = full_path
+    size = pick_thumb_size(display_px)
+    if size is not None:
+        rel_path = thumb_filename(filename, size)
+        if os.path.isfile(os.path.join(folder, rel_path)):
+            img_path = f"{url_prefix}/{rel_path}"
+    return {"img_path": img_path, "full_path": full_path, "is_target": is_target}
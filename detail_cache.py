@@ -0,0 +1,128 @@
+"""拼貼詳細資料（/collage/<id>）的回應快取
+
+快取的是已序列化好的回應內容，命中時不必查資料庫、解析 info_json 或重新 jsonify。
+排行榜或公開狀態改變時呼叫 invalidate(collage_id) 清掉該拼貼的所有版本。
+
+後端可替換：
+- MemoryCacheBackend：單一程序內的 LRU + TTL
+- RedisCacheBackend：多個 worker 共用（需安裝 redis 套件，任何 Redis 相容服務皆可）
+"""
+import threading
+import time
+from collections import OrderedDict
+
+DETAIL_VARIANTS = ('json', 'compact')
+
+
+class MemoryCacheBackend:
+    def __init__(self, max_entries=500, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()     # key -> (到期時間, 值)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    def __init__(self, url, ttl=60):
+        import redis  # 選用套件，只有設定 Redis 時才需要
+        self.ttl = ttl
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value):
+        self._client.set(key, value, ex=self.ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self._client.delete(*keys)
+
+    def __len__(self):
+        return -1  # Redis 端的數量不在這裡統計
+
+
+class DetailCache:
+    def __init__(self, backend, prefix='collage_detail'):
+        self.backend = backend
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def _key(self, collage_id, variant):
+        return f"{self.prefix}:{collage_id}:{variant}"
+
+    def get(self, collage_id, variant):
+        try:
+            value = self.backend.get(self._key(collage_id, variant))
+        except Exception as e:
+            print(f"讀取詳細資料快取失敗: {e}")
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, collage_id, variant, body):
+        try:
+            self.backend.set(self._key(collage_id, variant), body)
+        except Exception as e:
+            print(f"寫入詳細資料快取失敗: {e}")
+
+    def invalidate(self, collage_id):
+        try:
+            self.backend.delete(*(self._key(collage_id, v) for v in DETAIL_VARIANTS))
+        except Exception as e:
+            print(f"清除詳細資料快取失敗: {e}")
+        with self._lock:
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'backend': type(self.backend).__name__,
+                'entries': len(self.backend),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+
+def create_detail_cache(url=None, max_entries=500, ttl=60):
+    """url 為 redis:// 或 rediss:// 時使用 Redis，否則使用程序內快取"""
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return DetailCache(RedisCacheBackend(url, ttl=ttl))
+    return DetailCache(MemoryCacheBackend(max_entries=max_entries, ttl=ttl))
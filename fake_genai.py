@@ -0,0 +1,76 @@
+"""離線用的假 Gemini client，介面與 genai.Client 的 models.generate_content 相同，方便不連網測速"""
+import io
+import random
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+from PIL import Image
+
+
+class _FakeModels:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def generate_content(self, model=None, contents=None, config=None):
+        return self._owner._respond()
+
+
+class FakeAPIError(Exception):
+    """模擬 google.genai.errors.APIError（有 code 屬性）"""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FakeClient:
+    """模擬 genai.Client
+
+    latency: 每次呼叫的平均延遲（秒），jitter 為上下浮動比例
+    failure_rate: 丟出例外的機率
+    empty_rate: 回傳沒有圖片（candidates 為空）的機率
+    quota_rps: 模擬供應商的速率上限（每秒請求數），超過時立即丟出 429 RESOURCE_EXHAUSTED
+    """
+
+    def __init__(self, latency=1.0, jitter=0.2, failure_rate=0.0, empty_rate=0.0, image_size=(256, 256), seed=None,
+                 quota_rps=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.empty_rate = empty_rate
+        self.image_size = image_size
+        self.models = _FakeModels(self)
+        self.calls = 0
+        self.throttled = 0
+        self.quota_rps = quota_rps
+        self._recent = deque()          # 最近一秒內被接受的呼叫時間
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _respond(self):
+        with self._lock:
+            self.calls += 1
+            if self.quota_rps is not None:
+                now = time.monotonic()
+                while self._recent and now - self._recent[0] >= 1.0:
+                    self._recent.popleft()
+                if len(self._recent) >= self.quota_rps:
+                    self.throttled += 1
+                    raise FakeAPIError(429, "RESOURCE_EXHAUSTED: quota exceeded")
+                self._recent.append(now)
+            delay = self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter))
+            roll = self._rng.random()
+            color = tuple(self._rng.randint(0, 255) for _ in range(3))
+        time.sleep(max(0, delay))
+
+        if roll < self.failure_rate:
+            raise RuntimeError("fake genai: simulated failure")
+        if roll < self.failure_rate + self.empty_rate:
+            return SimpleNamespace(candidates=[])
+
+        buf = io.BytesIO()
+        Image.new("RGB", self.image_size, color).save(buf, format="JPEG")
+        part = SimpleNamespace(inline_data=SimpleNamespace(data=buf.getvalue(), mime_type="image/jpeg"))
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
@@ -0,0 +1,55 @@
+"""背景寫檔：把存檔與縮圖產生移出生成流程，呼叫端只在需要讀檔前等待
+
+寫入先寫到同目錄的暫存檔再 os.replace，其他人不會讀到寫一半的檔案。
+"""
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class AsyncFileWriter:
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='file-writer')
+        self._lock = threading.Lock()
+        self.written_files = 0
+        self.written_bytes = 0
+
+    def write(self, path, data):
+        """背景寫入 bytes，回傳 Future"""
+        return self._executor.submit(self.write_sync, path, data)
+
+    def submit(self, func, *args, **kwargs):
+        """在寫檔執行緒執行其他 I/O 工作（例如產生縮圖）"""
+        return self._executor.submit(func, *args, **kwargs)
+
+    @staticmethod
+    def wait(futures, timeout=None):
+        """等待所有 futures 完成，任何一個失敗就丟出它的例外"""
+        done, not_done = wait(futures, timeout=timeout)
+        if not_done:
+            raise TimeoutError(f"{len(not_done)} 個寫檔工作未在時限內完成")
+        for future in done:
+            future.result()
+
+    def stats(self):
+        with self._lock:
+            return {'written_files': self.written_files, 'written_bytes': self.written_bytes}
+
+    def write_sync(self, path, data):
+        """在目前執行緒寫入（給已在寫檔執行緒中的工作使用）"""
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self.written_files += 1
+            self.written_bytes += len(data)
+        return path
@@ -0,0 +1,359 @@
+"""Gemini 呼叫的全域排程：同一程序內所有請求（以及多個 worker）共用同一個速率上限
+
+- token bucket：每秒補充 rate 個 token、最多累積 burst 個；另外限制本程序同時進行的呼叫數 max_concurrent
+- 多個 worker 時以 SQLite 檔案（SQLiteQuota）共用 bucket 狀態與冷卻時間，每次取 token 是一個
+  BEGIN IMMEDIATE 交易；未設定時使用程序內的 LocalQuota
+- 收到 429 / 5xx 時速率減半並暫停（冷卻時間依 Retry-After 或指數退避），之後每次成功慢慢加回（AIMD），
+  冷卻期間其他呼叫收到的限流錯誤不會重複減半
+- 等待中的呼叫依使用者輪流放行（round robin），一個使用者送出大量請求不會讓其他人一直排隊
+- stats() 回報排隊數、執行中數量、等待時間、目前速率與被限流次數
+"""
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from metrics import metrics
+
+DEFAULT_RPM = 120                 # 每分鐘呼叫數上限
+DEFAULT_BURST = 20
+DEFAULT_MAX_CONCURRENT = 16       # 本程序同時進行的呼叫數
+MIN_RATE_RATIO = 0.05             # 速率最低降到上限的 5%
+RECOVERY_RATIO = 0.05             # 每次成功加回上限的 5%
+BASE_BACKOFF = 1.0                # 第一次限流的冷卻秒數，之後加倍
+MAX_BACKOFF = 60.0
+THROTTLE_STATUS = (429, 500, 502, 503, 504)
+THROTTLE_MARKERS = ("RESOURCE_EXHAUSTED", "UNAVAILABLE")    # google.genai APIError.status
+
+
+class SchedulerTimeout(TimeoutError):
+    pass
+
+
+class ThrottledError(RuntimeError):
+    """模型回傳限流或暫時性錯誤（429 / 5xx），scheduler 冷卻後重送；已送出的呼叫仍計入 max_attempts"""
+
+    def __init__(self, original, retry_after=None):
+        super().__init__(str(original))
+        self.original = original
+        self.retry_after = retry_after
+
+
+def throttle_info(exc):
+    """判斷例外是否為限流/暫時性錯誤，回傳 (是否限流, Retry-After 秒數或 None)
+
+    優先看 HTTP 狀態碼（code / status_code），其次是狀態名稱（status）；都沒有時才在訊息中找狀態名稱，
+    不比對訊息中的數字，避免檔名、ID 之類剛好含有 429 / 503 的錯誤被當成限流。
+    """
+    code = getattr(exc, "code", None)
+    if not isinstance(code, int):
+        code = getattr(exc, "status_code", None)
+    if isinstance(code, int) and not isinstance(code, bool):
+        throttled = code in THROTTLE_STATUS
+    else:
+        status = getattr(exc, "status", None)
+        if isinstance(status, str):
+            throttled = status in THROTTLE_MARKERS
+        else:
+            throttled = re.search(r"\b(?:%s)\b" % "|".join(THROTTLE_MARKERS), str(exc)) is not None
+    retry_after = None
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if throttled and headers:
+        try:
+            retry_after = float(headers.get("retry-after") or headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            retry_after = None
+    return throttled, retry_after
+
+
+# ---- bucket 狀態（本機 / SQLite 共用同一套計算） ----
+def _new_state(max_rate, burst, now):
+    return {"tokens": float(burst), "updated": now, "rate": max_rate, "cooldown_until": 0.0, "level": 0}
+
+
+def _take(state, now, burst):
+    """嘗試取一個 token，回傳需要再等待的秒數（0 表示已取得）"""
+    if now < state["cooldown_until"]:
+        return state["cooldown_until"] - now
+    state["tokens"] = min(burst, state["tokens"] + (now - state["updated"]) * state["rate"])
+    state["updated"] = now
+    if state["tokens"] >= 1:
+        state["tokens"] -= 1
+        return 0.0
+    return (1 - state["tokens"]) / state["rate"]
+
+
+def _throttled(state, now, max_rate, retry_after):
+    if now < state["cooldown_until"]:
+        # 同一波限流的其他呼叫：只延長冷卻，不重複減半
+        if retry_after:
+            state["cooldown_until"] = max(state["cooldown_until"], now + retry_after)
+        return
+    state["rate"] = max(max_rate * MIN_RATE_RATIO, state["rate"] / 2)
+    backoff = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** state["level"])
+    state["level"] += 1
+    state["cooldown_until"] = now + (retry_after or backoff)
+    state["tokens"] = 0.0
+    state["updated"] = state["cooldown_until"]
+
+
+def _succeeded(state, max_rate):
+    state["rate"] = min(max_rate, state["rate"] + max_rate * RECOVERY_RATIO)
+    state["level"] = 0
+
+
+def _refund(state, burst):
+    state["tokens"] = min(burst, state["tokens"] + 1)
+
+
+class LocalQuota:
+    """程序內的 bucket"""
+    backend = "local"
+
+    def __init__(self, max_rate, burst):
+        self.max_rate = max_rate
+        self.burst = burst
+        self._state = _new_state(max_rate, burst, time.time())
+        self._lock = threading.Lock()
+
+    def _apply(self, fn, *args):
+        with self._lock:
+            return fn(self._state, *args)
+
+    def try_acquire(self, now):
+        return self._apply(_take, now, self.burst)
+
+    def on_throttled(self, now, retry_after=None):
+        self._apply(_throttled, now, self.max_rate, retry_after)
+
+    def on_success(self):
+        self._apply(_succeeded, self.max_rate)
+
+    def refund(self):
+        self._apply(_refund, self.burst)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._state)
+
+
+class SQLiteQuota(LocalQuota):
+    """多個 worker 共用的 bucket，狀態存在 SQLite 檔案的一列中"""
+    backend = "sqlite"
+
+    def __init__(self, path, max_rate, burst, name="gemini"):
+        self.path = path
+        self.name = name
+        self.max_rate = max_rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._conn = None       # 第一次使用時才開啟
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS quota_bucket (name TEXT PRIMARY KEY, tokens REAL, updated REAL, "
+            "rate REAL, cooldown_until REAL, level INTEGER)")
+        return conn
+
+    def _apply(self, fn, *args):
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated, rate, cooldown_until, level FROM quota_bucket WHERE name = ?",
+                    (self.name,)).fetchone()
+                if row is None:
+                    state = _new_state(self.max_rate, self.burst, time.time())
+                else:
+                    state = dict(zip(("tokens", "updated", "rate", "cooldown_until", "level"), row))
+                    state["rate"] = min(state["rate"], self.max_rate)   # 上限調低後立即生效
+                result = fn(state, *args)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO quota_bucket VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.name, state["tokens"], state["updated"], state["rate"], state["cooldown_until"],
+                     state["level"]))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return result
+
+    def snapshot(self):
+        """唯讀查詢（不開寫入交易），/metrics 與 stats() 不會和取 token 搶寫入鎖"""
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+            row = self._conn.execute(
+                "SELECT tokens, updated, rate, cooldown_until, level FROM quota_bucket WHERE name = ?",
+                (self.name,)).fetchone()
+        if row is None:
+            return _new_state(self.max_rate, self.burst, time.time())
+        state = dict(zip(("tokens", "updated", "rate", "cooldown_until", "level"), row))
+        state["rate"] = min(state["rate"], self.max_rate)
+        return state
+
+
+# ---- 排程器 ----
+class _Ticket:
+    __slots__ = ("user", "enqueued", "granted_at")
+
+    def __init__(self, user):
+        self.user = user
+        self.enqueued = time.monotonic()
+        self.granted_at = None
+
+
+class GeminiScheduler:
+    def __init__(self, quota, max_concurrent=DEFAULT_MAX_CONCURRENT, enabled=True):
+        self.quota = quota
+        self.max_concurrent = max_concurrent
+        self.enabled = enabled
+        self._queues = OrderedDict()      # user -> deque[_Ticket]，排在前面的使用者先放行
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._dispatcher = None
+        self.granted = 0
+        self.throttled = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, user=None, timeout=None, cancel=None):
+        """排隊直到輪到 user 且取得 token，回傳 ticket（呼叫結束後交給 release）
+
+        cancel 為 threading.Event，呼叫端不再需要結果時 set() 後呼叫 wake()，排隊中的呼叫會離開佇列。
+        """
+        if not self.enabled:
+            return None
+        ticket = _Ticket(user)
+        deadline = None if timeout is None else ticket.enqueued + timeout
+        with self._cond:
+            self._queues.setdefault(user, deque()).append(ticket)
+            self._ensure_dispatcher()
+            self._cond.notify_all()
+            while ticket.granted_at is None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                cancelled = cancel is not None and cancel.is_set()
+                if cancelled or (remaining is not None and remaining <= 0):
+                    queue = self._queues.get(user)
+                    if queue is not None:
+                        queue.remove(ticket)
+                        if not queue:
+                            del self._queues[user]
+                    if cancelled:
+                        raise SchedulerTimeout("呼叫端已取消")
+                    self.timeouts += 1
+                    raise SchedulerTimeout(f"排隊等待模型呼叫超過 {timeout:.0f} 秒")
+                self._cond.wait(remaining)
+            waited = ticket.granted_at - ticket.enqueued
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        metrics.observe("gemini_queue_wait_seconds", waited)
+        return ticket
+
+    def release(self, ticket, outcome="success", retry_after=None):
+        """outcome：success 慢慢調回速率、throttled 減速並冷卻、error（其他失敗）不影響速率、
+        unused（取得名額後沒有送出）退回 token
+        """
+        if ticket is None:
+            return
+        if outcome == "throttled":
+            self.quota.on_throttled(time.time(), retry_after)
+        elif outcome == "success":
+            self.quota.on_success()
+        elif outcome == "unused":
+            self.quota.refund()
+        with self._cond:
+            if outcome == "throttled":
+                self.throttled += 1
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def wake(self):
+        """讓排隊中的呼叫重新檢查取消狀態"""
+        with self._cond:
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, user=None, timeout=None, cancel=None):
+        """with scheduler.slot(user): 呼叫模型；ThrottledError 會回報給 bucket 調降速率"""
+        ticket = self.acquire(user, timeout, cancel)
+        if cancel is not None and cancel.is_set():
+            # 排到時呼叫端已經不需要結果：不送出，token 退回 bucket
+            self.release(ticket, "unused")
+            raise SchedulerTimeout("呼叫端已取消")
+        outcome, retry_after = "error", None
+        try:
+            yield ticket
+            outcome = "success"
+        except ThrottledError as e:
+            outcome, retry_after = "throttled", e.retry_after
+            raise
+        finally:
+            self.release(ticket, outcome, retry_after)
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name="gemini-scheduler", daemon=True)
+            self._dispatcher.start()
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while not self._queues or self._in_flight >= self.max_concurrent:
+                    self._cond.wait()
+            wait = self.quota.try_acquire(time.time())
+            if wait > 0:
+                time.sleep(min(wait, 1.0))
+                continue
+            with self._cond:
+                if not self._queues:
+                    self.quota.refund()     # 等待的呼叫都已逾時離開
+                    continue
+                user, queue = next(iter(self._queues.items()))
+                ticket = queue.popleft()
+                if queue:
+                    self._queues.move_to_end(user)      # 輪到下一個使用者
+                else:
+                    del self._queues[user]
+                ticket.granted_at = time.monotonic()
+                self._in_flight += 1
+                self.granted += 1
+                self._cond.notify_all()
+
+    def stats(self):
+        snapshot = self.quota.snapshot()
+        with self._cond:
+            queued = sum(len(q) for q in self._queues.values())
+            oldest = min((q[0].enqueued for q in self._queues.values() if q), default=None)
+            return {
+                "enabled": self.enabled,
+                "backend": self.quota.backend,
+                "queued": queued,
+                "queued_users": len(self._queues),
+                "oldest_wait": round(time.monotonic() - oldest, 3) if oldest is not None else 0.0,
+                "in_flight": self._in_flight,
+                "max_concurrent": self.max_concurrent,
+                "granted": self.granted,
+                "throttled": self.throttled,
+                "timeouts": self.timeouts,
+                "avg_wait": round(self.total_wait / self.granted, 3) if self.granted else 0.0,
+                "max_wait": round(self.max_wait, 3),
+                "rate_per_min": round(snapshot["rate"] * 60, 2),
+                "max_rate_per_min": round(self.quota.max_rate * 60, 2),
+                "cooldown_remaining": round(max(0.0, snapshot["cooldown_until"] - time.time()), 3),
+            }
+
+
+def create_scheduler(rpm=DEFAULT_RPM, burst=DEFAULT_BURST, max_concurrent=DEFAULT_MAX_CONCURRENT,
+                     quota_db=None, enabled=True):
+    """quota_db 為 SQLite 檔案路徑時多個 worker 共用速率上限，否則只在本程序內限制"""
+    rate = rpm / 60
+    quota = SQLiteQuota(quota_db, rate, burst) if quota_db else LocalQuota(rate, burst)
+    return GeminiScheduler(quota, max_concurrent=max_concurrent, enabled=enabled)
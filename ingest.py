@@ -0,0 +1,111 @@
+"""上傳圖片的讀取與前處理
+
+- read_limited：分段讀取上傳檔案，超過上限立即中止，不會先把整個檔案讀進記憶體
+- ingest_image：只讀標頭檢查尺寸，JPEG 以 draft 在解碼時就縮小（DCT 縮放），
+  其他格式以 reduce 整數倍縮小，再套用 EXIF 方向並把長邊限制在 max_edge
+
+解碼出來的圖片同時用於存檔、縮圖、變體快取 key 與送給 Gemini 的內容，
+所以手機拍的 5000 萬畫素照片也只會以約 2048px 的大小在系統裡流動。
+"""
+import io
+import math
+import time
+
+from PIL import Image, ImageOps
+
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024     # 單一上傳檔案上限
+MAX_LONG_EDGE = 2048                    # 存檔與送給模型的長邊上限
+MAX_SOURCE_PIXELS = 120_000_000         # 原圖畫素上限（只看標頭判斷，避免解壓縮炸彈）
+READ_CHUNK = 256 * 1024
+
+
+# 檔頭 → (副檔名, MIME type)
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png", "image/png"),
+    (b"GIF8", "gif", "image/gif"),
+)
+
+
+class UploadTooLargeError(ValueError):
+    """上傳檔案超過大小或畫素上限"""
+
+
+def read_limited(stream, max_bytes=MAX_UPLOAD_BYTES):
+    """分段讀取 stream，超過 max_bytes 時丟出 UploadTooLargeError"""
+    buf = io.BytesIO()
+    while True:
+        chunk = stream.read(READ_CHUNK)
+        if not chunk:
+            break
+        if buf.tell() + len(chunk) > max_bytes:
+            raise UploadTooLargeError(f"檔案超過 {max_bytes // (1024 * 1024)}MB 上限")
+        buf.write(chunk)
+    return buf.getvalue()
+
+
+def sniff_format(data):
+    """依檔頭判斷圖片格式，回傳 (副檔名, MIME type)；無法判斷時回傳 (None, None)"""
+    for signature, ext, mime_type in _SIGNATURES:
+        if data.startswith(signature):
+            return ext, mime_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp", "image/webp"
+    return None, None
+
+
+def encode_jpeg(img, quality=90):
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def _buffer_bytes(img):
+    return img.size[0] * img.size[1] * len(img.getbands())
+
+
+def ingest_image(data, max_edge=MAX_LONG_EDGE):
+    """bytes → (RGB Image, 統計資料)
+
+    統計資料：原始尺寸/格式、輸出尺寸、解碼毫秒數，以及依尺寸與通道數估算的最大像素緩衝區位元組數
+    （est_peak_bytes）與完整解碼的估算大小（est_full_decode_bytes）。兩者都是估計值，不是實測：
+    Pillow 的像素緩衝區不在 Python 配置器內，tracemalloc 量不到，也不含解碼器與重新取樣的暫存。
+    """
+    start = time.perf_counter()
+    img = Image.open(io.BytesIO(data))
+    source_size, source_format = img.size, img.format
+    if source_size[0] * source_size[1] > MAX_SOURCE_PIXELS:
+        raise UploadTooLargeError(f"圖片尺寸過大（{source_size[0]}x{source_size[1]}）")
+
+    # EXIF 旋轉 90 度時寬高會對調，縮放目標以長邊計算即可，不受方向影響
+    if img.format == "JPEG":
+        # 解碼時直接以 1/2、1/4、1/8 縮小；容許結果比 max_edge 小一些（至少 3/4），
+        # 換來少一級解碼，也省掉之後一次大圖重新取樣
+        # draft 要求寬高都不小於目標，目標需依原圖比例計算
+        ratio = (max_edge * 3 // 4) / max(source_size)
+        if ratio < 1:
+            img.draft("RGB", (math.ceil(source_size[0] * ratio), math.ceil(source_size[1] * ratio)))
+    img.load()
+    peak = _buffer_bytes(img)
+
+    factor = max(img.size) // max_edge
+    if factor >= 2:
+        img = img.reduce(factor)                  # 非 JPEG 先以整數倍快速縮小
+        peak = max(peak, _buffer_bytes(img))
+
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    img = ImageOps.exif_transpose(img)            # 縮小後再轉向，搬動的像素較少
+    peak = max(peak, _buffer_bytes(img))
+
+    stats = {
+        "source_format": source_format,
+        "source_size": list(source_size),
+        "size": list(img.size),
+        "decode_ms": round((time.perf_counter() - start) * 1000, 1),
+        "est_peak_bytes": peak,
+        "est_full_decode_bytes": source_size[0] * source_size[1] * 3,
+    }
+    return img, stats
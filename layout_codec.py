@@ -0,0 +1,54 @@
+"""image_info 的精簡二進位格式
+
+JSON 版（layout_version = 1）每個位置都重複 "x"/"y"/"w"/"h"/"rotate" 鍵；
+精簡版（layout_version = 2）改成 5 個 int16 欄位陣列（x 全部、y 全部……），再以 zlib 壓縮。
+w/h 通常整欄相同、rotate 範圍小，欄式排列壓縮效果很好。
+
+格式：b"CLY" + 版本(1 byte) + 位置數(uint32, little endian) + zlib(int16 LE 欄位陣列 × 5)
+"""
+import base64
+import struct
+import zlib
+
+import numpy as np
+
+LAYOUT_JSON = 1
+LAYOUT_PACKED = 2
+
+LAYOUT_FIELDS = ("x", "y", "w", "h", "rotate")
+COMPACT_MIMETYPE = "application/vnd.shape-collage.compact+json"
+
+_MAGIC = b"CLY"
+_HEADER = struct.Struct("<3sBI")
+_INT16_MIN, _INT16_MAX = -32768, 32767
+
+
+def encode_layout(image_info):
+    """image_info（dict 列表）→ bytes；數值超出 int16 時丟出 ValueError"""
+    count = len(image_info)
+    columns = np.empty((len(LAYOUT_FIELDS), count), dtype=np.int64)
+    for i, field in enumerate(LAYOUT_FIELDS):
+        columns[i] = [pos[field] for pos in image_info]
+    if count and (columns.min() < _INT16_MIN or columns.max() > _INT16_MAX):
+        raise ValueError("排版座標超出 int16 範圍，無法使用精簡格式")
+    body = zlib.compress(columns.astype("<i2").tobytes(), 6)
+    return _HEADER.pack(_MAGIC, LAYOUT_PACKED, count) + body
+
+
+def decode_columns(blob):
+    """bytes → shape (5, N) 的 int16 陣列（給不需要 dict 的呼叫端直接使用）"""
+    magic, version, count = _HEADER.unpack_from(blob)
+    if magic != _MAGIC or version != LAYOUT_PACKED:
+        raise ValueError(f"不支援的排版格式: {magic!r} v{version}")
+    raw = zlib.decompress(blob[_HEADER.size:])
+    return np.frombuffer(raw, dtype="<i2").reshape(len(LAYOUT_FIELDS), count)
+
+
+def decode_layout(blob):
+    """bytes → image_info（dict 列表，與 JSON 版相同的結構）"""
+    columns = decode_columns(blob).tolist()
+    return [dict(zip(LAYOUT_FIELDS, values)) for values in zip(*columns)]
+
+
+def layout_to_b64(blob):
+    return base64.b64encode(blob).decode("ascii")
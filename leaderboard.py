@@ -0,0 +1,102 @@
+"""排行榜：成績寫入 Leaderboard，另外維護每個拼貼的前 N 名（LeaderboardTop）
+
+讀取前 N 名只需要一次主鍵查詢；新成績只有擠進前 N 名時才更新 LeaderboardTop。
+LeaderboardTop 以 version 欄位做樂觀鎖，多個 worker 同時提交時衝突的一方重讀後再合併。
+"""
+import json
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Leaderboard, LeaderboardTop
+
+TOP_N = 10
+MAX_MERGE_RETRIES = 8
+DEFAULT_NAME = '匿名玩家'
+
+
+def _sort_key(entry):
+    return (entry['time'], entry['id'])
+
+
+def _query_top(collage_id):
+    scores = (Leaderboard.query
+                .filter_by(collage_id=collage_id)
+                .order_by(Leaderboard.time.asc(), Leaderboard.id.asc())
+                .limit(TOP_N)
+                .all())
+    return [{'id': s.id, 'name': s.name, 'time': s.time} for s in scores]
+
+
+def _public(entries):
+    return [{'name': e['name'], 'time': e['time']} for e in entries]
+
+
+def rebuild_top(collage_id):
+    """從 Leaderboard 重新計算前 N 名並覆蓋 LeaderboardTop"""
+    entries = _query_top(collage_id)
+    top = db.session.get(LeaderboardTop, collage_id)
+    if top is None:
+        db.session.add(LeaderboardTop(collage_id=collage_id, entries_json=json.dumps(entries, ensure_ascii=False),
+                                      version=1, updated_at=time.time()))
+    else:
+        top.entries_json = json.dumps(entries, ensure_ascii=False)
+        top.version += 1
+        top.updated_at = time.time()
+    db.session.commit()
+    return entries
+
+
+def get_top(collage_id):
+    """回傳前 N 名 [{'name', 'time'}]；還沒有物化結果時從 Leaderboard 建立"""
+    top = db.session.get(LeaderboardTop, collage_id)
+    if top is not None:
+        return _public(json.loads(top.entries_json))
+    if not db.session.query(Leaderboard.query.filter_by(collage_id=collage_id).exists()).scalar():
+        return []
+    try:
+        return _public(rebuild_top(collage_id))
+    except IntegrityError:
+        db.session.rollback()  # 其他請求剛好先建立了
+        return get_top(collage_id)
+
+
+def submit_scores(collage_id, scores):
+    """批次寫入成績 [{'name', 'time'}]，回傳 (前 N 名, 前 N 名是否有變動)"""
+    rows = [Leaderboard(collage_id=collage_id, name=s.get('name') or DEFAULT_NAME, time=float(s['time']))
+            for s in scores]
+    db.session.add_all(rows)
+    db.session.commit()
+    new_entries = sorted(({'id': r.id, 'name': r.name, 'time': r.time} for r in rows), key=_sort_key)
+
+    for _ in range(MAX_MERGE_RETRIES):
+        top = db.session.get(LeaderboardTop, collage_id, populate_existing=True)
+        if top is None:
+            # 第一次：直接從資料表算（剛寫入的成績已在其中）
+            try:
+                return _public(rebuild_top(collage_id)), True
+            except IntegrityError:
+                db.session.rollback()
+                continue
+
+        entries = json.loads(top.entries_json)
+        worst = entries[-1] if len(entries) >= TOP_N else None
+        known_ids = {e['id'] for e in entries}   # 重建時可能已經包含這批成績
+        qualifying = [e for e in new_entries
+                      if e['id'] not in known_ids and (worst is None or _sort_key(e) < _sort_key(worst))]
+        if not qualifying:
+            return _public(entries), False
+
+        merged = sorted(entries + qualifying, key=_sort_key)[:TOP_N]
+        result = db.session.execute(
+            db.update(LeaderboardTop)
+              .where(LeaderboardTop.collage_id == collage_id, LeaderboardTop.version == top.version)
+              .values(entries_json=json.dumps(merged, ensure_ascii=False), version=top.version + 1,
+                      updated_at=time.time())
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return _public(merged), True
+
+    # 一直衝突就以資料表為準重建
+    return _public(rebuild_top(collage_id)), True
@@ -0,0 +1,61 @@
+"""形狀遮罩快取：圓形、星形、愛心與文字遮罩只跟畫布大小（和文字）有關，畫過一次就重複使用
+
+每筆同時保留 PIL Image 與 NumPy 陣列，排版程式可直接拿陣列做索引。
+快取中的遮罩是共用的，取用端不可修改（陣列已設為唯讀）。
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class MaskCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._entries = OrderedDict()     # key -> (Image, ndarray, 佔用 bytes)
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        """取得 (Image, ndarray)；未命中時呼叫 build() 產生 PIL 遮罩並放進快取"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], entry[1]
+            self.misses += 1
+
+        # 在鎖外繪製，避免大遮罩擋住其他請求
+        mask = build()
+        arr = np.asarray(mask)
+        arr.setflags(write=False)
+        size = mask.size[0] * mask.size[1] * len(mask.getbands()) + arr.nbytes
+
+        with self._lock:
+            if key not in self._entries and size <= self.max_bytes:
+                self._entries[key] = (mask, arr, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (_, _, evicted) = self._entries.popitem(last=False)
+                    self._bytes -= evicted
+        return mask, arr
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
@@ -0,0 +1,215 @@
+"""輕量的計時與計數：各生成階段、每次模型請求、HTTP 請求的延遲分布與成功/失敗次數
+
+- timer(name, **labels) 量測一段程式的秒數，histogram 保留每個序列最近 SAMPLE_WINDOW 筆樣本，
+  輸出時算出 p50/p95/p99（Prometheus summary 格式），另外累計 _sum 與 _count
+- inc(name, value, **labels) 累加計數（次數、位元組數）
+- register_stats(prefix, fn) 把既有元件的 stats() 數值欄位輸出成 gauge
+- render() 產生 Prometheus 文字格式，給 /metrics 使用
+- 請求期間 timer 量到的時間也記在目前請求的清單中，app 可以輸出成 Server-Timing 標頭
+
+設定 METRICS=0 時 timer 回傳共用的空 context manager、inc 直接返回，幾乎沒有額外成本。
+"""
+import contextvars
+import os
+import re
+import threading
+import time
+from collections import deque
+
+SAMPLE_WINDOW = 2048                  # 每個序列保留的最近樣本數（計算分位數用）
+QUANTILES = (0.5, 0.95, 0.99)
+
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+class _Timer:
+    __slots__ = ('_metrics', '_name', '_labels', '_start', 'seconds')
+
+    def __init__(self, metrics, name, labels):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._start
+        labels = self._labels
+        if exc_type is not None:
+            labels = labels + (('outcome', 'error'),)
+        self._metrics._observe(self._name, labels, self.seconds)
+        return False
+
+
+class _Series:
+    __slots__ = ('samples', 'sum', 'count')
+
+    def __init__(self):
+        self.samples = deque(maxlen=SAMPLE_WINDOW)
+        self.sum = 0.0
+        self.count = 0
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return '{' + body + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _quantile(sorted_samples, q):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(q * len(sorted_samples)))
+    return sorted_samples[index]
+
+
+class Metrics:
+    def __init__(self, enabled=True, prefix='collage'):
+        self.enabled = enabled
+        self.prefix = prefix
+        self._histograms = {}        # name -> {label_key: _Series}
+        self._counters = {}          # name -> {label_key: float}
+        self._help = {}
+        self._stats_sources = []     # (prefix, fn)
+        self._lock = threading.Lock()
+
+    # ---- 記錄 ----
+    def timer(self, name, **labels):
+        """with metrics.timer('stage_seconds', stage='decode'): ..."""
+        if not self.enabled:
+            return _NOOP
+        return _Timer(self, name, _label_key(labels))
+
+    def observe(self, name, seconds, **labels):
+        if self.enabled:
+            self._observe(name, _label_key(labels), seconds)
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def register_stats(self, prefix, fn):
+        """fn() 回傳 dict，數值欄位會輸出成 <prefix>_<欄位> gauge"""
+        self._stats_sources.append((prefix, fn))
+
+    def _observe(self, name, key, seconds):
+        with self._lock:
+            series = self._histograms.setdefault(name, {}).get(key)
+            if series is None:
+                series = self._histograms[name][key] = _Series()
+            series.samples.append(seconds)
+            series.sum += seconds
+            series.count += 1
+        timings = _request_timings.get()
+        if timings is not None:
+            label = '_'.join(v for _, v in key) or name
+            timings.append((label, seconds))
+
+    # ---- 單一請求的 Server-Timing ----
+    def start_request(self):
+        """開始收集目前請求（context）內的計時，回傳 token 給 finish_request"""
+        return _request_timings.set([])
+
+    def finish_request(self, token):
+        """結束收集並回傳 Server-Timing 標頭內容（同名階段會合併）"""
+        timings = _request_timings.get() or []
+        _request_timings.reset(token)
+        merged = {}
+        for label, seconds in timings:
+            merged[label] = merged.get(label, 0.0) + seconds
+        return ', '.join(f'{_metric_name(label)};dur={seconds * 1000:.1f}' for label, seconds in merged.items())
+
+    # ---- 輸出 ----
+    def snapshot(self):
+        """回傳 {name: [(label_key, {p50, p95, p99, sum, count})]} 與計數，給 JSON 或測試使用"""
+        with self._lock:
+            histograms = {name: [(key, sorted(s.samples), s.sum, s.count) for key, s in series.items()]
+                          for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+        result = {'histograms': {}, 'counters': {}}
+        for name, rows in histograms.items():
+            result['histograms'][name] = [
+                (key, {**{f'p{int(q * 100)}': _quantile(samples, q) for q in QUANTILES}, 'sum': total, 'count': count})
+                for key, samples, total, count in rows
+            ]
+        for name, series in counters.items():
+            result['counters'][name] = list(series.items())
+        return result
+
+    def render(self):
+        """Prometheus 文字格式"""
+        snap = self.snapshot()
+        lines = []
+        for name, rows in sorted(snap['histograms'].items()):
+            full = f'{self.prefix}_{name}'
+            if name in self._help:
+                lines.append(f'# HELP {full} {self._help[name]}')
+            lines.append(f'# TYPE {full} summary')
+            for key, values in rows:
+                for q in QUANTILES:
+                    lines.append(f'{full}{_format_labels(key, [("quantile", q)])} {values[f"p{int(q * 100)}"]:.6f}')
+                lines.append(f'{full}_sum{_format_labels(key)} {values["sum"]:.6f}')
+                lines.append(f'{full}_count{_format_labels(key)} {values["count"]}')
+        for name, rows in sorted(snap['counters'].items()):
+            full = f'{self.prefix}_{name}'
+            if name in self._help:
+                lines.append(f'# HELP {full} {self._help[name]}')
+            lines.append(f'# TYPE {full} counter')
+            for key, value in rows:
+                lines.append(f'{full}{_format_labels(key)} {_format_value(value)}')
+        for prefix, fn in self._stats_sources:
+            try:
+                stats = fn()
+            except Exception as err:
+                lines.append(f'# {prefix} 統計取得失敗: {_escape(err)}')
+                continue
+            for field, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                full = f'{self.prefix}_{prefix}_{_metric_name(field)}'
+                lines.append(f'# TYPE {full} gauge')
+                lines.append(f'{full} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_value(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def _metric_name(text):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', str(text))
+
+
+# 全域共用；METRICS=0 時停用
+metrics = Metrics(enabled=os.getenv('METRICS', '1') != '0')
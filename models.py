@@ -1,5 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy  # 匯入 Flask-SQLAlchemy 套件，讓 Flask 可以用 ORM 操作資料庫
 from datetime import datetime           # 匯入 datetime 模組
+import json                             # 匯入 json 模組
+import os
+from layout_codec import encode_layout, decode_layout, LAYOUT_JSON, LAYOUT_PACKED  # 排版精簡格式
 
 db = SQLAlchemy()                       # 建立一個 SQLAlchemy 物件，之後會綁定到 Flask app
 
@@ -7,7 +10,9 @@ class Collage(db.Model):                # 定義拼貼資料表
     id = db.Column(db.String(128), primary_key=True)    # 拼貼 ID（時間戳）
     title = db.Column(db.String(255), nullable=True)     # 作品標題
     preview_src = db.Column(db.Text)                     # 預覽圖片路徑
-    info_json = db.Column(db.Text, nullable=False)       # 拼貼詳細資料（JSON）
+    info_json = db.Column(db.Text, nullable=False)       # 拼貼詳細資料（JSON）；精簡格式時不含 image_info
+    layout_version = db.Column(db.Integer, nullable=False, default=LAYOUT_JSON, server_default=str(LAYOUT_JSON))  # 排版格式版本
+    layout_blob = db.Column(db.LargeBinary, nullable=True)  # 精簡格式的 image_info（layout_codec）
     is_public = db.Column(db.Boolean, default=False, nullable=False)  # ✅ 新增欄位
     created_at = db.Column(db.Float, nullable=False)     # 建立時間戳
     updated_at = db.Column(db.Float, nullable=False)     # 更新時間戳
@@ -16,8 +21,41 @@ class Collage(db.Model):                # 定義拼貼資料表
     __table_args__ = (
         db.Index('idx_collages_updated_at', 'updated_at'),
         db.Index('idx_collages_is_public', 'is_public'),  # ✅ 新增索引
+        # 畫廊分頁用的覆蓋索引：條件、排序、游標與回傳欄位都在索引內，不必回表讀 info_json
+        db.Index('idx_collages_public_updated', 'is_public', 'updated_at', 'id', 'preview_src'),
     )
     
+    def set_info(self, info):
+        """儲存拼貼資訊，image_info 盡量改用精簡格式存放"""
+        info = dict(info)
+        image_info = info.pop("image_info", [])
+        try:
+            self.layout_blob = encode_layout(image_info)
+            self.layout_version = LAYOUT_PACKED
+        except ValueError:
+            info["image_info"] = image_info
+            self.layout_blob = None
+            self.layout_version = LAYOUT_JSON
+        self.info_json = json.dumps(info, ensure_ascii=False)
+
+    def get_info(self, decode_layout_blob=True):
+        """讀回完整的拼貼資訊；decode_layout_blob=False 時不解開 image_info（精簡格式才有差別）"""
+        try:
+            info = json.loads(self.info_json) if self.info_json else {}
+        except ValueError:
+            info = {}
+        if self.layout_version == LAYOUT_PACKED and self.layout_blob is not None and decode_layout_blob:
+            info["image_info"] = decode_layout(self.layout_blob)
+        return info
+
+    def file_names(self):
+        """這個拼貼用到的檔名（預覽圖、上傳原圖與 AI 生成圖、縮圖、圖集）"""
+        info = self.get_info(decode_layout_blob=False)
+        paths = [self.preview_src or '', (info.get('atlas') or {}).get('src') or '']
+        for entry in info.get('images', []):
+            paths += [entry.get('full_path') or '', entry.get('img_path') or '']
+        return {os.path.basename(p) for p in paths if p}
+
     def to_dict(self):
         # 統一使用時間戳作為 ID，不再處理 .json 後綴
         return {
@@ -30,12 +68,89 @@ class Collage(db.Model):                # 定義拼貼資料表
             'updated_at': self.updated_at
         }
 
+class PublicFile(db.Model):              # 公開拼貼用到的檔案，保留策略刪檔前逐一查詢
+    filename = db.Column(db.String(255), primary_key=True)   # 檔名（不含路徑）
+    collage_id = db.Column(db.String(128), primary_key=True)  # 拼貼 ID
+
+
+def public_file_rows(collage):
+    """新建立的拼貼若為公開，回傳要一併寫入的 PublicFile"""
+    if not collage.is_public:
+        return []
+    return [PublicFile(filename=name, collage_id=collage.id) for name in collage.file_names()]
+
+
+def sync_public_files(collage):
+    """公開狀態改變時呼叫（與狀態在同一個交易中提交）：公開時登記檔案，取消公開時移除"""
+    PublicFile.query.filter_by(collage_id=collage.id).delete(synchronize_session=False)
+    db.session.add_all(public_file_rows(collage))
+
+
+def is_public_file(filename):
+    """主鍵查詢，與公開拼貼數量無關"""
+    return db.session.query(PublicFile.filename).filter_by(filename=filename).first() is not None
+
+
+def _backfill_public_files(batch_size=500):
+    """PublicFile 是後來新增的資料表，第一次升級時依現有的公開拼貼補齊"""
+    if db.session.query(PublicFile.filename).first() is not None:
+        return
+    last_id = ''
+    while True:
+        batch = (Collage.query
+                    .filter(Collage.is_public == True, Collage.id > last_id)
+                    .order_by(Collage.id)
+                    .limit(batch_size)
+                    .all())
+        if not batch:
+            return
+        for collage in batch:
+            db.session.add_all(public_file_rows(collage))
+        last_id = batch[-1].id
+        db.session.commit()
+
+
+def upgrade_tables():
+    """db.create_all() 不會替既有資料表加欄位或索引，這裡補上後來新增的部分"""
+    columns = {c['name'] for c in db.inspect(db.engine).get_columns(Collage.__tablename__)}
+    for model in (Collage, Leaderboard):
+        for index in model.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+    with db.engine.begin() as conn:
+        if 'layout_version' not in columns:
+            conn.exec_driver_sql(f"ALTER TABLE {Collage.__tablename__} ADD COLUMN layout_version INTEGER NOT NULL DEFAULT {LAYOUT_JSON}")
+        if 'layout_blob' not in columns:
+            conn.exec_driver_sql(f"ALTER TABLE {Collage.__tablename__} ADD COLUMN layout_blob BLOB")
+    _backfill_public_files()
+
+def migrate_collage_layouts(batch_size=500):
+    """把 layout_version = 1 的資料轉成精簡格式，分批提交；回傳轉換筆數"""
+    converted = 0
+    last_id = ''
+    while True:
+        batch = (Collage.query
+                    .filter(Collage.layout_version == LAYOUT_JSON, Collage.id > last_id)
+                    .order_by(Collage.id)
+                    .limit(batch_size)
+                    .all())
+        if not batch:
+            return converted
+        for collage in batch:
+            collage.set_info(collage.get_info())
+            converted += collage.layout_version == LAYOUT_PACKED
+        last_id = batch[-1].id
+        db.session.commit()
+
 class Leaderboard(db.Model):             # 定義排行榜資料表
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)  # 主鍵，自動遞增
     collage_id = db.Column(db.Text, nullable=False)      # 拼貼 ID
     name = db.Column(db.Text, nullable=False)            # 玩家姓名
     time = db.Column(db.Float, nullable=False)           # 遊戲時間（秒）
     created_at = db.Column(db.DateTime, default=datetime.utcnow)  # 建立時間
+
+    __table_args__ = (
+        db.Index('idx_leaderboard_collage_time', 'collage_id', 'time'),  # 依拼貼查前幾名
+    )
     
     def to_dict(self):
         return {
@@ -46,6 +161,12 @@ class Leaderboard(db.Model):             # 定義排行榜資料表
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
         
+class LeaderboardTop(db.Model):          # 每個拼貼的前 N 名（由 leaderboard.py 維護的物化結果）
+    collage_id = db.Column(db.String(128), primary_key=True)  # 拼貼 ID
+    entries_json = db.Column(db.Text, nullable=False)    # 前 N 名（JSON 陣列，依時間由快到慢）
+    version = db.Column(db.Integer, nullable=False, default=1)  # 樂觀鎖版本，每次更新 +1
+    updated_at = db.Column(db.Float, nullable=False)     # 更新時間戳
+
 class Feedback(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.String(50), nullable=False)        # 回饋類型: suggestion, bug, feature, other
@@ -64,4 +185,32 @@ class Feedback(db.Model):
             'subject': self.subject,
             'message': self.message,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S')
-        }
\ No newline at end of file
+        }
+
+class CollageJob(db.Model):              # 背景拼貼生成工作
+    id = db.Column(db.String(32), primary_key=True)      # 工作 ID（uuid hex）
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued / running / done / failed
+    stage = db.Column(db.String(50), nullable=True)      # 目前進行到的階段
+    progress = db.Column(db.Integer, nullable=False, default=0)  # 進度百分比 0-100
+    images_json = db.Column(db.Text, nullable=True)      # 已完成的圖片路徑（JSON 陣列）
+    collage_id = db.Column(db.String(128), nullable=True)  # 完成後對應的拼貼 ID
+    error = db.Column(db.Text, nullable=True)            # 失敗原因
+    created_at = db.Column(db.Float, nullable=False)     # 建立時間戳
+    updated_at = db.Column(db.Float, nullable=False)     # 更新時間戳
+
+    __table_args__ = (
+        db.Index('idx_collage_jobs_status', 'status'),
+    )
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'images': json.loads(self.images_json) if self.images_json else [],
+            'collage_id': self.collage_id,
+            'error': self.error,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
+        }
@@ -0,0 +1,220 @@
+"""上傳圖片與 AI 生成圖片的保留策略
+
+不在請求中列出整個資料夾、逐檔排序，而是：
+- 啟動時掃描一次資料夾建立索引，之後新檔案由 track() 加入，不再重新列目錄
+- 索引是依修改時間排序的 heap，淘汰最舊的檔案只需 pop，攤銷 O(log n)
+- 依「最長保留時間 / 檔案數 / 總位元組數」三種上限淘汰，兩個資料夾共用同一個索引
+- 背景執行緒定期執行 sweep()，不佔用請求時間
+- 公開拼貼仍在使用的檔案永遠不刪：每個要刪的檔案在刪除前才呼叫 is_protected(檔名) 查詢，
+  受保護的檔案直接移出索引（之後不再每次 sweep 都檢查），取消公開時再由 track() 加回
+
+只管理資料夾第一層的檔案；縮圖（thumbs/）隨原圖一起刪除。圖集資料夾也交給同一個索引，
+公開拼貼的圖集同樣受保護，非公開拼貼的圖集和它用到的圖片一樣依上限淘汰。
+保護狀態在刪除當下查詢，其他 worker 或批次工具建立的公開拼貼、sweep 進行中才公開的拼貼都不會被漏掉。
+"""
+import heapq
+import os
+import threading
+import time
+
+from derivatives import THUMB_SIZES, thumb_filename, remove_derivatives
+from metrics import metrics
+
+DEFAULT_MAX_AGE = 7 * 24 * 3600     # 非公開檔案最多保留 7 天
+DEFAULT_MAX_FILES = 2000
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+MIN_AGE = 15 * 60                   # 剛寫入的檔案可能屬於進行中的工作，至少保留 15 分鐘
+
+
+class RetentionManager:
+    def __init__(self, folders, max_age=DEFAULT_MAX_AGE, max_files=DEFAULT_MAX_FILES,
+                 max_bytes=DEFAULT_MAX_BYTES, min_age=MIN_AGE, on_evict=None):
+        self.folders = [os.path.abspath(f) for f in folders]
+        self.max_age = max_age
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self.on_evict = on_evict            # on_evict(folder, filename)，例如讓變體快取移除對應項目
+        self.is_protected = lambda filename: False   # 刪除前檢查檔名是否仍被公開拼貼使用
+        self._heap = []                     # (mtime, path)
+        self._entries = {}                  # path -> (mtime, 位元組數)
+        self._unsized = set()               # 新加入、縮圖可能還沒寫完、尚未計算大小的檔案
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._loaded = False
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self.released_files = 0             # 因受保護而移出索引的檔案數
+        self.last_sweep = None
+
+    # ---- 索引 ----
+    def _file_bytes(self, path):
+        """原圖加上所有縮圖的大小"""
+        folder, filename = os.path.split(path)
+        total = 0
+        for p in [path] + [os.path.join(folder, thumb_filename(filename, s)) for s in THUMB_SIZES]:
+            try:
+                total += os.path.getsize(p)
+            except OSError:
+                pass
+        return total
+
+    def _add(self, path, mtime, size):
+        old = self._entries.get(path)
+        if old is not None:
+            self._total_bytes -= old[1]
+        if size is None:
+            self._unsized.add(path)
+            size = 0
+        self._entries[path] = (mtime, size)
+        self._total_bytes += size
+        heapq.heappush(self._heap, (mtime, path))   # 舊的 heap 項目在 pop 時發現過期就略過
+
+    def load(self):
+        """掃描一次資料夾建立索引（只在啟動時執行）"""
+        with self._lock:
+            for folder in self.folders:
+                if not os.path.isdir(folder):
+                    continue
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if not entry.is_file() or entry.name.endswith('.tmp'):
+                            continue
+                        self._add(entry.path, entry.stat().st_mtime, self._file_bytes(entry.path))
+            self._loaded = True
+
+    def track(self, path, mtime=None):
+        """新檔案寫入後呼叫；縮圖要在原圖之後產生，所以大小在 sweep 時才補算"""
+        path = os.path.abspath(path)
+        if os.path.dirname(path) not in self.folders:
+            return
+        with self._lock:
+            self._add(path, mtime or time.time(), None)
+
+    def track_names(self, filenames):
+        """依檔名把管理資料夾中的檔案加回索引（例如拼貼取消公開後）"""
+        for filename in filenames:
+            for folder in self.folders:
+                path = os.path.join(folder, filename)
+                if os.path.isfile(path):
+                    self.track(path)
+
+    def touch(self, path):
+        """檔案再次被使用（例如變體快取命中），延後淘汰；同時更新 mtime，重啟後仍有效"""
+        try:
+            os.utime(path)
+        except OSError:
+            return
+        self.track(path)
+
+    # ---- 淘汰 ----
+    def sweep(self, now=None):
+        """淘汰超過上限的檔案，回傳刪除的檔案數"""
+        if not self._loaded:
+            self.load()
+        now = now or time.time()
+
+        evicted = 0
+        with self._lock:
+            for path in self._unsized:
+                if path in self._entries:
+                    mtime, _ = self._entries[path]
+                    size = self._file_bytes(path)
+                    self._entries[path] = (mtime, size)
+                    self._total_bytes += size
+            self._unsized.clear()
+
+            while self._heap:
+                mtime, path = self._heap[0]
+                entry = self._entries.get(path)
+                if entry is None or entry[0] != mtime:
+                    heapq.heappop(self._heap)   # 已刪除或已更新的舊項目
+                    continue
+                age = now - mtime
+                over_limit = (age > self.max_age
+                              or len(self._entries) > self.max_files
+                              or self._total_bytes > self.max_bytes)
+                if not over_limit or age < self.min_age:
+                    break
+                protected = self._protected(os.path.basename(path))
+                if protected is None:
+                    break                       # 查不到保護狀態就先不刪，下次 sweep 再試
+                heapq.heappop(self._heap)
+                if protected:
+                    # 公開拼貼的檔案不歸保留策略管，移出索引也不再計入上限
+                    del self._entries[path]
+                    self._total_bytes -= entry[1]
+                    self.released_files += 1
+                    continue
+                self._remove(path, entry[1])
+                evicted += 1
+            self.last_sweep = now
+        if evicted:
+            print(f"🧹 保留策略刪除 {evicted} 個檔案")
+        return evicted
+
+    def _protected(self, filename):
+        """回傳是否受保護；查詢失敗時回傳 None"""
+        try:
+            return bool(self.is_protected(filename))
+        except Exception as err:
+            print(f"查詢檔案保護狀態失敗，這次不刪除 {filename}: {err}")
+            return None
+
+    def _remove(self, path, size):
+        folder, filename = os.path.split(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            print(f"刪除檔案失敗: {path} ({err})")
+            return
+        remove_derivatives(folder, filename)
+        del self._entries[path]
+        self._total_bytes -= size
+        self.evicted_files += 1
+        self.evicted_bytes += size
+        if self.on_evict:
+            try:
+                self.on_evict(folder, filename)
+            except Exception as err:
+                print(f"淘汰回呼失敗: {err}")
+
+    # ---- 背景排程 ----
+    def start(self, interval=300):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    with metrics.timer('stage_seconds', stage='retention_sweep'):
+                        self.sweep()
+                except Exception as err:
+                    print(f"保留策略執行失敗: {err}")
+
+        self.load()
+        self._thread = threading.Thread(target=loop, name='retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_files': self.max_files,
+                'max_bytes': self.max_bytes,
+                'max_age': self.max_age,
+                'evicted_files': self.evicted_files,
+                'evicted_bytes': self.evicted_bytes,
+                'released_files': self.released_files,
+                'last_sweep': self.last_sweep,
+            }
@@ -0,0 +1,115 @@
+"""人像剪影分割服務：SelfieSegmentation 模型只建立一次，所有請求共用
+
+- 第一次使用時才載入（或啟動時呼叫 load() 預熱），載入過程有鎖保護只會發生一次
+- mediapipe 的模型不保證可同時呼叫，推論時以鎖序列化
+- 大圖先縮小到 max_side 再推論，結果依「圖片內容雜湊 + 畫布大小」快取
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+
+class SilhouetteSegmenter:
+    def __init__(self, max_side=1024, cache_entries=32, model_selection=1):
+        self.max_side = max_side
+        self.cache_entries = cache_entries
+        self.model_selection = model_selection
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._infer_lock = threading.Lock()
+        self._cache = OrderedDict()       # (sha256, canvas_size) -> PIL 遮罩
+        self._cache_lock = threading.Lock()
+        self._created_at = time.perf_counter()
+        self.timings = {
+            'load_seconds': None,          # 載入 cv2/mediapipe 與建立模型的時間
+            'first_mask_seconds': None,    # 服務建立後到第一張剪影完成的時間
+            'last_inference_ms': None,
+            'total_inference_ms': 0.0,
+            'inferences': 0,
+            'cache_hits': 0,
+            'cache_misses': 0
+        }
+
+    def load(self):
+        """載入模型（已載入則直接返回），可在啟動時呼叫以預熱"""
+        if self._model is not None:
+            return self._model
+        with self._load_lock:
+            if self._model is None:
+                start = time.perf_counter()
+                import mediapipe as mp
+                self._model = mp.solutions.selfie_segmentation.SelfieSegmentation(model_selection=self.model_selection)
+                self.timings['load_seconds'] = time.perf_counter() - start
+                print(f"🧠 剪影模型載入完成，用時 {self.timings['load_seconds']:.2f} 秒")
+        return self._model
+
+    def close(self):
+        with self._load_lock:
+            if self._model is not None:
+                self._model.close()
+                self._model = None
+
+    def mask_for(self, path, canvas_size):
+        """回傳 canvas_size 大小的 L 模式剪影遮罩"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        key = (hashlib.sha256(data).hexdigest(), tuple(canvas_size))
+
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.timings['cache_hits'] += 1
+                return cached
+            self.timings['cache_misses'] += 1
+
+        mask = self._segment(data, path, canvas_size)
+
+        with self._cache_lock:
+            self._cache[key] = mask
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        if self.timings['first_mask_seconds'] is None:
+            self.timings['first_mask_seconds'] = time.perf_counter() - self._created_at
+        return mask
+
+    def _segment(self, data, path, canvas_size):
+        import cv2
+        import numpy as np
+
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise FileNotFoundError(f"讀不到圖片喔：{path}")
+
+        # 大圖先縮小，模型輸入本來就只有 256 左右，原尺寸推論只會浪費時間
+        h, w = img.shape[:2]
+        if max(h, w) > self.max_side:
+            scale = self.max_side / max(h, w)
+            img = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+        model = self.load()
+        start = time.perf_counter()
+        with self._infer_lock:
+            result = model.process(img_rgb)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.timings['last_inference_ms'] = elapsed_ms
+        self.timings['total_inference_ms'] += elapsed_ms
+        self.timings['inferences'] += 1
+
+        binary_mask = (result.segmentation_mask > 0.5).astype(np.uint8) * 255
+        h, w = img.shape[:2]
+        kernel_size = max(7, int(min(w, h) * 0.07) // 2 * 2 + 1)
+        blurred_mask = cv2.GaussianBlur(binary_mask, (kernel_size, kernel_size), 0)
+        smooth_mask = (blurred_mask > 127).astype(np.uint8) * 255
+        return Image.fromarray(smooth_mask).resize(canvas_size).convert("L")
+
+    def stats(self):
+        with self._cache_lock:
+            stats = dict(self.timings)
+            stats['loaded'] = self._model is not None
+            stats['cached_masks'] = len(self._cache)
+        return stats
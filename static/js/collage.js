@@ -227,6 +227,7 @@ document.getElementById("uploadForm")?.addEventListener("submit", function(event
             }
             return res.json();
         })
+        .then(job => waitForCollageJob(job.status_url))
         .then(data => {
             console.log('✅ 拼貼生成成功');
             
@@ -248,6 +249,33 @@ document.getElementById("uploadForm")?.addEventListener("submit", function(event
 });
 
 
+// ✅ 輪詢背景生成工作，完成時回傳拼貼資料
+function waitForCollageJob(statusUrl, interval = 2000) {
+    return new Promise((resolve, reject) => {
+        const poll = () => {
+            fetch(statusUrl)
+                .then(res => res.json())
+                .then(job => {
+                    const progressBar = document.getElementById('progressBar');
+                    if (progressBar && job.progress) {
+                        const current = parseFloat(progressBar.style.width) || 0;
+                        progressBar.style.width = Math.max(current, job.progress) + '%';
+                    }
+
+                    if (job.status === 'done') {
+                        resolve(job);
+                    } else if (job.status === 'failed' || job.error) {
+                        reject(new Error(job.error || '生成失敗'));
+                    } else {
+                        setTimeout(poll, interval);
+                    }
+                })
+                .catch(reject);
+        };
+        poll();
+    });
+}
+
 // ✅ 新增：生成完成通知
 function showGenerationCompleteToast() {
     let toastContainer = document.querySelector('.toast-container');
@@ -26,13 +26,37 @@ function initMasonry(grid, gutter) {
     grid.classList.add('visible');
 }
 
-// 載入拼貼畫廊
+// 建立畫廊卡片
+function createGalleryCards(items) {
+    const cards = [];
+    items.forEach(item => {
+        if (!item?.preview_src) return;
+        
+        const card = document.createElement('div');
+        card.className = 'grid-item mb-4';
+        card.style.setProperty('--rand', (Math.random() * 1.6 + 0.2).toFixed(2));
+        
+        card.innerHTML = `
+            <div class="gallery-card" data-collage-id="${item.id}">
+                <img src="${item.preview_src}" alt="拼貼 ${item.timestamp}" loading="lazy">
+                <div class="gallery-label">拼貼 ${item.timestamp}</div>
+            </div>`;
+        
+        // 點擊進入遊戲
+        card.addEventListener('click', () => loadCollageGame(item.id));
+        cards.push(card);
+    });
+    return cards;
+}
+
+// 載入拼貼畫廊（第一頁）
 async function fetchGallery() {
     const grid = document.getElementById('grid');
     if (!grid) return;
     
     // ✅ 移除已載入檢查，每次都重新載入
     grid.dataset.galleryLoaded = 'false'; // 重置狀態
+    grid.dataset.nextCursor = '';
     
     try {
         const res = await fetch('/gallery');
@@ -47,31 +71,14 @@ async function fetchGallery() {
         }
         
         const frag = document.createDocumentFragment();
-        
-        data.items.forEach(item => {
-            if (!item?.preview_src) return;
-            
-            const card = document.createElement('div');
-            card.className = 'grid-item mb-4';
-            card.style.setProperty('--rand', (Math.random() * 1.6 + 0.2).toFixed(2));
-            
-            card.innerHTML = `
-                <div class="gallery-card" data-collage-id="${item.id}">
-                    <img src="${item.preview_src}" alt="拼貼 ${item.timestamp}" loading="lazy">
-                    <div class="gallery-label">拼貼 ${item.timestamp}</div>
-                </div>`;
-            
-            // 點擊進入遊戲
-            card.addEventListener('click', () => loadCollageGame(item.id));
-            frag.appendChild(card);
-        });
-        
+        createGalleryCards(data.items).forEach(card => frag.appendChild(card));
         grid.appendChild(frag);
         
         imagesLoaded(grid, () => {
             const gutter = updateLayout(grid);
             initMasonry(grid, gutter);
             grid.dataset.galleryLoaded = 'true';
+            grid.dataset.nextCursor = data.next_cursor || '';
         });
 
     } catch(err) {
@@ -80,6 +87,37 @@ async function fetchGallery() {
     }
 }
 
+// 捲動到底部時載入下一頁
+async function fetchMoreGallery() {
+    const grid = document.getElementById('grid');
+    if (!grid || !grid.dataset.nextCursor || grid.dataset.galleryLoading === 'true') return;
+    
+    grid.dataset.galleryLoading = 'true';
+    try {
+        const res = await fetch(`/gallery?cursor=${encodeURIComponent(grid.dataset.nextCursor)}`);
+        const data = await res.json();
+        const cards = createGalleryCards(data.items || []);
+        
+        cards.forEach(card => grid.appendChild(card));
+        imagesLoaded(cards, () => {
+            if (grid._msn) grid._msn.appended(cards);
+            grid.dataset.nextCursor = data.next_cursor || '';
+            grid.dataset.galleryLoading = 'false';
+        });
+    } catch(err) {
+        console.error('fetchMoreGallery error:', err);
+        grid.dataset.galleryLoading = 'false';
+    }
+}
+
+window.addEventListener('scroll', () => {
+    const grid = document.getElementById('grid');
+    if (!grid || grid.offsetParent === null || grid.dataset.galleryLoaded !== 'true') return;
+    if (window.innerHeight + window.scrollY >= document.body.offsetHeight - 600) {
+        fetchMoreGallery();
+    }
+}, { passive: true });
+
 // 載入拼貼遊戲
 async function loadCollageGame(collageId) {
     try {
@@ -155,6 +193,7 @@ window.addEventListener('resize', () => {
 // 匯出函數
 window.GalleryModule = {
     fetchGallery,
+    fetchMoreGallery,
     updateLayout,
     loadCollageGame
 };
\ No newline at end of file
@@ -303,6 +303,7 @@ const CollageModule = {
                 h: pos.h,
                 rotate: pos.rotate,
                 src: imgData.img_path,
+                uv: imgData.uv,
                 is_target: imgData.is_target
             };
         });
@@ -310,26 +311,42 @@ const CollageModule = {
         // 顯示目標照片
         const targetPhoto = document.getElementById('targetPhoto');
         if (targetPhoto && targetImg) {
-            targetPhoto.src = targetImg.img_path;
+            targetPhoto.src = targetImg.full_path || targetImg.img_path;
             targetPhoto.style.display = 'block';
         }
 
         // 渲染拼貼圖
         const fragment = document.createDocumentFragment();
-        let loadedCount = 0;
+        const atlas = data.atlas && merged.every(imgData => imgData.uv) ? data.atlas : null;
+
+        if (atlas) {
+            // 🧩 有圖集時所有小圖共用同一張圖片，只需等它載入一次
+            const sheet = new Image();
+            sheet.addEventListener('load', () => this.onLoaded());
+            sheet.addEventListener('error', () => this.onLoaded());
+            sheet.src = atlas.src;
+
+            merged.forEach(imgData => {
+                const tile = this.createAtlasElement(imgData, atlas);
+                if (imgData.is_target) state.targetEl = tile;
+                fragment.appendChild(tile);
+            });
+        } else {
+            let loadedCount = 0;
 
-        merged.forEach(imgData => {
-            const img = this.createImageElement(imgData);
-            if (imgData.is_target) state.targetEl = img;
+            merged.forEach(imgData => {
+                const img = this.createImageElement(imgData);
+                if (imgData.is_target) state.targetEl = img;
 
-            const handleLoad = () => {
-                if (++loadedCount === merged.length) this.onLoaded();
-            };
+                const handleLoad = () => {
+                    if (++loadedCount === merged.length) this.onLoaded();
+                };
 
-            img.addEventListener('load', handleLoad);
-            img.addEventListener('error', handleLoad);
-            fragment.appendChild(img);
-        });
+                img.addEventListener('load', handleLoad);
+                img.addEventListener('error', handleLoad);
+                fragment.appendChild(img);
+            });
+        }
 
         DOM.canvasBox.appendChild(fragment);
         state.currentCollageId = collageId;
@@ -361,6 +378,29 @@ const CollageModule = {
         return img;
     },
 
+    // 以圖集的一塊作為背景，外觀與 createImageElement 相同
+    createAtlasElement(imgData, atlas) {
+        const tile = document.createElement('div');
+        tile.className = 'photo';
+        tile.dataset.isTarget = imgData.is_target;
+
+        const uv = imgData.uv;
+        const posX = atlas.width > uv.w ? uv.x / (atlas.width - uv.w) * 100 : 0;
+        const posY = atlas.height > uv.h ? uv.y / (atlas.height - uv.h) * 100 : 0;
+
+        tile.style.cssText = `
+            left: ${(imgData.x / GameConfig.BASE_SIZE * 100)}%;
+            top: ${(imgData.y / GameConfig.BASE_SIZE * 100)}%;
+            width: ${(imgData.w / GameConfig.BASE_SIZE * 100)}%;
+            height: ${(imgData.h / GameConfig.BASE_SIZE * 100)}%;
+            --angle: ${imgData.rotate}deg;
+            background-image: url("${atlas.src}");
+            background-size: ${atlas.width / uv.w * 100}% ${atlas.height / uv.h * 100}%;
+            background-position: ${posX}% ${posY}%;
+        `;
+        return tile;
+    },
+
     onLoaded() {
         state.collageLoaded = true;
         if (state.active && state.hintsLeft > 0 && !state.hintCooldown) {
@@ -0,0 +1,181 @@
+"""資料庫設定與寫入批次器
+
+configure_database(app)：
+- 預設使用 SQLite（instance/photos.db），每個連線開啟 WAL、synchronous=NORMAL 與 busy_timeout，
+  讀寫可以同時進行，遇到鎖會等待而不是立刻丟出 "database is locked"
+- 設定 DATABASE_URL（例如 postgresql://...）時改用伺服器型資料庫，只調整連線池
+
+WriteBatcher：把高頻率、低價值的小寫入（排行榜成績、回饋表單）集中到背景執行緒，
+累積一小批後用一個交易寫入，減少 commit 次數與鎖的競爭。
+"""
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from sqlalchemy import event
+
+from models import db
+
+DEFAULT_SQLITE_URI = 'sqlite:///photos.db'
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')            # 讀取不會被寫入擋住
+    cursor.execute('PRAGMA synchronous=NORMAL')          # WAL 模式下 NORMAL 已足夠安全，commit 少一次 fsync
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.close()
+
+
+def configure_database(app, url=None):
+    """依設定決定資料庫與連線池，需在 db.init_app(app) 之前呼叫"""
+    url = url or app.config.get('DATABASE_URL') or DEFAULT_SQLITE_URI
+    pool_size = app.config.get('DB_POOL_SIZE', 8)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    if url.startswith('sqlite'):
+        # SQLite 同一時間只有一個寫入者，連線池只需涵蓋請求執行緒 + 背景 worker
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': pool_size,
+            'max_overflow': pool_size,
+            'pool_timeout': 10,
+            'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000, 'check_same_thread': False},
+        }
+    else:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': pool_size,
+            'max_overflow': pool_size * 2,
+            'pool_timeout': 10,
+            'pool_pre_ping': True,      # 伺服器端斷線後自動重連
+            'pool_recycle': 1800,
+        }
+
+
+def enable_sqlite_pragmas(app):
+    """在 db.init_app(app) 之後呼叫，讓之後建立的每個 SQLite 連線都套用 PRAGMA"""
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', _set_sqlite_pragmas)
+
+
+class WriteBatcher:
+    """背景批次寫入
+
+    submit(key, item) 回傳 Future；背景執行緒每 max_delay 秒或累積 max_batch 筆時，
+    依 key 分組呼叫 flush(key, items)（在 app context 中執行），回傳值交給該組每個 Future；
+    per_item=True 時 flush 回傳與 items 等長的 list，每個 Future 拿到自己那一筆的結果。
+    不需要結果的呼叫端（write-behind）可以直接忽略 Future。
+    建立時不啟動執行緒：由 start()（create_app 中）或第一次 submit() 啟動。
+    """
+
+    def __init__(self, app, flush, max_batch=100, max_delay=0.05, name='db-writer', per_item=False):
+        self.app = app
+        self.flush = flush
+        self.per_item = per_item
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.flushed_items = 0
+        self.flushed_batches = 0
+        self.name = name
+        self._queue = queue.Queue()
+        self._stopped = False
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None or self._stopped:
+                return
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def submit(self, key, item):
+        future = Future()
+        if self._stopped:
+            future.set_exception(RuntimeError('寫入批次器已關閉'))
+            return future
+        if self._thread is None:
+            self.start()
+        self._queue.put((key, item, future))
+        return future
+
+    def close(self, timeout=5):
+        """送出剩下的資料並停止背景執行緒"""
+        if self._stopped:
+            return
+        self._stopped = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'pending': self._queue.qsize(),
+            'flushed_items': self.flushed_items,
+            'flushed_batches': self.flushed_batches,
+            'avg_batch': self.flushed_items / self.flushed_batches if self.flushed_batches else 0.0,
+        }
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None)   # 留給下一輪結束迴圈
+                break
+            batch.append(entry)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            groups = OrderedDict()
+            for key, item, future in batch:
+                groups.setdefault(key, []).append((item, future))
+
+            with self.app.app_context():
+                for key, entries in groups.items():
+                    try:
+                        result = self.flush(key, [item for item, _ in entries])
+                    except Exception as e:
+                        db.session.rollback()
+                        print(f"批次寫入失敗 ({key}): {e}")
+                        if len(entries) > 1:
+                            self._flush_each(key, entries)
+                        else:
+                            entries[0][1].set_exception(e)
+                        continue
+                    results = result if self.per_item else [result] * len(entries)
+                    for (_, future), value in zip(entries, results):
+                        future.set_result(value)
+            self.flushed_items += len(batch)
+            self.flushed_batches += 1
+
+    def _flush_each(self, key, entries):
+        """整批失敗時逐筆重試，只有有問題的那筆拿到例外，同批其他請求不受影響"""
+        for item, future in entries:
+            try:
+                result = self.flush(key, [item])
+                future.set_result(result[0] if self.per_item else result)
+            except Exception as e:
+                db.session.rollback()
+                future.set_exception(e)
@@ -0,0 +1,98 @@
+"""AI 變體圖片快取：以「正規化後的上傳圖片 + prompt」的雜湊為 key，對應 static/generated_images 裡已存在的檔案
+
+同一張照片換形狀或格數重新排版時，不必再呼叫一次 Gemini。
+快取只記錄檔名，淘汰時不會刪檔（舊拼貼可能還在引用這些圖片）；檔案被清掉時查詢會自動視為未命中。
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def variant_cache_key(img, prompt):
+    """img 為已轉成 RGB 的 PIL Image；用像素內容而不是原始檔案 bytes，避免 EXIF/壓縮差異造成 key 不同"""
+    h = hashlib.sha256()
+    h.update(f"{img.mode}:{img.size[0]}x{img.size[1]}:".encode())
+    h.update(img.tobytes())
+    h.update(b"\0")
+    h.update(prompt.encode("utf-8"))
+    return h.hexdigest()
+
+
+class VariantCache:
+    def __init__(self, output_dir, max_entries=200, index_path=None):
+        self.output_dir = output_dir
+        self.max_entries = max_entries
+        self.index_path = index_path      # 設定後會把索引寫成 JSON，重啟後仍可命中
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()     # key -> [filename, ...]，依最近使用排序
+        self._lock = threading.Lock()
+        self._load()
+
+    def get(self, key):
+        """命中時回傳檔名列表；任何一個檔案已不存在就當作未命中並移除該筆"""
+        with self._lock:
+            filenames = self._entries.get(key)
+            if filenames is not None and not all(
+                    os.path.isfile(os.path.join(self.output_dir, f)) for f in filenames):
+                del self._entries[key]
+                filenames = None
+            if filenames is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(filenames)
+
+    def put(self, key, filenames):
+        with self._lock:
+            self._entries[key] = list(filenames)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._save()
+
+    def discard_files(self, filenames):
+        """外部清除檔案時呼叫，移除引用到這些檔案的快取項目"""
+        removed = set(filenames)
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if removed.intersection(v)]:
+                del self._entries[key]
+            self._save()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+    def _load(self):
+        if not self.index_path or not os.path.isfile(self.index_path):
+            return
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                for key, filenames in json.load(f):
+                    self._entries[key] = filenames
+        except Exception as e:
+            print(f"讀取變體快取索引失敗: {e}")
+
+    def _save(self):
+        if not self.index_path:
+            return
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(list(self._entries.items()), f)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            print(f"寫入變體快取索引失敗: {e}")